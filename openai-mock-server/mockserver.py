@@ -0,0 +1,634 @@
+# Local stand-in for the OpenAI/Azure OpenAI API, for benchmarking and load testing without using any quota.
+#
+# Requires only the Python standard library. Start with:
+#   python3 mockserver.py --port 10001 --latency 2.0 --rate-limit-probability 0.1
+#
+# and point the client to http://localhost:10001 (works both as azure_endpoint for AzureOpenAI and as base_url for OpenAI).
+#
+# Supported calls:
+#  - chat.completions: the last user message is echoed back as the answer (or "{}" when JSON output is requested),
+#    which is enough for passing the subtitle validation of otula-whisper. With "stream": true the answer is sent as
+#    server-sent chunks, word by word. Prompt caching is simulated: the leading messages repeated from earlier calls are
+#    reported as cached tokens (usage.prompt_tokens_details.cached_tokens).
+#  - files: upload, retrieve, list and delete
+#  - vector stores: create, retrieve, files (add, list, delete) and file batches (create, retrieve, list files)
+#  - assistants: create, retrieve and update
+#  - threads, messages and runs: runs complete after the configured latency with a mock answer citing a file of the assistant's vector store,
+#    streamed runs ("stream": true) send the answer as server-sent events, word by word during the configured latency
+#  - GET /mock/stats: counters of handled, rate limited and failed requests
+#
+# The state (files, vector stores, assistants and threads) is kept in memory only.
+#
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 10001
+DEFAULT_LATENCY = 1.0 # base latency of each call, in seconds
+DEFAULT_JITTER = 0.0 # random extra latency of each call, 0..JITTER seconds
+DEFAULT_RETRY_AFTER = 1 # value of the Retry-After header given with 429 responses, in seconds
+CHARACTERS_PER_TOKEN = 4 # rough estimate used for the reported token usage
+PROMPT_CACHE_MIN_TOKENS = 1024 # like the real service, prompt prefixes shorter than this are not cached
+PROMPT_CACHE_INCREMENT_TOKENS = 128 # the cached part of the prompt is reported in increments of this
+PATH_PREFIX_PATTERN = re.compile(r'^/(openai|v1)(?=/)') # azure and openai base paths, removed before routing
+MULTIPART_FILENAME_PATTERN = re.compile(rb'filename="([^"]*)"')
+MULTIPART_PURPOSE_PATTERN = re.compile(rb'name="purpose"\r\n\r\n([^\r]*)')
+STREAM_CHUNK_PATTERN = re.compile(r'\S+\s*') # a streamed answer is split into words
+
+
+#
+# Server-sent events returned by a handler instead of a JSON object, list of (delay in seconds, event name or None, data),
+# data is sent as JSON or as is if it is a string
+#
+class EventStream(list):
+    pass
+
+
+#
+# Simulated behaviour of the server, can be changed while the server is running
+#
+class MockConfig:
+    # latency is used for chat completions and as the duration of assistant runs, other calls are answered immediately
+    def __init__(self, latency=DEFAULT_LATENCY, jitter=DEFAULT_JITTER, rate_limit_probability=0.0, failure_probability=0.0, requests_per_minute=0, retry_after=DEFAULT_RETRY_AFTER):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability # probability of a random 429 response
+        self.failure_probability = failure_probability # probability of a random 500 response
+        self.requests_per_minute = requests_per_minute # if > 0, requests exceeding this rate get 429 responses
+        self.retry_after = retry_after
+
+
+#
+# In-memory objects of the files, vector stores, assistants and threads APIs
+#
+class MockState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.vector_stores = {}
+        self.vector_store_files = {} # vector store id => list of file ids
+        self.file_batches = {}
+        self.assistants = {}
+        self.threads = {}
+        self.messages = {} # thread id => list of messages, oldest first
+        self.runs = {}
+        self.prompt_prefixes = set() # hashes of the message prefixes of chat completions, for simulating prompt caching
+
+    def create_id(self, prefix):
+        return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+#
+# Sliding window request counter used for simulating the requests-per-minute quota
+#
+class RateLimiter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timestamps = []
+
+    def allow(self, requests_per_minute):
+        if requests_per_minute <= 0:
+            return True
+        now = time.time()
+        with self.lock:
+            self.timestamps = [t for t in self.timestamps if now - t < 60]
+            if len(self.timestamps) >= requests_per_minute:
+                return False
+            self.timestamps.append(now)
+            return True
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, config=None):
+        super().__init__((host, port), MockRequestHandler)
+        self.config = config if config is not None else MockConfig()
+        self.state = MockState()
+        self.rate_limiter = RateLimiter()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "rate_limited": 0, "failed": 0}
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    #
+    # Start serving in a background thread, use when running the server inside another program (e.g. a benchmark)
+    #
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass # do not print every request
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def route(self, method):
+        path = PATH_PREFIX_PATTERN.sub('', self.path.split('?')[0])
+        if method == "GET" and path == "/mock/stats":
+            self.send_json(200, self.server.get_stats())
+            return
+        body = self.read_body()
+        for route_method, pattern, handler in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                if self.simulate_service(handler in LATENCY_HANDLERS):
+                    with self.server.state.lock:
+                        code, data = handler(self, self.server.state, body, *match.groups())
+                    if isinstance(data, EventStream):
+                        self.send_events(data) # sent outside the lock, the events are delayed
+                    else:
+                        self.send_json(code, data)
+                return
+        self.send_error_json(404, f"Not found: {method} {path}")
+
+    #
+    # Simulates latency, rate limits and failures
+    #
+    # @return True if the request should be answered normally, False if an error response was already sent
+    #
+    def simulate_service(self, with_latency):
+        config = self.server.config
+        self.server.count("requests")
+        if not self.server.rate_limiter.allow(config.requests_per_minute) or random.random() < config.rate_limit_probability:
+            self.server.count("rate_limited")
+            self.send_error_json(429, "Rate limit exceeded (simulated).", {"Retry-After": str(config.retry_after)})
+            return False
+        if with_latency:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if random.random() < config.failure_probability:
+            self.server.count("failed")
+            self.send_error_json(500, "Internal server error (simulated).")
+            return False
+        self.server.count("completed")
+        return True
+
+    def chat_completion(self, state, body):
+        body = self.parse_json(body)
+        messages = body.get("messages", [])
+        user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            content = "{}"
+        else:
+            content = user_messages[-1] if user_messages else ""
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // CHARACTERS_PER_TOKEN
+        completion_tokens = len(content) // CHARACTERS_PER_TOKEN
+        cached_tokens = self.get_cached_tokens(state, messages)
+        if body.get("stream"):
+            return 200, self.chat_completion_chunks(body, content)
+        return 200, {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        }
+
+    #
+    # Simulates prompt caching: the tokens of the longest sequence of leading messages seen in an earlier call are
+    # reported as cached, if there are at least PROMPT_CACHE_MIN_TOKENS of them
+    #
+    # @return number of cached prompt tokens
+    #
+    def get_cached_tokens(self, state, messages):
+        cached_tokens = 0
+        characters = 0
+        prefix = hashlib.sha256()
+        for message in messages:
+            prefix.update(json.dumps([message.get("role"), message.get("content")]).encode('utf-8'))
+            characters += len(message.get("content") or "")
+            key = prefix.hexdigest()
+            if key in state.prompt_prefixes:
+                cached_tokens = characters // CHARACTERS_PER_TOKEN
+            else:
+                state.prompt_prefixes.add(key)
+        if cached_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return cached_tokens - cached_tokens % PROMPT_CACHE_INCREMENT_TOKENS
+
+    #
+    # @return the answer as chat completion chunks, the latency has already passed before the first chunk
+    #
+    def chat_completion_chunks(self, body, content):
+        chunk_id = f"chatcmpl-mock-{uuid.uuid4().hex}"
+        def chunk(delta, finish_reason=None):
+            return {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]}
+        words = STREAM_CHUNK_PATTERN.findall(content)
+        events = EventStream([(0, None, chunk({"role": "assistant", "content": ""}))])
+        events.extend((0.01, None, chunk({"content": word})) for word in words)
+        events.append((0, None, chunk({}, "stop")))
+        events.append((0, None, "[DONE]"))
+        return events
+
+    #
+    # Files
+    #
+    def create_file(self, state, body):
+        filename = MULTIPART_FILENAME_PATTERN.search(body)
+        purpose = MULTIPART_PURPOSE_PATTERN.search(body)
+        file = {
+            "id": state.create_id("file"),
+            "object": "file",
+            "bytes": len(body),
+            "created_at": int(time.time()),
+            "filename": filename.group(1).decode('utf-8', 'replace') if filename else "upload",
+            "purpose": purpose.group(1).decode('utf-8', 'replace') if purpose else "assistants",
+            "status": "processed"
+        }
+        state.files[file["id"]] = file
+        return 200, file
+
+    def list_files(self, state, body):
+        return 200, self.list_response(list(state.files.values()))
+
+    def retrieve_file(self, state, body, file_id):
+        if file_id not in state.files:
+            return self.not_found(file_id)
+        return 200, state.files[file_id]
+
+    def delete_file(self, state, body, file_id):
+        if state.files.pop(file_id, None) is None:
+            return self.not_found(file_id)
+        return 200, {"id": file_id, "object": "file", "deleted": True}
+
+    #
+    # Vector stores
+    #
+    def create_vector_store(self, state, body):
+        body = self.parse_json(body)
+        vector_store = {"id": state.create_id("vs"), "object": "vector_store", "created_at": int(time.time()), "name": body.get("name"), "status": "completed", "usage_bytes": 0, "metadata": {}}
+        state.vector_stores[vector_store["id"]] = vector_store
+        state.vector_store_files[vector_store["id"]] = list(body.get("file_ids") or [])
+        return 200, self.vector_store_object(state, vector_store["id"])
+
+    def retrieve_vector_store(self, state, body, vector_store_id):
+        if vector_store_id not in state.vector_stores:
+            return self.not_found(vector_store_id)
+        return 200, self.vector_store_object(state, vector_store_id)
+
+    def vector_store_object(self, state, vector_store_id):
+        count = len(state.vector_store_files[vector_store_id])
+        return dict(state.vector_stores[vector_store_id], file_counts={"in_progress": 0, "completed": count, "failed": 0, "cancelled": 0, "total": count})
+
+    def vector_store_file_object(self, vector_store_id, file_id):
+        return {"id": file_id, "object": "vector_store.file", "created_at": int(time.time()), "vector_store_id": vector_store_id, "status": "completed", "usage_bytes": 0, "last_error": None}
+
+    def create_vector_store_file(self, state, body, vector_store_id):
+        body = self.parse_json(body)
+        if vector_store_id not in state.vector_stores or body.get("file_id") not in state.files:
+            return self.not_found(vector_store_id)
+        state.vector_store_files[vector_store_id].append(body["file_id"])
+        return 200, self.vector_store_file_object(vector_store_id, body["file_id"])
+
+    def list_vector_store_files(self, state, body, vector_store_id):
+        if vector_store_id not in state.vector_stores:
+            return self.not_found(vector_store_id)
+        return 200, self.list_response([self.vector_store_file_object(vector_store_id, f) for f in state.vector_store_files[vector_store_id]])
+
+    def delete_vector_store_file(self, state, body, vector_store_id, file_id):
+        if file_id not in state.vector_store_files.get(vector_store_id, []):
+            return self.not_found(file_id)
+        state.vector_store_files[vector_store_id].remove(file_id)
+        return 200, {"id": file_id, "object": "vector_store.file.deleted", "deleted": True}
+
+    def create_file_batch(self, state, body, vector_store_id):
+        body = self.parse_json(body)
+        if vector_store_id not in state.vector_stores:
+            return self.not_found(vector_store_id)
+        file_ids = [f for f in body.get("file_ids", []) if f in state.files]
+        failed = len(body.get("file_ids", [])) - len(file_ids)
+        state.vector_store_files[vector_store_id].extend(file_ids)
+        batch = {
+            "id": state.create_id("vsfb"),
+            "object": "vector_store.file_batch",
+            "created_at": int(time.time()),
+            "vector_store_id": vector_store_id,
+            "status": "completed",
+            "file_counts": {"in_progress": 0, "completed": len(file_ids), "failed": failed, "cancelled": 0, "total": len(file_ids) + failed},
+            "file_ids": file_ids
+        }
+        state.file_batches[batch["id"]] = batch
+        return 200, self.file_batch_object(batch)
+
+    def file_batch_object(self, batch):
+        return {k: v for k, v in batch.items() if k != "file_ids"}
+
+    def retrieve_file_batch(self, state, body, vector_store_id, batch_id):
+        if batch_id not in state.file_batches:
+            return self.not_found(batch_id)
+        return 200, self.file_batch_object(state.file_batches[batch_id])
+
+    def list_file_batch_files(self, state, body, vector_store_id, batch_id):
+        if batch_id not in state.file_batches:
+            return self.not_found(batch_id)
+        return 200, self.list_response([self.vector_store_file_object(vector_store_id, f) for f in state.file_batches[batch_id]["file_ids"]])
+
+    #
+    # Assistants
+    #
+    def create_assistant(self, state, body):
+        body = self.parse_json(body)
+        assistant = {
+            "id": state.create_id("asst"),
+            "object": "assistant",
+            "created_at": int(time.time()),
+            "name": body.get("name"),
+            "description": body.get("description"),
+            "model": body.get("model", "mock"),
+            "instructions": body.get("instructions"),
+            "tools": body.get("tools", []),
+            "tool_resources": body.get("tool_resources") or {},
+            "metadata": {}
+        }
+        state.assistants[assistant["id"]] = assistant
+        return 200, assistant
+
+    def retrieve_assistant(self, state, body, assistant_id):
+        if assistant_id not in state.assistants:
+            return self.not_found(assistant_id)
+        return 200, state.assistants[assistant_id]
+
+    def update_assistant(self, state, body, assistant_id):
+        if assistant_id not in state.assistants:
+            return self.not_found(assistant_id)
+        state.assistants[assistant_id].update({k: v for k, v in self.parse_json(body).items() if k != "assistant_id"})
+        return 200, state.assistants[assistant_id]
+
+    #
+    # Threads, messages and runs
+    #
+    def create_thread(self, state, body):
+        thread = {"id": state.create_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}, "tool_resources": {}}
+        state.threads[thread["id"]] = thread
+        state.messages[thread["id"]] = []
+        return 200, thread
+
+    def message_object(self, state, thread_id, role, text, annotations=None, run_id=None, assistant_id=None):
+        return {
+            "id": state.create_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": text, "annotations": annotations or []}}],
+            "assistant_id": assistant_id,
+            "run_id": run_id,
+            "attachments": [],
+            "status": "completed",
+            "metadata": {}
+        }
+
+    def create_message(self, state, body, thread_id):
+        body = self.parse_json(body)
+        if thread_id not in state.threads:
+            return self.not_found(thread_id)
+        content = body.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        message = self.message_object(state, thread_id, body.get("role", "user"), content or "")
+        state.messages[thread_id].append(message)
+        return 200, message
+
+    def list_messages(self, state, body, thread_id):
+        if thread_id not in state.threads:
+            return self.not_found(thread_id)
+        return 200, self.list_response(list(reversed(state.messages[thread_id]))) # newest first, as in the actual API
+
+    def create_run(self, state, body, thread_id):
+        body = self.parse_json(body)
+        if thread_id not in state.threads or body.get("assistant_id") not in state.assistants:
+            return self.not_found(thread_id)
+        config = self.server.config
+        run = {
+            "id": state.create_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": body["assistant_id"],
+            "status": "queued",
+            "model": state.assistants[body["assistant_id"]]["model"],
+            "instructions": "",
+            "tools": [],
+            "last_error": None,
+            "completes_at": time.time() + config.latency + random.uniform(0, config.jitter)
+        }
+        state.runs[run["id"]] = run
+        if body.get("stream"):
+            return 200, self.run_events(state, run)
+        return 200, self.run_object(run)
+
+    #
+    # Completes the run immediately and returns its events, the answer deltas are spread over the run duration
+    #
+    def run_events(self, state, run):
+        duration = run["completes_at"] - time.time()
+        events = EventStream([(0, "thread.run.created", self.run_object(run))])
+        run["status"] = "in_progress"
+        events.append((0, "thread.run.in_progress", self.run_object(run)))
+        message = self.complete_run(state, run)
+        if message is None:
+            events.append((duration, "thread.run.failed", self.run_object(run)))
+            events.append((0, "done", "[DONE]"))
+            return events
+        events.append((0, "thread.message.created", dict(message, status="in_progress", content=[])))
+        text = message["content"][0]["text"]
+        chunks = STREAM_CHUNK_PATTERN.findall(text["value"][:text["annotations"][0]["start_index"]] if text["annotations"] else text["value"])
+        for index, chunk in enumerate(chunks):
+            delay = duration / 2 if index == 0 else duration / 2 / len(chunks) # first token after half of the duration
+            events.append((delay, "thread.message.delta", self.message_delta(message, {"value": chunk})))
+        for annotation in text["annotations"]:
+            events.append((0, "thread.message.delta", self.message_delta(message, {"value": annotation["text"], "annotations": [dict(annotation, index=0)]})))
+        events.append((0, "thread.message.completed", message))
+        events.append((0, "thread.run.completed", self.run_object(run)))
+        events.append((0, "done", "[DONE]"))
+        return events
+
+    def message_delta(self, message, text):
+        return {"id": message["id"], "object": "thread.message.delta", "delta": {"content": [{"index": 0, "type": "text", "text": text}]}}
+
+    def retrieve_run(self, state, body, thread_id, run_id):
+        run = state.runs.get(run_id)
+        if run is None:
+            return self.not_found(run_id)
+        if run["status"] in ("queued", "in_progress"):
+            if time.time() >= run["completes_at"]:
+                self.complete_run(state, run)
+            else:
+                run["status"] = "in_progress"
+        return 200, self.run_object(run)
+
+    def run_object(self, run):
+        return {k: v for k, v in run.items() if k != "completes_at"}
+
+    #
+    # @return the answer message or None if the run failed
+    #
+    def complete_run(self, state, run):
+        if random.random() < self.server.config.failure_probability:
+            run["status"] = "failed"
+            run["last_error"] = {"code": "server_error", "message": "Run failed (simulated)."}
+            return None
+        questions = [m for m in state.messages[run["thread_id"]] if m["role"] == "user"]
+        question = questions[-1]["content"][0]["text"]["value"] if questions else ""
+        text = f"Mock answer to: {question}"
+        annotations = []
+        file_id = self.cited_file_id(state, run["assistant_id"])
+        if file_id is not None:
+            marker = "【0:0†source】"
+            annotations.append({"type": "file_citation", "text": marker, "start_index": len(text), "end_index": len(text) + len(marker), "file_citation": {"file_id": file_id}})
+            text += marker
+        message = self.message_object(state, run["thread_id"], "assistant", text, annotations, run["id"], run["assistant_id"])
+        state.messages[run["thread_id"]].append(message)
+        run["status"] = "completed"
+        return message
+
+    #
+    # @return a random file from the vector stores of the given assistant, or None if there are no files
+    #
+    def cited_file_id(self, state, assistant_id):
+        tool_resources = state.assistants[assistant_id].get("tool_resources") or {}
+        vector_store_ids = (tool_resources.get("file_search") or {}).get("vector_store_ids") or []
+        file_ids = [f for v in vector_store_ids for f in state.vector_store_files.get(v, []) if f in state.files]
+        return random.choice(file_ids) if file_ids else None
+
+    def list_response(self, data):
+        return {"object": "list", "data": data, "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None, "has_more": False}
+
+    def not_found(self, object_id):
+        return 404, {"error": {"message": f"No such object: {object_id}", "type": "invalid_request_error", "code": "404"}}
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length < 1:
+            return b''
+        return self.rfile.read(length)
+
+    def parse_json(self, body):
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def send_json(self, code, data, headers=None):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    #
+    # Sends the events of an EventStream
+    #
+    def send_events(self, events):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close') # the length is not known, the end of the stream is marked by closing the connection
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for delay, event, data in events:
+                if delay > 0:
+                    time.sleep(delay)
+                lines = f"event: {event}\n" if event is not None else ""
+                lines += f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+                self.wfile.write(lines.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # client stopped reading
+
+    def send_error_json(self, code, message, headers=None):
+        self.send_json(code, {"error": {"message": message, "type": "mock_error", "code": str(code)}}, headers)
+
+
+ID = r'([^/]+)'
+ROUTES = [ # (method, path pattern, handler)
+    ("POST", r'(?:/deployments/[^/]+)?/chat/completions', MockRequestHandler.chat_completion),
+    ("POST", r'/files', MockRequestHandler.create_file),
+    ("GET", r'/files', MockRequestHandler.list_files),
+    ("GET", rf'/files/{ID}', MockRequestHandler.retrieve_file),
+    ("DELETE", rf'/files/{ID}', MockRequestHandler.delete_file),
+    ("POST", r'/vector_stores', MockRequestHandler.create_vector_store),
+    ("GET", rf'/vector_stores/{ID}', MockRequestHandler.retrieve_vector_store),
+    ("POST", rf'/vector_stores/{ID}/files', MockRequestHandler.create_vector_store_file),
+    ("GET", rf'/vector_stores/{ID}/files', MockRequestHandler.list_vector_store_files),
+    ("DELETE", rf'/vector_stores/{ID}/files/{ID}', MockRequestHandler.delete_vector_store_file),
+    ("POST", rf'/vector_stores/{ID}/file_batches', MockRequestHandler.create_file_batch),
+    ("GET", rf'/vector_stores/{ID}/file_batches/{ID}', MockRequestHandler.retrieve_file_batch),
+    ("GET", rf'/vector_stores/{ID}/file_batches/{ID}/files', MockRequestHandler.list_file_batch_files),
+    ("POST", r'/assistants', MockRequestHandler.create_assistant),
+    ("GET", rf'/assistants/{ID}', MockRequestHandler.retrieve_assistant),
+    ("POST", rf'/assistants/{ID}', MockRequestHandler.update_assistant),
+    ("POST", r'/threads', MockRequestHandler.create_thread),
+    ("POST", rf'/threads/{ID}/messages', MockRequestHandler.create_message),
+    ("GET", rf'/threads/{ID}/messages', MockRequestHandler.list_messages),
+    ("POST", rf'/threads/{ID}/runs', MockRequestHandler.create_run),
+    ("GET", rf'/threads/{ID}/runs/{ID}', MockRequestHandler.retrieve_run)
+]
+LATENCY_HANDLERS = (MockRequestHandler.chat_completion,) # handlers which are delayed by the configured latency, runs are delayed by their own completion time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock server for the OpenAI/Azure OpenAI API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="base latency of each call, in seconds")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER, help="random extra latency of each call, in seconds")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="probability of a random 429 response")
+    parser.add_argument("--failure-probability", type=float, default=0.0, help="probability of a random 500 response")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="simulated quota, 0 for unlimited")
+    parser.add_argument("--retry-after", type=int, default=DEFAULT_RETRY_AFTER, help="Retry-After header of 429 responses, in seconds")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.rate_limit_probability, args.failure_probability, args.requests_per_minute, args.retry_after)
+    server = MockOpenAIServer(args.host, args.port, config)
+    print(f"Mock OpenAI server listening at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
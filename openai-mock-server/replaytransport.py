@@ -0,0 +1,116 @@
+# Record/replay of OpenAI API calls on the HTTP level, for deterministic load testing.
+#
+# Requires:
+#  - pip install httpx (installed with openai)
+#
+# In record mode all requests are passed to the actual service and the responses are appended to a cassette file
+# (JSON lines). In replay mode the responses are read from the cassette and no network connection is made. Requests are
+# matched by method, path and body (query parameters such as the api-version are ignored), repeated requests (e.g. polling
+# the status of a run) are answered in the recorded order, repeating the last response when the recording runs out.
+#
+# Usage (the examples create the client like this when OPENAI_CASSETTE_MODE is set):
+#   client = OpenAI(api_key=..., http_client=replaytransport.create_http_client("record", "calls.jsonl"))
+#
+import base64
+import hashlib
+import json
+import threading
+import time
+import httpx
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+RECORDED_HEADERS = ('content-type', 'retry-after') # response headers stored in the cassette
+
+
+#
+# @return key used for matching the request with a recorded response
+#
+def request_key(request):
+    body = request.read()
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json') and body:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode('utf-8') # ignore differences in key order and whitespace
+        except ValueError:
+            pass
+    elif 'boundary=' in content_type:
+        boundary = content_type.split('boundary=')[1].split(';')[0].strip('"')
+        body = body.replace(boundary.encode('utf-8'), b'BOUNDARY') # boundaries are random for each upload
+    return f"{request.method} {request.url.path} {hashlib.sha256(body).hexdigest()}"
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, cassette_path, transport=None):
+        self.cassette_path = cassette_path
+        self.transport = transport if transport is not None else httpx.HTTPTransport()
+        self.lock = threading.Lock()
+
+    def handle_request(self, request):
+        key = request_key(request)
+        start_time = time.time()
+        response = self.transport.handle_request(request)
+        content = response.read()
+        elapsed = time.time() - start_time
+        entry = {
+            "key": key,
+            "status": response.status_code,
+            "headers": {h: response.headers[h] for h in RECORDED_HEADERS if h in response.headers},
+            "body": base64.b64encode(content).decode('ascii'),
+            "elapsed": elapsed
+        }
+        with self.lock:
+            with open(self.cassette_path, 'a') as file:
+                file.write(json.dumps(entry) + "\n")
+        return httpx.Response(response.status_code, headers=entry["headers"], content=content, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    #
+    # @param cassette_path the cassette file created in record mode
+    # @param latency_scale multiplier for the recorded latency, 0 to answer immediately, 1 to simulate the recorded latency
+    #
+    def __init__(self, cassette_path, latency_scale=0.0):
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.entries = {} # key => list of recorded responses, in the recorded order
+        self.positions = {} # key => index of the next response to replay
+        with open(cassette_path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], []).append(entry)
+
+    def handle_request(self, request):
+        key = request_key(request)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                print(f"No recorded response for request: {request.method} {request.url.path}")
+                return httpx.Response(404, json={"error": {"message": f"No recorded response for: {request.method} {request.url.path}", "type": "replay_error", "code": "404"}}, request=request)
+            position = self.positions.get(key, 0)
+            entry = entries[min(position, len(entries) - 1)]
+            self.positions[key] = position + 1
+        if self.latency_scale > 0:
+            time.sleep(entry["elapsed"] * self.latency_scale)
+        return httpx.Response(entry["status"], headers=entry["headers"], content=base64.b64decode(entry["body"]), request=request)
+
+
+#
+# Creates the http client for the OpenAI/AzureOpenAI clients (http_client parameter)
+#
+# @param mode MODE_RECORD or MODE_REPLAY
+# @param cassette_path the cassette file
+# @param latency_scale only used in replay mode, see ReplayTransport
+#
+def create_http_client(mode, cassette_path, latency_scale=0.0):
+    if mode == MODE_RECORD:
+        transport = RecordingTransport(cassette_path)
+    elif mode == MODE_REPLAY:
+        transport = ReplayTransport(cassette_path, latency_scale)
+    else:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    return httpx.Client(transport=transport, timeout=httpx.Timeout(600.0, connect=5.0))
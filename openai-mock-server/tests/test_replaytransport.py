@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import pytest
+httpx = pytest.importorskip("httpx")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import replaytransport
+
+
+#
+# Transport answering each request with the next of the given responses
+#
+class SequenceTransport(httpx.BaseTransport):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def handle_request(self, request):
+        self.requests.append(request)
+        status, body = self.responses.pop(0)
+        return httpx.Response(status, json=body, headers={"retry-after": "1"} if status == 429 else {})
+
+
+def test_json_body_key_ignores_key_order_and_query():
+    first = httpx.Request("POST", "https://example.com/v1/chat/completions?api-version=1", content=b'{"model": "a", "messages": []}', headers={"content-type": "application/json"})
+    second = httpx.Request("POST", "https://example.com/v1/chat/completions?api-version=2", content=b'{"messages":[],"model":"a"}', headers={"content-type": "application/json"})
+    other = httpx.Request("POST", "https://example.com/v1/chat/completions", content=b'{"messages":[],"model":"b"}', headers={"content-type": "application/json"})
+    assert replaytransport.request_key(first) == replaytransport.request_key(second)
+    assert replaytransport.request_key(first) != replaytransport.request_key(other)
+
+def test_multipart_key_ignores_the_boundary():
+    def upload(boundary):
+        body = f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n\r\ndata\r\n--{boundary}--\r\n'.encode('utf-8')
+        return httpx.Request("POST", "https://example.com/v1/files", content=body, headers={"content-type": f"multipart/form-data; boundary={boundary}"})
+    assert replaytransport.request_key(upload("abc123")) == replaytransport.request_key(upload("def456"))
+
+def test_recorded_responses_are_replayed_in_order(tmp_path):
+    cassette = str(tmp_path / "calls.jsonl")
+    service = SequenceTransport([(429, {"error": "busy"}), (200, {"status": "queued"}), (200, {"status": "completed"})])
+    with httpx.Client(transport=replaytransport.RecordingTransport(cassette, service)) as client:
+        assert client.get("https://example.com/v1/runs/1").status_code == 429
+        assert client.get("https://example.com/v1/runs/1").json() == {"status": "queued"}
+        assert client.get("https://example.com/v1/runs/1").json() == {"status": "completed"}
+    with open(cassette, 'r') as file:
+        assert len([json.loads(line) for line in file]) == 3
+
+    with httpx.Client(transport=replaytransport.ReplayTransport(cassette)) as client:
+        response = client.get("https://example.com/v1/runs/1")
+        assert response.status_code == 429 and response.headers["retry-after"] == "1"
+        assert client.get("https://example.com/v1/runs/1").json() == {"status": "queued"}
+        assert client.get("https://example.com/v1/runs/1").json() == {"status": "completed"}
+        assert client.get("https://example.com/v1/runs/1").json() == {"status": "completed"} # the last response is repeated
+        assert client.get("https://example.com/v1/runs/2").status_code == 404
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        replaytransport.create_http_client("live", "calls.jsonl")
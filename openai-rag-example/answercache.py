@@ -0,0 +1,150 @@
+# Cache for the answers of the assistant, so that repeated questions are answered without running the assistant again.
+#
+# Requires only the Python standard library.
+#
+# Questions are first matched exactly after normalization (case, punctuation and whitespace are ignored). Optionally,
+# a question can also be matched with a similar cached question using TF-IDF weighted cosine similarity of the words.
+# The cached answers are valid only for the vector store version they were created with, and expire after a time.
+#
+# Usage:
+#   cache = AnswerCache(1000, 24 * 60 * 60, 0.9)
+#   cache.set_version(filesearch.sync_vector_store(...))
+#   answer = cache.get(query)
+#   if answer is None:
+#       answer = filesearch.run_assistant(...)
+#       cache.put(query, answer)
+#
+import collections
+import math
+import re
+import threading
+import time
+import unicodedata
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+#
+# @return the query in lower case with punctuation and extra whitespace removed
+#
+def normalize(query):
+    return " ".join(WORD_PATTERN.findall(unicodedata.normalize('NFKC', query).casefold()))
+
+
+class AnswerCache:
+    #
+    # @param max_size maximum number of cached answers, the least recently used answers are dropped first
+    # @param ttl time to live of the answers, in seconds
+    # @param similarity_threshold minimum cosine similarity (0..1) for using the answer of a similar question, or None to use exact matches only
+    #
+    def __init__(self, max_size, ttl, similarity_threshold=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = collections.OrderedDict() # normalized query => (expiration time, word counts, answer), least recently used first
+        self.document_frequency = collections.Counter() # word => number of cached queries containing the word
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    #
+    # Sets the vector store version, the cached answers are dropped if the version changes
+    #
+    def set_version(self, version):
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    print(f"Vector store version changed from {self.version} to {version}, dropping {len(self.entries)} cached answers.")
+                self._clear()
+                self.version = version
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.entries.clear()
+        self.document_frequency.clear()
+
+    #
+    # @return the cached answer for the query or a similar query, or None if not found
+    #
+    def get(self, query):
+        key = normalize(query)
+        now = time.time()
+        with self.lock:
+            self._remove_expired(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if self.similarity_threshold is not None and key:
+                similar_key, similarity = self._find_similar(collections.Counter(key.split()))
+                if similar_key is not None and similarity >= self.similarity_threshold:
+                    print(f"Using the cached answer of a similar question (similarity {similarity:.2f}): {similar_key}")
+                    self.entries.move_to_end(similar_key)
+                    self.hits += 1
+                    self.similar_hits += 1
+                    return self.entries[similar_key][2]
+            self.misses += 1
+            return None
+
+    #
+    # @param query the question
+    # @param answer the answer to cache, any value
+    # @param version the vector store version the answer was created with, the answer is not cached if the version has changed since
+    #
+    def put(self, query, answer, version=None):
+        key = normalize(query)
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self._remove(key)
+            words = collections.Counter(key.split())
+            self.entries[key] = (time.time() + self.ttl, words, answer)
+            self.document_frequency.update(words.keys())
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "version": self.version, "hits": self.hits, "similar_hits": self.similar_hits, "misses": self.misses}
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.document_frequency.subtract(entry[1].keys())
+            for word in entry[1]:
+                if self.document_frequency[word] <= 0:
+                    del self.document_frequency[word]
+
+    def _remove_expired(self, now):
+        for key in [k for k, entry in self.entries.items() if entry[0] < now]:
+            self._remove(key)
+
+    #
+    # @return tuple of (most similar cached query or None, its cosine similarity)
+    #
+    def _find_similar(self, words):
+        document_count = len(self.entries) + 1 # the new query is counted as a document, so that unknown words get the highest weight
+        def weights(counts):
+            return {w: c * (math.log(document_count / (1 + self.document_frequency.get(w, 0))) + 1) for w, c in counts.items()}
+        def norm(vector):
+            return math.sqrt(sum(v * v for v in vector.values()))
+
+        query_vector = weights(words)
+        query_norm = norm(query_vector)
+        best_key = None
+        best_similarity = 0.0
+        for key, entry in self.entries.items():
+            if not words.keys() & entry[1].keys():
+                continue
+            vector = weights(entry[1])
+            similarity = sum(v * vector.get(w, 0.0) for w, v in query_vector.items()) / (query_norm * norm(vector))
+            if similarity > best_similarity:
+                best_key = key
+                best_similarity = similarity
+        return best_key, best_similarity
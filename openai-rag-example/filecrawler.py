@@ -1,10 +1,19 @@
 #
 # Requires:
-#  - pip install pymupdf
+#  - pip install pymupdf (PyPDF2 also works but is slower), see ../pdf-text-extractor
 #
 
+import concurrent.futures
+import json
 import os
-import fitz  # PyMuPD
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pdf-text-extractor'))
+import pdfextract
+
+PDF_TEXT_INDEX_FILE = ".pdf_text_index.json" # cache of the text-presence scan results, keyed by (path, size, mtime)
+PDF_SCAN_MAX_WORKERS = None # number of processes used for scanning the PDFs, None for the number of CPUs
+PDF_SCAN_CHUNK_SIZE = 16 # number of files given to a worker process at once
 
 def collect_files_with_suffixes(directory, *suffixes):
     """
@@ -27,35 +36,113 @@ def collect_files_with_suffixes(directory, *suffixes):
     
     return file_list
 
-def filter_pdfs_without_text(file_paths):
-    processed_list = []
+def pdf_contains_text(file_path):
+    """
+    Checks whether the given PDF contains any text. Run in the worker processes of filter_pdfs_without_text.
 
-    for file_path in file_paths:
-        # Check if the file is a PDF
-        if not file_path.lower().endswith('.pdf'):
-            continue  # Skip non-PDF files
+    Parameters:
+    file_path (str): The PDF file to check.
 
-        try:
-            # Open the PDF
-            doc = fitz.open(file_path)
-            contains_text = False
-
-            # Check each page for text
-            for page_num in range(doc.page_count):
-                page = doc.load_page(page_num)
-                text = page.get_text("text")
-                if text.strip():  # If any text is found, mark as containing text
-                    contains_text = True
-                    break
-
-            # If the PDF contains text, keep it; otherwise, remove it and print the name
-            if contains_text:
-                processed_list.append(file_path)
-            else:
-                print(f"Removing: {os.path.basename(file_path)} (contains only images)")
+    Returns:
+    tuple: (contains_text, error), contains_text is None if the file could not be processed.
+    """
+    try:
+        return pdfextract.contains_text(file_path), None # the pages are checked only until the first text is found
+    except Exception as e:
+        return None, str(e)
+
+def extract_pdf_pages(file_path):
+    """
+    Extracts the text of each page of the given PDF. Run in the worker processes of localsearch.LocalIndex.
+
+    Parameters:
+    file_path (str): The PDF file to read.
+
+    Returns:
+    tuple: (pages, error), pages is a list of the page texts, or None if the file could not be processed.
+    """
+    try:
+        return pdfextract.extract_pages(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+def load_pdf_text_index(index_path):
+    try:
+        with open(index_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable PDF text index {index_path}: {e}")
+        return {}
 
-        except Exception as e:
+def save_pdf_text_index(index_path, index):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(tmp_path, index_path)
+
+def filter_pdfs_without_text(file_paths, index_path=PDF_TEXT_INDEX_FILE, max_workers=PDF_SCAN_MAX_WORKERS):
+    """
+    Filters out PDFs which do not contain any text (e.g. scanned image-only PDFs) and non-PDF files.
+
+    The PDFs are scanned in a process pool and the results are stored in an on-disk index keyed by
+    (path, size, mtime), so only new or changed files are scanned again on the next call.
+
+    Parameters:
+    file_paths (list): The files to filter.
+    index_path (str): The index file, or None to disable the index.
+    max_workers (int): Number of worker processes, None for the number of CPUs.
+
+    Returns:
+    list: The PDFs containing text, in the original order.
+    """
+    start_time = time.time()
+    index = load_pdf_text_index(index_path) if index_path else {}
+    pdf_paths = [f for f in file_paths if f.lower().endswith('.pdf')] # Skip non-PDF files
+    results = {}
+    to_scan = []
+
+    for file_path in pdf_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
             print(f"Error processing file {file_path}: {e}")
+            continue
+        key = [stat.st_size, stat.st_mtime_ns]
+        entry = index.get(file_path)
+        if entry is not None and entry["key"] == key and entry.get("error") is None:
+            results[file_path] = entry
+        else:
+            to_scan.append((file_path, key))
+
+    if to_scan:
+        print(f"Scanning {len(to_scan)} new or changed PDFs ({len(results)} found in the index)...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=pdfextract.get_mp_context(), initializer=pdfextract.pool_initializer) as executor:
+            scanned = executor.map(pdf_contains_text, [file_path for file_path, key in to_scan], chunksize=PDF_SCAN_CHUNK_SIZE)
+            for (file_path, key), (contains_text, error) in zip(to_scan, scanned):
+                results[file_path] = {"key": key, "contains_text": contains_text, "error": error}
+                if error is not None:
+                    print(f"Error processing file {file_path}: {error}")
+                elif not contains_text:
+                    print(f"Removing: {os.path.basename(file_path)} (contains only images)")
+
+    # If the PDF contains text, keep it; otherwise, remove it
+    processed_list = [f for f in pdf_paths if f in results and results[f]["contains_text"]]
+    print(f"Filtered {len(pdf_paths)} PDFs in {time.time() - start_time} seconds, {len(pdf_paths) - len(processed_list)} removed.")
+
+    if index_path and to_scan:
+        for file_path, entry in results.items():
+            if entry.get("error") is None:
+                index[file_path] = entry
+            else:
+                index.pop(file_path, None) # failed files are scanned again on the next call
+        for file_path in [f for f in index if f not in results and not os.path.exists(f)]: # forget deleted files
+            del index[file_path]
+        try:
+            save_pdf_text_index(index_path, index)
+        except OSError as e:
+            print(f"Failed to save PDF text index {index_path}: {e}")
 
     return processed_list
 
@@ -0,0 +1,59 @@
+# Index for finding the local files matching the citations of the assistant (which contain only the filename).
+#
+# Requires only the Python standard library.
+#
+# The index is immutable, create a new index when the list of files changes. Lookups:
+#  - exact filename: dictionary lookup
+#  - end of the path (e.g. a partial filename or "subdirectory/file.pdf"): binary search in the sorted reversed paths
+#  - any other part of the path: linear scan, used only if the other lookups find nothing
+#
+import bisect
+import os
+
+
+class FileIndex:
+    #
+    # @param file_paths list of file paths, the lookups return the paths in the same order
+    #
+    def __init__(self, file_paths):
+        self.file_paths = list(file_paths)
+        self.by_filename = {} # filename => list of indexes in file_paths
+        for index, path in enumerate(self.file_paths):
+            self.by_filename.setdefault(os.path.basename(path), []).append(index)
+        self.reversed_paths = sorted((path[::-1], index) for index, path in enumerate(self.file_paths)) # for suffix searches
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    #
+    # @param query filename or part of a path
+    # @param only_first if True, only the first match is returned
+    # @return list of paths containing the query, if some paths have the query as their filename or end with it, only those are returned
+    #
+    def find(self, query, only_first=False):
+        if not query:
+            return []
+        indexes = self.by_filename.get(query)
+        if indexes is None:
+            indexes = self.find_suffix(query)
+        if not indexes:
+            indexes = [index for index, path in enumerate(self.file_paths) if query in path]
+        else:
+            indexes = sorted(indexes)
+        if only_first:
+            indexes = indexes[:1]
+        return [self.file_paths[index] for index in indexes]
+
+    #
+    # @return indexes of the paths ending with the suffix, unordered
+    #
+    def find_suffix(self, suffix):
+        prefix = suffix[::-1]
+        start = bisect.bisect_left(self.reversed_paths, (prefix,))
+        indexes = []
+        for position in range(start, len(self.reversed_paths)):
+            reversed_path, index = self.reversed_paths[position]
+            if not reversed_path.startswith(prefix):
+                break
+            indexes.append(index)
+        return indexes
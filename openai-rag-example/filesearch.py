@@ -13,23 +13,94 @@
 # 3. Install the required packages:
 #     pip install openai
 #
-from openai import AzureOpenAI, OpenAI
+from openai import AzureOpenAI, OpenAI, NotFoundError
+import os
 import sys
 import time
 import json
-import contextlib
+import hashlib
+import threading
+import concurrent.futures
+import collections
 
 
-AZURE_API_KEY="YOUR AZURE API KEY"
+AZURE_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY", "YOUR AZURE API KEY")
 AZURE_API_VERSION = "2024-07-01-preview"
-AZURE_ENDPOINT = "YOUR AZURE END POINT"
+AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "YOUR AZURE END POINT")
 MODEL_ENGINE = "gpt-4o-mini"
-OPENAI_API_KEY = "YOUR OPENAI KEY"
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR OPENAI KEY")
+# The client created by create_client(), the settings can also be given as environment variables with the same names:
+#   OPENAI_CLIENT_BACKEND = "azure", "openai" or "mock" (local mock server, see openai-mock-server directory)
+#   OPENAI_MOCK_ENDPOINT  = address of the mock server
+#   OPENAI_CASSETTE_MODE  = None, "record" (record the api calls to OPENAI_CASSETTE_FILE) or "replay" (answer the api calls from OPENAI_CASSETTE_FILE)
+OPENAI_CLIENT_BACKEND = "azure"
+OPENAI_MOCK_ENDPOINT = "http://127.0.0.1:10001"
+OPENAI_CASSETTE_MODE = None
+OPENAI_CASSETTE_FILE = "openai_cassette.jsonl"
+MOCK_SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openai-mock-server')
 VECTOR_STORE_MAX_BATCH_SIZE = 500
+FILE_HASH_BLOCK_SIZE = 1024 * 1024 # block size used when computing file content hashes
+VECTOR_STORE_UPLOAD_WORKERS = 16 # number of concurrent file uploads, each upload keeps one file open
+VECTOR_STORE_UPLOAD_MAX_RETRY = 3 # how many times an individual file upload or attach is tried
+VECTOR_STORE_UPLOAD_RETRY_DELAY = 5 # delay before retrying a failed upload, multiplied by the attempt number, in seconds
+VECTOR_STORE_BATCH_POLL_INTERVAL = 5 # how often the status of the file batches is checked, in seconds
+VECTOR_STORE_BATCH_MAX_WAIT = 30 * 60 # a file batch still in progress after this long (or whose status could not be checked VECTOR_STORE_UPLOAD_MAX_RETRY times in a row) is cancelled and its files are attached individually, in seconds
+VECTOR_STORE_PROGRESS_INTERVAL = 100 # print upload progress after every this many files
+RUN_POLL_INTERVAL = 1 # how often the status of a non-streamed assistant run is checked, in seconds
+FILE_NAME_CACHE_SIZE = 100000 # maximum number of file id => filename mappings kept in memory for resolving citations
+FILE_NAME_CACHE_TTL = 24 * 60 * 60 # how long a file id => filename mapping is kept, in seconds
 VECTOR_STORE_NAME = "Name of your vector storage."
 ASSISTANT_NAME = "Name of you assistant."
 ASSISTANT_INSTRUCTIONS = "You are a secretary. Use your knowledge base to answer questions about events, topics, discussions and decissions made during meetings. Answer only based on the given files. If the requested information does not exist in the files, report that information is not available. Answer in the language of the user query. ALWAYS include file citations."
 
+# thread-safe LRU cache with expiring entries
+#
+class LRUCache:
+    #
+    # @param max_size maximum number of entries, the least recently used entries are dropped first
+    # @param ttl time to live of the entries, in seconds
+    #
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # key => (expiration time, value), least recently used first
+
+    # @return the value or None if not found or expired
+    #
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        expires = time.time() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+file_name_cache = LRUCache(FILE_NAME_CACHE_SIZE, FILE_NAME_CACHE_TTL) # file id => filename, used for resolving citations
+
 # create or retrieve an assistant
 #
 # @param client the client to use
@@ -67,9 +138,6 @@ def create_assistant(client, assistant_id):
 # @return vector store or None on error
 #
 def create_vector_store(client, vector_store_id, file_paths):
-    import time
-    import sys
-    
     start_time = time.time()
 
     vector_store = None
@@ -86,94 +154,391 @@ def create_vector_store(client, vector_store_id, file_paths):
 
     add_files_to_vector_store(client, vector_store, file_paths)
 
-    print(f"Vector store created in {time.time() - start_time} seconds. Id: {vector_store.id}")
+    if vector_store is not None:
+        print(f"Vector store created in {time.time() - start_time} seconds. Id: {vector_store.id}")
 
     return vector_store
 
 # add files into a vector store
-#  
+#
+# The files are uploaded individually using VECTOR_STORE_UPLOAD_WORKERS concurrent uploads, so that at most that many
+# files are open at once. Every time VECTOR_STORE_MAX_BATCH_SIZE files have been uploaded, they are attached to the
+# vector store as a file batch while the uploads continue. Finally the status of all batches is polled, and the files
+# which failed to attach are retried individually.
+#
 # @param client the client to use
-# @param vector_store_id if given, this store is retrieved, if None, a new one is created
+# @param vector_store the vector store to add the files to
 # @param file_paths an array of files to add to the vector store or None if no files to add
+# @param on_progress optional function(uploaded, total, failed) called after each upload
+# @return dict of file path => file id for the files added to the vector store
 #
-import contextlib
-import time
-
-def add_files_to_vector_store(client, vector_store, file_paths):
+def add_files_to_vector_store(client, vector_store, file_paths, on_progress=None):
+    added = {}
     if vector_store is not None and file_paths is not None:
         start_time = time.time()
 
         print(f"Adding {len(file_paths)} files to vector store, id: {vector_store.id}")
 
-        file_paths_lists = split_list(file_paths, VECTOR_STORE_MAX_BATCH_SIZE) # the client will not handle file lists larger than 500 files in one go
-
-        for fp in file_paths_lists:
-            batch_start_time = time.time()
+        uploaded = {} # file id => path
+        batches = []
+        pending_ids = []
+        progress = UploadProgress(len(file_paths), start_time, on_progress)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=VECTOR_STORE_UPLOAD_WORKERS) as executor:
+            futures = {executor.submit(upload_file, client, path): path for path in file_paths}
+            for future in concurrent.futures.as_completed(futures):
+                file_id = future.result()
+                progress.update(file_id is not None)
+                if file_id is None:
+                    continue
+                uploaded[file_id] = futures[future]
+                pending_ids.append(file_id)
+                if len(pending_ids) == VECTOR_STORE_MAX_BATCH_SIZE: # the client will not handle file lists larger than 500 files in one go
+                    batches.append(create_file_batch(client, vector_store, pending_ids))
+                    pending_ids = []
+        if pending_ids:
+            batches.append(create_file_batch(client, vector_store, pending_ids))
+
+        for file_id in wait_file_batches(client, vector_store, batches):
+            added[uploaded[file_id]] = file_id
+        for file_id in set(uploaded) - set(added.values()): # do not leave unused files in the storage
             try:
-                # Ready the files for upload to OpenAI
-                with contextlib.ExitStack() as stack:
-                    # This allows multiple files to be opened and closed automatically after the block
-                    file_streams = [stack.enter_context(open(path, "rb")) for path in fp]
-
-                    # Use the upload and poll SDK helper to upload the files, add them to the vector store,
-                    # and poll the status of the file batch for completion.
-                    file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-                        vector_store_id=vector_store.id, files=file_streams
-                    )
+                client.files.delete(file_id)
+            except Exception as e:
+                print(f"Error occurred while deleting file {file_id}: {str(e)}")
 
-                print(f"Batch processed in {time.time() - batch_start_time} seconds.")
+        print(f"All batches processed in {time.time() - start_time} seconds, {len(added)} of {len(file_paths)} files added.")
+    return added
 
-                # You can print the status and the file counts of the batch to see the result of this operation.
-                print(file_batch.status)
-                print(file_batch.file_counts)
+# prints the progress of the uploads every VECTOR_STORE_PROGRESS_INTERVAL files
+#
+class UploadProgress:
+    def __init__(self, total, start_time, on_progress=None):
+        self.total = total
+        self.start_time = start_time
+        self.on_progress = on_progress
+        self.done = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def update(self, success):
+        with self.lock:
+            self.done += 1
+            if not success:
+                self.failed += 1
+            if self.on_progress is not None:
+                self.on_progress(self.done, self.total, self.failed)
+            if self.done % VECTOR_STORE_PROGRESS_INTERVAL == 0 or self.done == self.total:
+                elapsed = time.time() - self.start_time
+                print(f"Uploaded {self.done}/{self.total} files ({self.failed} failed) in {elapsed:.1f} seconds, {self.done / elapsed if elapsed > 0 else 0:.1f} files/s.")
+
+# upload a single file for use with assistants, retrying on failure
+#
+# @param client the client to use
+# @param path the file to upload
+# @return the uploaded file id or None on error
+#
+def upload_file(client, path):
+    for attempt in range(1, VECTOR_STORE_UPLOAD_MAX_RETRY + 1):
+        try:
+            with open(path, "rb") as file:
+                return client.files.create(file=file, purpose="assistants").id
+        except OSError as e:
+            print(f"Error occurred while reading file {path}: {str(e)}")
+            return None
+        except Exception as e:
+            print(f"Error occurred while uploading file {path} (attempt {attempt}/{VECTOR_STORE_UPLOAD_MAX_RETRY}): {str(e)}")
+            if attempt < VECTOR_STORE_UPLOAD_MAX_RETRY:
+                time.sleep(VECTOR_STORE_UPLOAD_RETRY_DELAY * attempt)
+    return None
 
+# create a file batch without waiting for it to be processed
+#
+# @return tuple of (batch or None if the batch could not be created, file ids in the batch)
+#
+def create_file_batch(client, vector_store, file_ids):
+    try:
+        batch = client.beta.vector_stores.file_batches.create(vector_store_id=vector_store.id, file_ids=file_ids)
+        print(f"Created file batch {batch.id} with {len(file_ids)} files.")
+        return batch, file_ids
+    except Exception as e:
+        print(f"Error occurred while creating file batch: {str(e)}")
+        return None, file_ids
+
+# wait until the given file batches have been processed and retry the failed files individually
+#
+# A batch which is still in progress after VECTOR_STORE_BATCH_MAX_WAIT seconds, or whose status cannot be checked
+# VECTOR_STORE_UPLOAD_MAX_RETRY times in a row, is cancelled and all its files are retried individually.
+#
+# @return list of file ids successfully added to the vector store
+#
+def wait_file_batches(client, vector_store, batches):
+    added = []
+    retry_ids = []
+    pending = []
+    deadline = time.time() + VECTOR_STORE_BATCH_MAX_WAIT
+    for batch, file_ids in batches:
+        if batch is None:
+            retry_ids.extend(file_ids)
+        else:
+            pending.append((batch, file_ids, 0))
+
+    while pending:
+        still_pending = []
+        for batch, file_ids, errors in pending:
+            try:
+                batch = client.beta.vector_stores.file_batches.retrieve(batch_id=batch.id, vector_store_id=vector_store.id)
+                errors = 0
             except Exception as e:
-                # Handle any exceptions that occur during the batch upload process
-                print(f"Error occurred while processing batch: {str(e)}")
-            finally:
-                print("Proceeding to next batch if available.")
+                errors += 1
+                print(f"Error occurred while checking file batch {batch.id} ({errors}/{VECTOR_STORE_UPLOAD_MAX_RETRY}): {str(e)}")
+            if batch.status == "in_progress":
+                if errors < VECTOR_STORE_UPLOAD_MAX_RETRY and time.time() < deadline:
+                    still_pending.append((batch, file_ids, errors))
+                else:
+                    print(f"Giving up waiting for file batch {batch.id}, attaching its {len(file_ids)} files individually.")
+                    cancel_file_batch(client, vector_store, batch)
+                    retry_ids.extend(file_ids)
+                continue
+            print(f"Batch {batch.id} {batch.status}: {batch.file_counts}")
+            if batch.status == "completed":
+                failed_ids = set(list_failed_batch_files(client, vector_store, batch)) if batch.file_counts.failed > 0 else set()
+            else:
+                failed_ids = set(file_ids) # cancelled or failed batch, the files are already uploaded so only attaching is retried
+            added.extend(f for f in file_ids if f not in failed_ids)
+            retry_ids.extend(f for f in file_ids if f in failed_ids)
+        pending = still_pending
+        if pending:
+            time.sleep(VECTOR_STORE_BATCH_POLL_INTERVAL)
+
+    for file_id in retry_ids:
+        if attach_file(client, vector_store, file_id):
+            added.append(file_id)
+    return added
+
+def cancel_file_batch(client, vector_store, batch):
+    try:
+        client.beta.vector_stores.file_batches.cancel(batch_id=batch.id, vector_store_id=vector_store.id)
+    except Exception as e:
+        print(f"Error occurred while cancelling file batch {batch.id}: {str(e)}")
+
+def list_failed_batch_files(client, vector_store, batch):
+    try:
+        return [f.id for f in client.beta.vector_stores.file_batches.list_files(batch_id=batch.id, vector_store_id=vector_store.id, filter="failed")]
+    except Exception as e:
+        print(f"Error occurred while listing failed files of batch {batch.id}: {str(e)}")
+        return []
+
+# attach an uploaded file to the vector store individually, used for retrying files which failed in a batch
+#
+# @return True on success
+#
+def attach_file(client, vector_store, file_id):
+    for attempt in range(1, VECTOR_STORE_UPLOAD_MAX_RETRY + 1):
+        try:
+            vector_store_file = client.beta.vector_stores.files.create_and_poll(file_id=file_id, vector_store_id=vector_store.id)
+            if vector_store_file.status == "completed":
+                return True
+            print(f"Attaching file {file_id} finished with status {vector_store_file.status}: {vector_store_file.last_error}")
+        except Exception as e:
+            print(f"Error occurred while attaching file {file_id} (attempt {attempt}/{VECTOR_STORE_UPLOAD_MAX_RETRY}): {str(e)}")
+        if attempt < VECTOR_STORE_UPLOAD_MAX_RETRY:
+            time.sleep(VECTOR_STORE_UPLOAD_RETRY_DELAY * attempt)
+    return False
 
-        print(f"All batches processed in {time.time() - start_time} seconds.")
+# remove files from a vector store and delete the uploaded files
+#
+# @param client the client to use
+# @param vector_store the vector store
+# @param file_ids the files to remove
+#
+def remove_files_from_vector_store(client, vector_store, file_ids):
+    for file_id in file_ids:
+        try:
+            client.beta.vector_stores.files.delete(file_id=file_id, vector_store_id=vector_store.id)
+        except Exception as e:
+            print(f"Error occurred while removing file {file_id} from vector store: {str(e)}")
+        try:
+            client.files.delete(file_id)
+        except Exception as e:
+            print(f"Error occurred while deleting file {file_id}: {str(e)}")
 
-def split_list(input_list, chunk_size):
-    # Use list comprehension to split the list into smaller chunks
-    return [input_list[i:i + chunk_size] for i in range(0, len(input_list), chunk_size)]
+# delete uploaded files which are no longer attached to any vector store
+#
+# @param client the client to use
+# @param file_ids the files to delete
+# @return the ids of the files which could not be deleted
+#
+def delete_files(client, file_ids):
+    failed = []
+    for file_id in file_ids:
+        try:
+            client.files.delete(file_id)
+        except NotFoundError:
+            pass # already deleted
+        except Exception as e:
+            print(f"Error occurred while deleting file {file_id}: {str(e)}")
+            failed.append(file_id)
+    return failed
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(FILE_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# load the manifest mapping local files to the files uploaded into the vector store
+#
+# @param manifest_path the manifest file
+# @return the manifest, an empty manifest if the file does not exist
+#
+def load_vector_store_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"vector_store_id": None, "version": 0, "files": {}}
+
+def save_vector_store_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+
+# retrieve the vector store listed in the manifest, or create a new one (and a new manifest) if it does not exist
+#
+# A new vector store is created only if the listed one has been deleted (404). The files uploaded for the deleted store
+# are kept in the manifest as "stale_file_ids" and deleted by sync_vector_store().
+#
+# @param client the client to use
+# @param manifest_path the manifest file
+# @return the vector store
+# @raise Exception if the vector store could not be retrieved for another reason (e.g. timeout or rate limit), so that the caller can retry
+#
+def open_vector_store(client, manifest_path):
+    manifest = load_vector_store_manifest(manifest_path)
+    if manifest["vector_store_id"] is not None:
+        print(f"Retrieving the vector store of the manifest, id: {manifest['vector_store_id']}")
+        try:
+            return client.beta.vector_stores.retrieve(manifest["vector_store_id"])
+        except NotFoundError:
+            print(f"Vector store {manifest['vector_store_id']} no longer exists, creating a new one.")
+    vector_store = create_vector_store(client, None, None)
+    stale_file_ids = manifest.get("stale_file_ids", []) + [entry["file_id"] for entry in manifest["files"].values() if entry["file_id"] is not None]
+    save_vector_store_manifest(manifest_path, {"vector_store_id": vector_store.id, "version": manifest["version"] + 1, "files": {}, "stale_file_ids": stale_file_ids})
+    return vector_store
 
+# synchronize the vector store with the given files: upload added or changed files and remove deleted ones
+#
+# @param client the client to use
+# @param vector_store the vector store, see open_vector_store()
+# @param file_paths all files which should be in the vector store
+# @param manifest_path the manifest file
+# @param on_progress optional function(uploaded, total, failed) called after each upload, see add_files_to_vector_store()
+# @return the manifest version, which is increased every time the contents of the vector store change
+#
+def sync_vector_store(client, vector_store, file_paths, manifest_path, on_progress=None):
+    start_time = time.time()
+    manifest = load_vector_store_manifest(manifest_path)
+    files = manifest["files"]
 
+    current = {} # path => entry for the current version of the file
+    for path in file_paths:
+        try:
+            stat = os.stat(path)
+            entry = files.get(path)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = {"sha256": hash_file(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "file_id": entry["file_id"] if entry else None, "uploaded_sha256": entry["uploaded_sha256"] if entry else None}
+            current[path] = entry
+        except OSError as e:
+            print(f"Error occurred while reading file {path}: {str(e)}")
+
+    to_upload = [path for path, entry in current.items() if entry["file_id"] is None or entry["uploaded_sha256"] != entry["sha256"]]
+    to_remove = [entry["file_id"] for path, entry in files.items() if entry["file_id"] is not None and (path not in current or path in to_upload)]
+    print(f"Synchronizing vector store {vector_store.id}: {len(to_upload)} files to upload, {len(to_remove)} files to remove, {len(current) - len(to_upload)} unchanged.")
+
+    if to_upload:
+        uploaded = add_files_to_vector_store(client, vector_store, to_upload, on_progress)
+        for path in to_upload:
+            current[path]["file_id"] = uploaded.get(path) # failed uploads are retried on the next synchronization
+            current[path]["uploaded_sha256"] = current[path]["sha256"] if path in uploaded else None
+    if to_remove:
+        remove_files_from_vector_store(client, vector_store, to_remove)
+    if manifest.get("stale_file_ids"):
+        print(f"Deleting {len(manifest['stale_file_ids'])} files uploaded for a deleted vector store.")
+        manifest["stale_file_ids"] = delete_files(client, manifest["stale_file_ids"]) # failed deletions are retried on the next synchronization
+
+    if to_upload or to_remove:
+        manifest["version"] += 1
+    manifest["vector_store_id"] = vector_store.id
+    manifest["files"] = current
+    save_vector_store_manifest(manifest_path, manifest)
+    file_name_cache.update({entry["file_id"]: os.path.basename(path) for path, entry in current.items() if entry["file_id"] is not None}) # uploaded files are named by their basename
+    print(f"Vector store synchronized in {time.time() - start_time} seconds, version: {manifest['version']}.")
+    return manifest["version"]
+
+# fill the filename cache used for resolving citations with a bulk listing of the uploaded files
+#
+# Not needed when the vector store is managed with sync_vector_store(), which fills the cache from the manifest.
+#
+# @param client the client to use
+# @return number of cached filenames
+#
+def prefetch_file_names(client):
+    start_time = time.time()
+    names = {}
+    try:
+        for file in client.files.list(purpose="assistants"): # the client fetches the following pages automatically
+            names[file.id] = file.filename
+    except Exception as e:
+        print(f"Error occurred while listing files: {str(e)}")
+    file_name_cache.update(names)
+    print(f"Cached {len(names)} filenames in {time.time() - start_time} seconds.")
+    return len(names)
 
 # run assistant
 #  
 # @param client the client to use
 # @param assistant the assistant to use
 # @param user_message the user's prompt message
+# @param thread_id the thread to add the message to, or None to use a new thread. Reusing a thread saves a round-trip
+#        but the assistant sees the earlier messages of the thread, and only one run can be active in a thread at a time.
 #
-def run_assistant(client, assistant, user_message):
+def run_assistant(client, assistant, user_message, thread_id=None):
+    status, message, citations = run_assistant_with_status(client, assistant, user_message, thread_id)
+    return message, citations
+
+# run assistant, see run_assistant()
+#
+# @return tuple of (final status of the run, answer, citations), the answer is valid only if the status is "completed"
+#
+def run_assistant_with_status(client, assistant, user_message, thread_id=None):
     start_time = time.time()
 
-    thread = client.beta.threads.create()
+    thread_id = thread_id or client.beta.threads.create().id
     message = client.beta.threads.messages.create(
-        thread_id=thread.id,
+        thread_id=thread_id,
         role="user",
         content=user_message
     )
 
     run = client.beta.threads.runs.create(
-        thread_id=thread.id,
+        thread_id=thread_id,
         assistant_id=assistant.id,
     )
 
     status = run.status
 
     while status not in ["completed", "cancelled", "expired", "failed"]:
-        time.sleep(5)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id,run_id=run.id)
+        time.sleep(RUN_POLL_INTERVAL)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id,run_id=run.id)
         status = run.status
         print(f'Status: {status}')
         if status == 'failed':
             print(f"Last error: {run.last_error}")
 
     messages = client.beta.threads.messages.list(
-        thread_id=thread.id
+        thread_id=thread_id
     ) 
 
     print(f'Status: {status}')
@@ -181,14 +546,66 @@ def run_assistant(client, assistant, user_message):
     print(f"Assistant finished in {time.time() - start_time} seconds.")
     
     message_content = messages.data[0].content[0].text
-    annotations = message_content.annotations
+    return status, message_content.value, get_citations(client, message_content.annotations)
+
+# run assistant and stream the answer as it is generated
+#
+# The answer is the same as the one given by run_assistant(), but the text is available token by token instead of
+# only after the run has completed, so the user sees the first words of the answer after a fraction of the total time.
+#
+# @param client the client to use
+# @param assistant the assistant to use
+# @param user_message the user's prompt message
+# @param thread_id the thread to add the message to, or None to use a new thread, see run_assistant()
+# @return generator of events: ("delta", text) for each piece of the answer, and finally ("done", (answer, citations))
+#         or ("error", message) if the run did not complete
+#
+def run_assistant_stream(client, assistant, user_message, thread_id=None):
+    start_time = time.time()
+
+    thread_id = thread_id or client.beta.threads.create().id
+    client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=user_message
+    )
+
+    first_delta_time = None
+    with client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant.id) as stream:
+        for text in stream.text_deltas:
+            if first_delta_time is None:
+                first_delta_time = time.time()
+                print(f"First answer token after {first_delta_time - start_time} seconds.")
+            yield "delta", text
+        run = stream.get_final_run()
+        messages = stream.get_final_messages()
+
+    print(f'Status: {run.status}')
+    print(f"Assistant finished in {time.time() - start_time} seconds.")
+
+    if run.status != "completed" or not messages:
+        print(f"Last error: {run.last_error}")
+        yield "error", f"Run {run.status}."
+        return
+
+    message_content = messages[-1].content[0].text
+    yield "done", (message_content.value, get_citations(client, message_content.annotations))
+
+# @return list of the filenames of the files cited in the given message annotations
+#
+# The filenames are taken from file_name_cache, files missing from the cache are retrieved once each.
+#
+def get_citations(client, annotations):
     citations = []
-    for index, annotation in enumerate(annotations):
+    for annotation in annotations:
         if file_citation := getattr(annotation, "file_citation", None):
-            cited_file = client.files.retrieve(file_citation.file_id)
-            citations.append(cited_file.filename)
-
-    return message_content.value, citations
+            file_id = file_citation.file_id
+            filename = file_name_cache.get(file_id)
+            if filename is None:
+                filename = client.files.retrieve(file_id).filename
+                file_name_cache.put(file_id, filename)
+            citations.append(filename)
+    return citations
 
 # update assistant
 #  
@@ -206,16 +623,39 @@ def update_assistant(client, assistant, vector_store):
 
     print(f"Assistant updated in {time.time() - start_time} seconds.")
 
-def create_azure_client():
+def create_azure_client(azure_endpoint=AZURE_ENDPOINT, api_key=AZURE_API_KEY):
     client = AzureOpenAI(
-        api_key=AZURE_API_KEY,
+        api_key=api_key,
         api_version=AZURE_API_VERSION,
-        azure_endpoint=AZURE_ENDPOINT
+        azure_endpoint=azure_endpoint,
+        http_client=create_cassette_http_client()
     )
     return client
 
 def create_openai_client():
     client = OpenAI(
-        api_key=OPENAI_API_KEY
+        api_key=OPENAI_API_KEY,
+        http_client=create_cassette_http_client()
     )
     return client
+
+# create the client selected by OPENAI_CLIENT_BACKEND
+#
+def create_client():
+    backend = os.environ.get("OPENAI_CLIENT_BACKEND", OPENAI_CLIENT_BACKEND)
+    if backend == "openai":
+        return create_openai_client()
+    elif backend == "mock":
+        return create_azure_client(os.environ.get("OPENAI_MOCK_ENDPOINT", OPENAI_MOCK_ENDPOINT), "mock")
+    return create_azure_client()
+
+# @return http client for recording/replaying the api calls, or None if OPENAI_CASSETTE_MODE is not set
+#
+def create_cassette_http_client():
+    mode = os.environ.get("OPENAI_CASSETTE_MODE", OPENAI_CASSETTE_MODE)
+    if not mode:
+        return None
+    if MOCK_SERVER_DIRECTORY not in sys.path:
+        sys.path.append(MOCK_SERVER_DIRECTORY)
+    import replaytransport
+    return replaytransport.create_http_client(mode, os.environ.get("OPENAI_CASSETTE_FILE", OPENAI_CASSETTE_FILE))
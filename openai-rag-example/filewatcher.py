@@ -0,0 +1,94 @@
+# Watches a directory tree for added, changed and removed files by comparing periodic snapshots of the file sizes and
+# modification times.
+#
+# Requires only the Python standard library. Polling is used instead of inotify, so the watcher also works on network
+# drives and on all operating systems. Changes are reported only after the directory has stayed the same for two
+# polls, so files which are still being copied are not reported until they are complete.
+#
+import os
+import threading
+
+
+#
+# @param directory the root directory
+# @param suffixes the file suffixes to include (case-insensitive)
+# @return dict of absolute path => (size, modification time in ns) of the files, in the same order as
+#         filecrawler.collect_files_with_suffixes() returns them
+#
+def take_snapshot(directory, suffixes):
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    snapshot = {}
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(suffixes):
+                path = os.path.join(os.path.abspath(root), file)
+                try:
+                    stat = os.stat(path)
+                except OSError: # removed during the walk
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class FileWatcher:
+    #
+    # @param directory the root directory to watch
+    # @param suffixes the file suffixes to watch, e.g. (".pdf",)
+    # @param interval how often the directory is checked, in seconds
+    # @param on_change function(file_paths, added, changed, removed) called from the watcher thread when the files change,
+    #        file_paths is the list of all current files, the others are the lists of paths that differ from the previous call.
+    #        The next check is done only after the function has returned, so changes during a slow update are combined.
+    #
+    def __init__(self, directory, suffixes, interval, on_change):
+        self.directory = directory
+        self.suffixes = suffixes
+        self.interval = interval
+        self.on_change = on_change
+        self.snapshot = None
+        self.pending = None # changed snapshot waiting to become stable
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    #
+    # @param snapshot the files the caller already knows about (see take_snapshot()), or None to take a new snapshot.
+    #        Passing the snapshot the caller used for its own initialization makes sure no changes are missed in between.
+    #
+    def start(self, snapshot=None):
+        if self.thread is not None:
+            return
+        self.snapshot = snapshot if snapshot is not None else take_snapshot(self.directory, self.suffixes)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"Watching {len(self.snapshot)} files in {self.directory}, checking every {self.interval} seconds.")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Exception while checking for file changes: {e}")
+
+    #
+    # Compares the current files to the previous snapshot and calls on_change if the files have changed
+    #
+    # @return True if on_change was called
+    #
+    def check(self):
+        snapshot = take_snapshot(self.directory, self.suffixes)
+        if snapshot == self.snapshot:
+            self.pending = None
+            return False
+        if snapshot != self.pending:
+            self.pending = snapshot # wait for one more poll, the files may still be being written
+            return False
+        added = [path for path in snapshot if path not in self.snapshot]
+        changed = [path for path in snapshot if path in self.snapshot and snapshot[path] != self.snapshot[path]]
+        removed = [path for path in self.snapshot if path not in snapshot]
+        print(f"Files changed in {self.directory}: {len(added)} added, {len(changed)} changed, {len(removed)} removed.")
+        self.on_change(list(snapshot), added, changed, removed)
+        self.snapshot = snapshot
+        self.pending = None
+        return True
@@ -0,0 +1,343 @@
+# Local retrieval for the RAG: an alternative to the assistant and the hosted vector store (file_search tool).
+#
+# The crawled PDFs are split into passages, which are searched locally with BM25 and optionally with embeddings of a
+# local sentence-transformers model. The best passages are sent with the question to a plain chat completion, so the
+# retrieval does not use the hosted service at all and the answer takes one API call without polling.
+#
+# Requires:
+#  - pip install pymupdf (for filecrawler.extract_pdf_pages)
+#  - optional, only if LOCAL_EMBEDDING_MODEL is set: pip install numpy sentence-transformers
+#
+# The index is stored in LOCAL_INDEX_DIRECTORY: the extracted passages in passages.json and the embeddings in
+# embeddings.npy, which is memory-mapped instead of loaded into memory. Only new or changed files are extracted (and
+# embedded) when the index is updated. The BM25 postings are built in memory when the index is loaded or updated.
+#
+# Usage:
+#   index = LocalIndex(LOCAL_INDEX_DIRECTORY, LOCAL_EMBEDDING_MODEL)
+#   index.update(file_paths)
+#   answer, citations = answer_query(client, index, "What was decided about the budget?")
+#
+import collections
+import concurrent.futures
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+import filecrawler
+import filesearch
+
+LOCAL_INDEX_DIRECTORY = ".local_index"
+LOCAL_EMBEDDING_MODEL = None # sentence-transformers model for embedding search, e.g. "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", None for BM25 only
+LOCAL_EMBEDDING_BATCH_SIZE = 64 # passages embedded at once
+LOCAL_EXTRACT_MAX_WORKERS = None # number of processes used for extracting the text of the PDFs, None for the number of CPUs
+LOCAL_PASSAGE_WORDS = 200 # length of a passage, in words
+LOCAL_PASSAGE_OVERLAP = 50 # words shared by consecutive passages, so that sentences at the boundaries are found
+LOCAL_SEARCH_TOP_K = 8 # number of passages sent to the chat completion
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60 # rank constant of the reciprocal rank fusion of the BM25 and embedding results
+LOCAL_INSTRUCTIONS = "The relevant passages of the files are given in the user message, each starting with its number in square brackets. Cite the passages you use with their numbers, e.g. [1]."
+PASSAGES_FILE = "passages.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+WORD_PATTERN = re.compile(r'\w+')
+CITATION_PATTERN = re.compile(r'\[(\d+)\]')
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall(text.casefold())
+
+#
+# @return tuple of (list of [page number, passage text] of the given PDF, or None on error, error message). Run in the worker processes of LocalIndex.update().
+#
+def extract_passages(file_path):
+    pages, error = filecrawler.extract_pdf_pages(file_path)
+    if pages is None:
+        return None, error
+    passages = []
+    step = max(1, LOCAL_PASSAGE_WORDS - LOCAL_PASSAGE_OVERLAP)
+    for page_num, text in enumerate(pages):
+        words = text.split()
+        for start in range(0, len(words), step):
+            passages.append([page_num + 1, " ".join(words[start:start + LOCAL_PASSAGE_WORDS])])
+            if start + LOCAL_PASSAGE_WORDS >= len(words):
+                break
+    return passages, None
+
+
+class LocalIndex:
+    #
+    # @param directory where the index is stored, the index is loaded from here if it exists
+    # @param embedding_model sentence-transformers model name, or None to use BM25 only
+    #
+    def __init__(self, directory=LOCAL_INDEX_DIRECTORY, embedding_model=LOCAL_EMBEDDING_MODEL):
+        self.directory = directory
+        self.embedding_model = embedding_model
+        self.model = None # loaded on first use
+        self.model_lock = threading.Lock()
+        self.lock = threading.Lock() # protects the search structures below, which are replaced as a whole on update
+        self.update_lock = threading.Lock()
+        self.version = 0 # increased every time the contents of the index change
+        self.files = {} # path => {"key": [size, mtime_ns], "passages": [[page, text], ...]}
+        self.passages = [] # (path, page, text) of each row
+        self.postings = {} # term => list of (row, term frequency)
+        self.lengths = [] # number of terms of each row
+        self.average_length = 0.0
+        self.embeddings = None # memory-mapped matrix of the passage embeddings, one row per passage
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, PASSAGES_FILE), 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable local index {self.directory}: {e}")
+            return
+        embeddings = None
+        if self.embedding_model is not None and data.get("embedding_model") == self.embedding_model:
+            embeddings = self.load_embeddings(sum(len(entry["passages"]) for entry in data["files"].values()))
+        self.set_files(data["files"], embeddings)
+        self.version = data.get("version", 0)
+        print(f"Loaded local index with {len(self.passages)} passages from {len(self.files)} files.")
+
+    def load_embeddings(self, rows):
+        import numpy as np
+        try:
+            embeddings = np.load(os.path.join(self.directory, EMBEDDINGS_FILE), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return embeddings if embeddings.shape[0] == rows else None
+
+    def set_files(self, files, embeddings):
+        passages = [(path, page, text) for path, entry in files.items() for page, text in entry["passages"]]
+        postings = collections.defaultdict(list)
+        lengths = []
+        for row, (path, page, text) in enumerate(passages):
+            terms = collections.Counter(tokenize(os.path.basename(path) + " " + text)) # the filename often tells the date and the meeting
+            for term, count in terms.items():
+                postings[term].append((row, count))
+            lengths.append(sum(terms.values()))
+        with self.lock:
+            self.files = files
+            self.passages = passages
+            self.postings = dict(postings)
+            self.lengths = lengths
+            self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+            self.embeddings = embeddings
+
+    #
+    # Updates the index to contain the given files, only new and changed files are extracted
+    #
+    # @param file_paths all files which should be in the index
+    # @return the index version
+    #
+    def update(self, file_paths):
+        with self.update_lock:
+            start_time = time.time()
+            files = {}
+            to_extract = []
+            for path in file_paths:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    print(f"Error occurred while reading file {path}: {str(e)}")
+                    continue
+                key = [stat.st_size, stat.st_mtime_ns]
+                entry = self.files.get(path)
+                if entry is not None and entry["key"] == key:
+                    files[path] = entry
+                else:
+                    files[path] = {"key": key, "passages": []}
+                    to_extract.append(path)
+
+            if to_extract:
+                print(f"Extracting {len(to_extract)} new or changed files for the local index...")
+                with concurrent.futures.ProcessPoolExecutor(max_workers=LOCAL_EXTRACT_MAX_WORKERS, mp_context=filecrawler.pdfextract.get_mp_context(), initializer=filecrawler.pdfextract.pool_initializer) as executor:
+                    for path, (passages, error) in zip(to_extract, executor.map(extract_passages, to_extract, chunksize=4)):
+                        files[path]["passages"] = passages or []
+                        if passages is None:
+                            print(f"Error processing file {path}: {error}")
+                            files[path]["key"] = None # retried on the next update
+
+            embeddings_missing = self.embedding_model is not None and self.embeddings is None and self.passages
+            if not to_extract and list(files) == list(self.files) and not embeddings_missing:
+                return self.version
+
+            embeddings = self.update_embeddings(files, set(to_extract)) if self.embedding_model is not None else None
+            self.version += 1
+            data = {"version": self.version, "embedding_model": self.embedding_model, "files": files}
+            tmp_path = os.path.join(self.directory, PASSAGES_FILE + ".tmp")
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, os.path.join(self.directory, PASSAGES_FILE))
+            self.set_files(files, embeddings)
+            print(f"Local index updated in {time.time() - start_time} seconds: {len(self.passages)} passages from {len(files)} files, version {self.version}.")
+            return self.version
+
+    #
+    # Writes the embeddings of the given files, the rows of unchanged files are copied from the current embeddings
+    #
+    # @return the new memory-mapped embeddings
+    #
+    def update_embeddings(self, files, changed_paths):
+        import numpy as np
+        old_rows = {} # path => first row in the current embeddings
+        row = 0
+        for path, entry in self.files.items():
+            old_rows[path] = row
+            row += len(entry["passages"])
+
+        parts = [] # (current embeddings or None for computed, first row, row count) of each file
+        pending_texts = []
+        for path, entry in files.items():
+            count = len(entry["passages"])
+            if self.embeddings is not None and path in old_rows and path not in changed_paths:
+                parts.append((self.embeddings, old_rows[path], count))
+            else:
+                parts.append((None, len(pending_texts), count))
+                pending_texts.extend(text for page, text in entry["passages"])
+
+        total = sum(len(entry["passages"]) for entry in files.values())
+        if total == 0:
+            return None # an empty file cannot be memory-mapped
+        computed = self.embed(pending_texts) if pending_texts else None
+        dimension = computed.shape[1] if computed is not None else self.embeddings.shape[1] if self.embeddings is not None else self.get_model().get_sentence_embedding_dimension()
+        tmp_path = os.path.join(self.directory, EMBEDDINGS_FILE + ".tmp.npy")
+        output = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(total, dimension))
+        row = 0
+        for source, first, count in parts:
+            output[row:row + count] = (computed if source is None else source)[first:first + count]
+            row += count
+        output.flush()
+        del output
+        with self.lock:
+            self.embeddings = None # release the old mapping before replacing the file
+        os.replace(tmp_path, os.path.join(self.directory, EMBEDDINGS_FILE))
+        return np.load(os.path.join(self.directory, EMBEDDINGS_FILE), mmap_mode='r')
+
+    def get_model(self):
+        with self.model_lock:
+            if self.model is None:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.embedding_model, device="cpu")
+            return self.model
+
+    def embed(self, texts):
+        import numpy as np
+        start_time = time.time()
+        vectors = self.get_model().encode(texts, batch_size=LOCAL_EMBEDDING_BATCH_SIZE, normalize_embeddings=True)
+        print(f"Embedded {len(texts)} passages in {time.time() - start_time} seconds.")
+        return np.asarray(vectors, dtype=np.float32)
+
+    #
+    # @param query the question
+    # @param top_k number of passages to return
+    # @return list of (path, page, text) of the best matching passages, best first
+    #
+    def search(self, query, top_k=LOCAL_SEARCH_TOP_K):
+        with self.lock: # the structures are replaced, not modified, on update
+            passages = self.passages
+            postings = self.postings
+            lengths = self.lengths
+            average_length = self.average_length
+            embeddings = self.embeddings
+        bm25_rows = search_bm25(postings, lengths, average_length, query, top_k * 4)
+        if embeddings is None or not passages:
+            return [passages[row] for row in bm25_rows[:top_k]]
+        embedding_rows = self.search_embeddings(embeddings, query, top_k * 4)
+        scores = collections.defaultdict(float) # reciprocal rank fusion
+        for rows in (bm25_rows, embedding_rows):
+            for rank, row in enumerate(rows):
+                scores[row] += 1.0 / (RRF_K + rank + 1)
+        return [passages[row] for row in heapq.nlargest(top_k, scores, key=scores.get)]
+
+    def search_embeddings(self, embeddings, query, top_k):
+        import numpy as np
+        similarities = embeddings @ self.embed([query])[0]
+        top_k = min(top_k, len(similarities))
+        rows = np.argpartition(-similarities, top_k - 1)[:top_k]
+        return [int(row) for row in rows[np.argsort(-similarities[rows])]]
+
+
+#
+# @param postings term => list of (row, term frequency)
+# @param lengths number of terms of each row
+# @return the best matching rows, best first
+#
+def search_bm25(postings, lengths, average_length, query, top_k):
+    scores = collections.defaultdict(float)
+    for term in set(tokenize(query)):
+        term_postings = postings.get(term)
+        if not term_postings:
+            continue
+        idf = math.log(1 + (len(lengths) - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+        for row, frequency in term_postings:
+            length_norm = 1 - BM25_B + BM25_B * lengths[row] / average_length
+            scores[row] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+    return heapq.nlargest(top_k, scores, key=scores.get)
+
+#
+# @return the chat messages asking the question with the given passages
+#
+def create_messages(query, passages):
+    context = "\n\n".join(f"[{number}] {os.path.basename(path)}, page {page}:\n{text}" for number, (path, page, text) in enumerate(passages, 1))
+    return [
+        {"role": "system", "content": f"{filesearch.ASSISTANT_INSTRUCTIONS}\n\n{LOCAL_INSTRUCTIONS}"},
+        {"role": "user", "content": f"Passages:\n\n{context}\n\nQuestion: {query}"}
+    ]
+
+#
+# @return list of the filenames of the passages cited in the answer, each file once in the order of the first citation
+#
+def get_citations(answer, passages):
+    citations = []
+    for number in CITATION_PATTERN.findall(answer):
+        index = int(number) - 1
+        if 0 <= index < len(passages):
+            filename = os.path.basename(passages[index][0])
+            if filename not in citations:
+                citations.append(filename)
+    return citations
+
+#
+# Answers the question using the passages found in the local index
+#
+# @param client the client to use
+# @param index the LocalIndex
+# @param query the user's question
+# @return tuple of (answer, citations), as filesearch.run_assistant()
+#
+def answer_query(client, index, query):
+    start_time = time.time()
+    passages = index.search(query)
+    search_time = time.time()
+    response = client.chat.completions.create(model=filesearch.MODEL_ENGINE, messages=create_messages(query, passages))
+    answer = response.choices[0].message.content or ""
+    print(f"Local search found {len(passages)} passages in {search_time - start_time} seconds, answered in {time.time() - start_time} seconds.")
+    return answer, get_citations(answer, passages)
+
+#
+# Answers the question using the passages found in the local index, streaming the answer as it is generated
+#
+# @return generator of events, as filesearch.run_assistant_stream()
+#
+def answer_query_stream(client, index, query):
+    start_time = time.time()
+    passages = index.search(query)
+    print(f"Local search found {len(passages)} passages in {time.time() - start_time} seconds.")
+    parts = []
+    stream = client.chat.completions.create(model=filesearch.MODEL_ENGINE, messages=create_messages(query, passages), stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content: # azure sends chunks without choices for the content filter results
+            if not parts:
+                print(f"First answer token after {time.time() - start_time} seconds.")
+            parts.append(chunk.choices[0].delta.content)
+            yield "delta", parts[-1]
+    answer = "".join(parts)
+    print(f"Answered in {time.time() - start_time} seconds.")
+    yield "done", (answer, get_citations(answer, passages))
@@ -21,25 +21,195 @@
 # 5. Run application
 #     python server.py
 
-from flask import Flask, request, render_template_string, jsonify, send_file
+from flask import Flask, Response, request, render_template_string, jsonify, send_file, session, stream_with_context
 import filesearch
 import filecrawler
+import answercache
+import fileindex
+import localsearch
+import filewatcher
+import json
 import os
+import threading
+import time
 
+RETRIEVAL_BACKEND = "assistant" # "assistant" (assistant with the hosted vector store) or "local" (local search with a chat completion, see localsearch.py)
 ASSISTANT_ID = None # id for pre-existing assistant or None if creating a new one
-VECTOR_STORE_ID = None # id for pre-existing vector store or None if creating a new one
+VECTOR_STORE_ID = None # id for pre-existing vector store or None if the vector store is managed using VECTOR_STORE_MANIFEST_FILE
+VECTOR_STORE_MANIFEST_FILE = "vector_store_manifest.json" # maps the local files to the files in the vector store, only changed files are uploaded on restart
 FILE_DIRECTORY = "files"
 FILE_SUFFIX = (".pdf")
 PORT = 10000
+REUSE_THREADS = False # if True, the queries of a browser session are sent to the same assistant thread, so the assistant sees the earlier questions and answers
+THREAD_SESSION_TTL = 60 * 60 # a new thread is created when the session has been idle for this long, in seconds
+SECRET_KEY = os.environ.get("SECRET_KEY") # key for signing the session cookies, must be the same in all the processes of a WSGI server when REUSE_THREADS is used. None for a random key, sessions are then valid only in this process
+FILE_WATCH_INTERVAL = 60 # how often FILE_DIRECTORY is checked for added, changed or removed files, in seconds, None to disable
+ANSWER_CACHE_SIZE = 1000 # maximum number of cached answers, 0 to disable the cache
+ANSWER_CACHE_TTL = 24 * 60 * 60 # how long the answers are cached, in seconds, the cache is also cleared when the vector store changes
+ANSWER_CACHE_SIMILARITY = None # minimum similarity (0..1) for answering with the cached answer of a similar question, e.g. 0.9, None for exact matches only
+STARTUP_RETRY_DELAY = 60 # if the initialization fails (e.g. the service is not reachable), it is retried after this many seconds
 
 app = Flask(__name__)
-client = filesearch.create_azure_client()
-assistant = filesearch.create_assistant(client, ASSISTANT_ID)
-file_list = filecrawler.collect_files_with_suffixes(FILE_DIRECTORY, FILE_SUFFIX)
-if VECTOR_STORE_ID is None:
-    file_list = filecrawler.filter_pdfs_without_text(file_list) # azure vector store has issues with image-only-pdfs, so filter those out first
-    vector_store = filesearch.create_vector_store(client, VECTOR_STORE_ID, file_list) # uncomment to create a new vector store
-    filesearch.update_assistant(client, assistant, vector_store) # uncomment to update the vectore store to an existing assistant
+app.secret_key = SECRET_KEY or os.urandom(24)
+if REUSE_THREADS and SECRET_KEY is None:
+    print("Warning: SECRET_KEY is not set, the threads of the sessions are not reused if the server is run in several processes.")
+client = None # created by initialize(), the client type is selected with OPENAI_CLIENT_BACKEND in filesearch.py
+assistant = None # the objects below are set by initialize(), which runs in the background after the server has started
+vector_store = None
+local_index = None
+file_list = []
+file_index = fileindex.FileIndex(file_list) # for finding the files of the citations
+busy_threads = set() # the threads of the sessions with a run in progress in this process
+busy_threads_lock = threading.Lock()
+answer_cache = answercache.AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+file_update_lock = threading.Lock()
+initialization_lock = threading.Lock()
+initialization_started = False
+
+#
+# The progress of the initialization, reported by /readyz
+#
+class StartupProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.ready_time = None
+        self.step = "starting"
+        self.details = {}
+        self.attempt = 0
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.ready_time is not None
+
+    def set_step(self, step, **details):
+        with self.lock:
+            self.step = step
+            self.details = details
+        print(f"Startup: {step} {details if details else ''}")
+
+    def update(self, **details):
+        with self.lock:
+            self.details.update(details)
+
+    def set_ready(self):
+        with self.lock:
+            self.step = "ready"
+            self.details = {}
+            self.error = None
+            self.ready_time = time.time()
+        print(f"Startup finished in {self.ready_time - self.start_time} seconds.")
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "ready": self.ready,
+                "step": self.step,
+                "details": self.details,
+                "attempt": self.attempt,
+                "error": self.error,
+                "elapsed": (self.ready_time or time.time()) - self.start_time
+            }
+
+startup = StartupProgress()
+
+# Creates the assistant, crawls the files and synchronizes the vector store (or the local index). This can take a long
+# time with a large number of new files, so it is run in a background thread and /process returns 503 until it has finished.
+#
+def initialize():
+    global client, assistant, vector_store, local_index, file_list, file_index
+    while True:
+        startup.attempt += 1
+        try:
+            if client is None:
+                client = filesearch.create_client()
+            if RETRIEVAL_BACKEND == "local":
+                startup.set_step("crawling files", directory=FILE_DIRECTORY)
+                snapshot = filewatcher.take_snapshot(FILE_DIRECTORY, (FILE_SUFFIX,))
+                paths = list(snapshot)
+                startup.set_step("indexing files", files=len(paths))
+                new_local_index = localsearch.LocalIndex()
+                version = new_local_index.update(paths)
+                with file_update_lock:
+                    local_index = new_local_index
+                    file_list = paths
+                    file_index = fileindex.FileIndex(paths)
+                    answer_cache.set_version(version)
+                if FILE_WATCH_INTERVAL:
+                    filewatcher.FileWatcher(FILE_DIRECTORY, (FILE_SUFFIX,), FILE_WATCH_INTERVAL, update_files).start(snapshot)
+                startup.set_ready()
+                return
+            startup.set_step("creating assistant")
+            new_assistant = filesearch.create_assistant(client, ASSISTANT_ID)
+            if new_assistant is None:
+                raise RuntimeError("Failed to create or retrieve the assistant.")
+            startup.set_step("crawling files", directory=FILE_DIRECTORY)
+            snapshot = filewatcher.take_snapshot(FILE_DIRECTORY, (FILE_SUFFIX,)) # same files as filecrawler.collect_files_with_suffixes()
+            paths = list(snapshot)
+            if VECTOR_STORE_ID is None:
+                startup.set_step("filtering PDFs", files=len(paths))
+                paths = filecrawler.filter_pdfs_without_text(paths) # azure vector store has issues with image-only-pdfs, so filter those out first
+                startup.set_step("synchronizing vector store", files=len(paths))
+                new_vector_store = filesearch.open_vector_store(client, VECTOR_STORE_MANIFEST_FILE) # the vector store listed in the manifest, or a new one
+                version = filesearch.sync_vector_store(client, new_vector_store, paths, VECTOR_STORE_MANIFEST_FILE, # upload only added or changed files
+                    lambda uploaded, total, failed: startup.update(uploaded=uploaded, to_upload=total, failed=failed))
+                startup.set_step("updating assistant")
+                filesearch.update_assistant(client, new_assistant, new_vector_store) # uncomment to update the vectore store to an existing assistant
+            else:
+                startup.set_step("caching filenames")
+                filesearch.prefetch_file_names(client) # the filenames of the citations, sync_vector_store fills these from the manifest
+                new_vector_store = None
+                version = 0 # the contents of an unmanaged vector store are not tracked
+            with file_update_lock:
+                assistant = new_assistant
+                vector_store = new_vector_store
+                file_list = paths
+                file_index = fileindex.FileIndex(paths)
+                answer_cache.set_version(version)
+            if FILE_WATCH_INTERVAL:
+                filewatcher.FileWatcher(FILE_DIRECTORY, (FILE_SUFFIX,), FILE_WATCH_INTERVAL, update_files).start(snapshot)
+            startup.set_ready()
+            return
+        except Exception as e:
+            print(f"Startup failed: {e}, retrying in {STARTUP_RETRY_DELAY} seconds.")
+            with startup.lock:
+                startup.error = str(e)
+            time.sleep(STARTUP_RETRY_DELAY)
+
+# Called by the file watcher when the files in FILE_DIRECTORY change. The new files can be found immediately, and the
+# vector store is synchronized when it is managed by the server (only the added and changed files are uploaded).
+#
+def update_files(file_paths, added, changed, removed):
+    global file_list, file_index
+    with file_update_lock:
+        if RETRIEVAL_BACKEND == "local":
+            file_list = file_paths
+            file_index = fileindex.FileIndex(file_paths)
+            answer_cache.set_version(local_index.update(file_paths))
+            return
+        if VECTOR_STORE_ID is None:
+            file_paths = filecrawler.filter_pdfs_without_text(file_paths)
+        file_list = file_paths
+        file_index = fileindex.FileIndex(file_paths)
+        if VECTOR_STORE_ID is None:
+            answer_cache.set_version(filesearch.sync_vector_store(client, vector_store, file_paths, VECTOR_STORE_MANIFEST_FILE))
+
+# Starts initialize() in a background thread, only once. Called when the server is started directly, and before the first
+# request under a WSGI server. Nothing is started at import time, as the worker processes of filecrawler and localsearch
+# import the main module again (see pdfextract.get_mp_context()).
+#
+def start_initialization():
+    global initialization_started
+    with initialization_lock:
+        if initialization_started:
+            return
+        initialization_started = True
+        threading.Thread(target=initialize, daemon=True).start()
+
+@app.before_request
+def ensure_initialization_started():
+    start_initialization()
 
 # HTML template
 template = '''
@@ -105,47 +275,87 @@ template = '''
 
             startTime = new Date().getTime();
             timerInterval = setInterval(updateTimer, 1000);
-            document.getElementById('response').innerText = ''
+            document.getElementById('response').value = '';
+            document.getElementById('download-links').innerHTML = '';
 
             fetch('/process', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ query: query }),
+                body: JSON.stringify({ query: query, stream: true }),
             })
-            .then(response => response.json())
-            .then(data => {
-                clearInterval(timerInterval);
-                document.getElementById('response').value = data.response;
-
-                // Display download links
-                var downloadLinksDiv = document.getElementById('download-links');
-                downloadLinksDiv.innerHTML = ''; // Clear previous links
-                var addedCitations = []
-                for(let i=0;i<data.citations.length;++i) {
-                    let citation = data.citations[i]
-                    if (addedCitations.indexOf(citation) >= 0) continue;
-                    addedCitations.push(citation)
-                    let link = document.createElement('a');
-                    let uriCitation = encodeURIComponent(citation)
-                    link.href = '/download?file=' + uriCitation;
-                    link.innerText = 'Download ' + citation;
-                    link.style.display = 'block';
-
-                    fetch('/citation?citation=' + uriCitation)
-                    .then(response => response.json())  // Parse the JSON response
-                    .then(data => {
-                        for(let j=0;j<data.length;++j)
-                            details = data[j]
-                            link.innerText += ' ('+details.directory + ' ' + details.subdirectory+')'
-                    })
-                    .catch(error => console.error('Error:', error));
-
-                    downloadLinksDiv.appendChild(link);
+            .then(response => response.ok ? response : response.json().then(data => { throw new Error(data.error); }))
+            .then(response => readEvents(response, function(event, data) {
+                if (event == 'delta') {
+                    document.getElementById('response').value += data.text;
+                } else if (event == 'done') {
+                    clearInterval(timerInterval);
+                    document.getElementById('response').value = data.response;
+                    showCitations(data.citations);
+                } else if (event == 'error') {
+                    clearInterval(timerInterval);
+                    document.getElementById('response').value += '\\n\\n' + data.error;
                 }
+            }))
+            .catch(error => {
+                clearInterval(timerInterval);
+                document.getElementById('response').value = error.message;
+                console.error('Error:', error);
             });
         };
+
+        // read the server-sent events of a streamed response and call onEvent(event, data) for each of them
+        async function readEvents(response, onEvent) {
+            var reader = response.body.getReader();
+            var decoder = new TextDecoder();
+            var buffer = '';
+            while (true) {
+                var result = await reader.read();
+                if (result.done) break;
+                buffer += decoder.decode(result.value, { stream: true });
+                var events = buffer.split('\\n\\n');
+                buffer = events.pop(); // incomplete event
+                for (let i=0;i<events.length;++i) {
+                    var event = 'message';
+                    var data = '';
+                    var lines = events[i].split('\\n');
+                    for (let j=0;j<lines.length;++j) {
+                        if (lines[j].startsWith('event: ')) event = lines[j].substring(7);
+                        else if (lines[j].startsWith('data: ')) data += lines[j].substring(6);
+                    }
+                    onEvent(event, JSON.parse(data));
+                }
+            }
+        }
+
+        function showCitations(citations) {
+            // Display download links
+            var downloadLinksDiv = document.getElementById('download-links');
+            downloadLinksDiv.innerHTML = ''; // Clear previous links
+            var addedCitations = []
+            for(let i=0;i<citations.length;++i) {
+                let citation = citations[i]
+                if (addedCitations.indexOf(citation) >= 0) continue;
+                addedCitations.push(citation)
+                let link = document.createElement('a');
+                let uriCitation = encodeURIComponent(citation)
+                link.href = '/download?file=' + uriCitation;
+                link.innerText = 'Download ' + citation;
+                link.style.display = 'block';
+
+                fetch('/citation?citation=' + uriCitation)
+                .then(response => response.json())  // Parse the JSON response
+                .then(data => {
+                    for(let j=0;j<data.length;++j)
+                        details = data[j]
+                        link.innerText += ' ('+details.directory + ' ' + details.subdirectory+')'
+                })
+                .catch(error => console.error('Error:', error));
+
+                downloadLinksDiv.appendChild(link);
+            }
+        }
     </script>
 </body>
 </html>
@@ -164,13 +374,7 @@ def get_citation_details():
     return jsonify(data)
 
 def find_abosulate_paths(file_path, only_first):
-    absolute_paths = []
-    for f in file_list:
-        if file_path in f:
-            absolute_paths.append(f)
-            if only_first:
-                break
-    return absolute_paths
+    return file_index.find(file_path, only_first)
 
 @app.route('/download')
 def download_file():
@@ -184,19 +388,124 @@ def download_file():
         return jsonify({'error': 'File not found'}), 404
 
 
+# liveness check, the server is up even if it is still initializing
+#
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# readiness check, 503 until the initialization has finished, the response tells the progress
+#
+@app.route('/readyz')
+def readyz():
+    progress = startup.to_dict()
+    return jsonify(progress), 200 if progress['ready'] else 503
+
 @app.route('/')
 def index():
     return render_template_string(template)
 
 
+# Answers the query in the request JSON ({"query": "...", "stream": false}).
+#
+# Without streaming the response is {"response": "...", "citations": [...]}. With "stream": true the answer is sent as
+# server-sent events while it is generated: "delta" events ({"text": "..."}) followed by a "done" event with the same
+# content as the non-streamed response, or an "error" event ({"error": "..."}).
+#
 @app.route('/process', methods=['POST'])
 def process():
+    if not startup.ready:
+        return jsonify({'error': 'The service is starting, please try again later.', 'startup': startup.to_dict()}), 503, {'Retry-After': str(STARTUP_RETRY_DELAY)}
     data = request.get_json()
     user_query = data.get('query', '')
-    message, citations = filesearch.run_assistant(client, assistant, user_query)
+    thread_id = get_session_thread_id()
+    use_cache = ANSWER_CACHE_SIZE > 0 and thread_id is None # the answers in a reused thread depend on the earlier messages
+    cached = answer_cache.get(user_query) if use_cache else None
+    if cached is not None:
+        message, citations = cached
+        print(f"Cached answer for query: {user_query}")
+        if data.get('stream', False):
+            return Response(sse_event("delta", {'text': message}) + sse_event("done", {'response': message, 'citations': citations}), mimetype='text/event-stream')
+        return jsonify({'response': message, 'citations': citations})
+    version = answer_cache.version # the answer is not cached if the vector store changes while the assistant is running
+    if data.get('stream', False):
+        return Response(stream_with_context(stream_answer(user_query, thread_id, use_cache, version)), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    thread_id = reserve_thread(thread_id)
+    try:
+        if RETRIEVAL_BACKEND == "local":
+            status = "completed"
+            message, citations = localsearch.answer_query(client, local_index, user_query)
+        else:
+            status, message, citations = filesearch.run_assistant_with_status(client, assistant, user_query, thread_id)
+    finally:
+        release_thread(thread_id)
     print(f"Message:\n{message}\n\nCitations:\n{citations}")
+    if use_cache and status == "completed":
+        answer_cache.put(user_query, (message, citations), version)
     return jsonify({'response': message, 'citations': citations})
+
+def stream_answer(user_query, thread_id, use_cache, version):
+    thread_id = reserve_thread(thread_id) # reserved only when the response is sent, so that it is always released
+    try:
+        if RETRIEVAL_BACKEND == "local":
+            events = localsearch.answer_query_stream(client, local_index, user_query)
+        else:
+            events = filesearch.run_assistant_stream(client, assistant, user_query, thread_id)
+        for event, value in events:
+            if event == "delta":
+                yield sse_event("delta", {'text': value})
+            elif event == "done":
+                message, citations = value
+                print(f"Message:\n{message}\n\nCitations:\n{citations}")
+                if use_cache:
+                    answer_cache.put(user_query, (message, citations), version)
+                yield sse_event("done", {'response': message, 'citations': citations})
+            else:
+                yield sse_event("error", {'error': value})
+    except Exception as e:
+        print(f"Error occurred while streaming the answer: {str(e)}")
+        yield sse_event("error", {'error': 'Failed to generate the answer.'})
+    finally:
+        release_thread(thread_id)
+
+# The thread is stored in the session cookie, so the session can be served by any process which has the same SECRET_KEY.
+#
+# @return the thread of the current session if REUSE_THREADS is enabled, otherwise None (a new thread is used for each query)
+#
+def get_session_thread_id():
+    if not REUSE_THREADS or RETRIEVAL_BACKEND == "local":
+        return None
+    thread_id = session.get('thread_id')
+    if thread_id is None or session.get('thread_time', 0) + THREAD_SESSION_TTL < time.time():
+        thread_id = client.beta.threads.create().id
+        session['thread_id'] = thread_id
+    session['thread_time'] = time.time() # refresh the expiration time
+    return thread_id
+
+# Only one run can be active in a thread at a time, so a query sent while an earlier query of the same session is still
+# running is answered in a new thread instead of the session's thread.
+#
+# @return thread_id if it was free and is now reserved for this query (release with release_thread()), otherwise None
+#
+def reserve_thread(thread_id):
+    if thread_id is None:
+        return None
+    with busy_threads_lock:
+        if thread_id in busy_threads:
+            print(f"Thread {thread_id} has a run in progress, using a new thread.")
+            return None
+        busy_threads.add(thread_id)
+        return thread_id
+
+def release_thread(thread_id):
+    if thread_id is not None:
+        with busy_threads_lock:
+            busy_threads.discard(thread_id)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
     
 
 if __name__ == '__main__':
+    start_initialization()
     app.run(debug=False,host='0.0.0.0',port=PORT)
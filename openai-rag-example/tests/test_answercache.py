@@ -0,0 +1,51 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import answercache
+
+
+def test_normalize():
+    assert answercache.normalize("  What was DECIDED about the budget?! ") == "what was decided about the budget"
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = answercache.AnswerCache(10, 60)
+    cache.put("What was decided about the budget?", "answer")
+    assert cache.get("what was decided   about the budget") == "answer"
+    assert cache.get("What was decided about the schools?") is None
+    assert cache.get_stats()["hits"] == 1 and cache.get_stats()["misses"] == 1
+
+def test_least_recently_used_answer_is_dropped():
+    cache = answercache.AnswerCache(2, 60)
+    cache.put("first", 1)
+    cache.put("second", 2)
+    cache.get("first")
+    cache.put("third", 3)
+    assert cache.get("second") is None
+    assert cache.get("first") == 1 and cache.get("third") == 3
+
+def test_expired_answer_is_not_used():
+    cache = answercache.AnswerCache(10, -1)
+    cache.put("question", "answer")
+    assert cache.get("question") is None
+
+def test_version_change_drops_the_answers():
+    cache = answercache.AnswerCache(10, 60)
+    cache.set_version(1)
+    cache.put("question", "answer", 1)
+    cache.set_version(2)
+    assert cache.get("question") is None
+    cache.put("question", "old answer", 1) # created with the previous version
+    assert cache.get("question") is None
+
+def test_similar_question():
+    cache = answercache.AnswerCache(10, 60, 0.8)
+    cache.put("What did the board decide about the school budget", "budget")
+    cache.put("When is the next council meeting", "meeting")
+    assert cache.get("what did the board decide about the school budget in 2024") == "budget"
+    assert cache.get("What did the board decide about the parking fees") is None
+    assert cache.get_stats()["similar_hits"] == 1
+
+def test_similar_questions_are_not_used_by_default():
+    cache = answercache.AnswerCache(10, 60)
+    cache.put("What did the board decide about the school budget", "budget")
+    assert cache.get("what did the board decide about the school budget in 2024") is None
@@ -0,0 +1,35 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fileindex
+
+FILES = [
+    "/files/2023/board/minutes 1.pdf",
+    "/files/2023/board/minutes 11.pdf",
+    "/files/2024/board/minutes 1.pdf",
+    "/files/2024/council/agenda.pdf",
+    "/files/2024/council/old agenda.pdf"
+]
+
+
+def test_exact_filename_does_not_match_longer_filenames():
+    index = fileindex.FileIndex(FILES)
+    assert index.find("minutes 1.pdf") == [FILES[0], FILES[2]]
+    assert index.find("agenda.pdf") == [FILES[3]] # not "old agenda.pdf"
+
+def test_end_of_the_path():
+    index = fileindex.FileIndex(FILES)
+    assert index.find("council/agenda.pdf") == [FILES[3]]
+    assert index.find("1.pdf") == [FILES[0], FILES[1], FILES[2]]
+
+def test_any_part_of_the_path_is_used_only_without_other_matches():
+    index = fileindex.FileIndex(FILES)
+    assert index.find("council") == [FILES[3], FILES[4]]
+    assert index.find("board/minutes") == [FILES[0], FILES[1], FILES[2]]
+    assert index.find("budget") == []
+
+def test_only_first_and_empty_query():
+    index = fileindex.FileIndex(FILES)
+    assert index.find("minutes 1.pdf", only_first=True) == [FILES[0]]
+    assert index.find("") == []
+    assert len(index) == len(FILES)
@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import filewatcher
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+def test_snapshot_includes_only_the_suffixes(tmp_path):
+    write(str(tmp_path / "a" / "one.pdf"), "1")
+    write(str(tmp_path / "a" / "two.PDF"), "22")
+    write(str(tmp_path / "notes.txt"), "3")
+    snapshot = filewatcher.take_snapshot(str(tmp_path), (".pdf",))
+    assert sorted(os.path.basename(path) for path in snapshot) == ["one.pdf", "two.PDF"]
+    assert snapshot[str(tmp_path / "a" / "two.PDF")][0] == 2
+
+def test_changes_are_reported_after_two_checks(tmp_path):
+    changes = []
+    directory = str(tmp_path)
+    write(os.path.join(directory, "a", "keep.pdf"), "1")
+    write(os.path.join(directory, "a", "change.pdf"), "1")
+    write(os.path.join(directory, "b", "remove.pdf"), "1")
+    watcher = filewatcher.FileWatcher(directory, (".pdf",), 60, lambda *args: changes.append(args))
+    watcher.snapshot = filewatcher.take_snapshot(directory, (".pdf",))
+    assert not watcher.check()
+
+    write(os.path.join(directory, "b", "add.pdf"), "1")
+    write(os.path.join(directory, "a", "change.pdf"), "12")
+    os.remove(os.path.join(directory, "b", "remove.pdf"))
+    assert not watcher.check() # the files may still be being written
+    assert watcher.check()
+    file_paths, added, changed, removed = changes[0]
+    assert sorted(os.path.basename(path) for path in file_paths) == ["add.pdf", "change.pdf", "keep.pdf"]
+    assert [os.path.basename(path) for path in added] == ["add.pdf"]
+    assert [os.path.basename(path) for path in changed] == ["change.pdf"]
+    assert [os.path.basename(path) for path in removed] == ["remove.pdf"]
+    assert not watcher.check()
+    assert len(changes) == 1
+
+def test_file_still_being_written_is_not_reported(tmp_path):
+    changes = []
+    path = str(tmp_path / "large.pdf")
+    watcher = filewatcher.FileWatcher(str(tmp_path), (".pdf",), 60, lambda *args: changes.append(args))
+    watcher.snapshot = {}
+    write(path, "1")
+    assert not watcher.check()
+    write(path, "12") # grew since the previous check
+    assert not watcher.check()
+    assert watcher.check()
+    assert changes[0][1] == [path]
@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+pytest.importorskip("openai")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import localsearch
+
+FILES = {
+    "/files/board/2024-01 minutes.pdf": {"key": [1, 1], "passages": [[1, "The board approved the school budget for the next year."], [2, "The meeting was closed at eight."]]},
+    "/files/council/2024-02 minutes.pdf": {"key": [1, 1], "passages": [[1, "The council discussed the parking fees in the city centre."]]},
+    "/files/council/2024-03 agenda.pdf": {"key": [1, 1], "passages": [[1, "Parking fees, parking permits and parking in general."]]}
+}
+
+
+def create_index(tmp_path):
+    index = localsearch.LocalIndex(str(tmp_path), None)
+    index.set_files(FILES, None)
+    return index
+
+def test_tokenize():
+    assert localsearch.tokenize("The Budget, 2024!") == ["the", "budget", "2024"]
+
+def test_search_ranks_the_matching_passages_first(tmp_path):
+    index = create_index(tmp_path)
+    results = index.search("school budget", top_k=2)
+    assert results[0] == ("/files/board/2024-01 minutes.pdf", 1, "The board approved the school budget for the next year.")
+    assert len(results) == 1 # the other passages contain none of the words
+
+def test_search_prefers_the_higher_term_frequency(tmp_path):
+    results = create_index(tmp_path).search("parking", top_k=5)
+    assert [path for path, page, text in results] == ["/files/council/2024-03 agenda.pdf", "/files/council/2024-02 minutes.pdf"]
+
+def test_search_matches_the_filename(tmp_path):
+    results = create_index(tmp_path).search("agenda", top_k=5)
+    assert [path for path, page, text in results] == ["/files/council/2024-03 agenda.pdf"]
+
+def test_search_without_matches(tmp_path):
+    assert create_index(tmp_path).search("weather", top_k=5) == []
+    assert localsearch.LocalIndex(str(tmp_path / "empty"), None).search("budget") == []
+
+def test_citations_list_each_file_once():
+    passages = [("/files/a.pdf", 1, ""), ("/files/b.pdf", 1, ""), ("/files/a.pdf", 2, "")]
+    assert localsearch.get_citations("First [2], then [1] and [3], again [2] and [9].", passages) == ["b.pdf", "a.pdf"]
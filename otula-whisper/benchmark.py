@@ -0,0 +1,328 @@
+# Throughput benchmark for the subtitle generator and optimizer.
+#
+# Generates a synthetic media corpus (speech-like tone sequences or, with --tts, speech synthesized with espeak-ng),
+# transcribes it with SubtitleGenerator for each decoding profile and runs split_subtitles, the optimizer loop and
+# validate_srt against a local mock OpenAI server (../openai-mock-server/mockserver.py) that simulates latency and 429s.
+#
+# Reported for each configuration:
+#  - transcription: realtime factor (processing time / media duration), jobs/hour and peak RSS
+#  - optimization: total time, optimizer time per chunk, simulated 429s, jobs/hour and peak RSS
+#
+# Usage (no API keys or network needed, whisper models are downloaded on first use):
+#   python3 benchmark.py --durations 60,300 --profiles fast,accurate --optimizer-tasks 5,10 --optimizer-rate-limits 0,5 --output benchmark.json
+#
+# Note: server.py is imported inside a temporary working directory, so that the benchmark does not touch the status storage of a running server.
+#
+import argparse
+import array
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+MOCK_SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openai-mock-server')
+SAMPLE_RATE = 16000
+CUE_DURATION = 3 # duration of each synthetic subtitle cue, in seconds
+RSS_SAMPLE_INTERVAL = 0.05 # in seconds
+RANDOM_SEED = 42
+TTS_SENTENCE = "This is a synthetic lecture about subtitle generation and the optimization of speech recognition results."
+TTS_WORDS_PER_SECOND = 2.5
+META_TEXT = "Synthetic reference material for the subtitle optimizer. Terms: faster-whisper, subtitle, optimizer, benchmark."
+
+
+#
+# Tracks the peak resident set size of the process while a benchmark step is running
+#
+class PeakMemorySampler:
+    def __init__(self):
+        self.peak_kb = 0
+        self.running = False
+        self.thread = None
+
+    def read_rss_kb(self):
+        try:
+            with open('/proc/self/status', 'r') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # fallback, peak of the whole process lifetime (kB on Linux)
+
+    def sample(self):
+        while self.running:
+            self.peak_kb = max(self.peak_kb, self.read_rss_kb())
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.peak_kb = self.read_rss_kb()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        self.peak_kb = max(self.peak_kb, self.read_rss_kb())
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_kb / 1024, 1)
+
+
+#
+# Writes a mono 16 kHz wav file with speech-like harmonic "syllables" separated by pauses
+#
+def write_synthetic_audio(file_path, duration):
+    rng = random.Random(RANDOM_SEED)
+    samples = array.array('h')
+    total = int(duration * SAMPLE_RATE)
+    while len(samples) < total:
+        for _ in range(rng.randint(3, 8)): # one "word group"
+            base = rng.uniform(100, 220)
+            length = int(rng.uniform(0.12, 0.3) * SAMPLE_RATE)
+            for n in range(length):
+                envelope = math.sin(math.pi * n / length)
+                t = n / SAMPLE_RATE
+                value = sum(math.sin(2 * math.pi * base * h * t) / h for h in (1, 2, 3, 4))
+                samples.append(int(8000 * envelope * value / 2))
+        samples.extend([0] * int(rng.uniform(0.3, 1.0) * SAMPLE_RATE))
+    del samples[total:]
+    with wave.open(file_path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes(samples.tobytes())
+
+
+#
+# Writes a wav file with synthesized speech using espeak-ng (or espeak)
+#
+# @return True on success, False if no synthesizer is available
+#
+def write_tts_audio(file_path, duration):
+    synthesizer = shutil.which('espeak-ng') or shutil.which('espeak')
+    if synthesizer is None:
+        return False
+    words = int(duration * TTS_WORDS_PER_SECOND)
+    sentence_words = len(TTS_SENTENCE.split())
+    text = " ".join([TTS_SENTENCE] * max(1, words // sentence_words))
+    result = subprocess.run([synthesizer, '-w', file_path, text], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.returncode == 0
+
+
+def get_audio_duration(file_path):
+    with wave.open(file_path, 'rb') as file:
+        return file.getnframes() / file.getframerate()
+
+
+def create_media_corpus(directory, durations, use_tts):
+    media = []
+    for duration in durations:
+        file_path = os.path.join(directory, f"synthetic_{duration}s.wav")
+        if not (use_tts and write_tts_audio(file_path, duration)):
+            if use_tts:
+                print("espeak-ng/espeak not found, using synthetic tones instead of speech.")
+            write_synthetic_audio(file_path, duration)
+        media.append((file_path, get_audio_duration(file_path)))
+        print(f"Created {file_path} ({media[-1][1]:.1f} seconds)")
+    return media
+
+
+def create_synthetic_srt(cues):
+    blocks = []
+    for index in range(cues):
+        start = index * CUE_DURATION
+        end = start + CUE_DURATION
+        blocks.append(f"{index + 1}\n{format_srt_timestamp(start)} --> {format_srt_timestamp(end)}\nSynthetic subtitle cue number {index + 1} for the optimizer benchmark.")
+    return '\n\n'.join(blocks)
+
+
+def format_srt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02},000"
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(math.ceil(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def benchmark_transcription(server, profile, media):
+    results = []
+    with PeakMemorySampler() as sampler:
+        load_start_time = time.time()
+        generator = server.SubtitleGenerator(profile)
+        load_time = time.time() - load_start_time
+        for file_path, duration in media:
+            start_time = time.time()
+            srt = generator.generate_subtitles(file_path, "en")
+            processing_time = time.time() - start_time
+            results.append({"file": os.path.basename(file_path), "duration": duration, "time": processing_time, "rtf": processing_time / duration, "cues": srt.count(' --> ')})
+    total_duration = sum(r["duration"] for r in results)
+    total_time = sum(r["time"] for r in results)
+    return {
+        "stage": "transcription",
+        "profile": profile,
+        "model_load_time": load_time,
+        "files": results,
+        "rtf": total_time / total_duration if total_duration > 0 else None,
+        "jobs_per_hour": 3600 * len(results) / total_time if total_time > 0 else None,
+        "peak_rss_mb": sampler.peak_mb
+    }
+
+
+def benchmark_optimizer(server, endpoint, stats_reader, srt, max_concurrent_tasks, rate_limit):
+    chunk_times = []
+
+    class TimedSubtitleOptimizer(server.SubtitleOptimizer):
+        def run_optimization(self, client, system_prompt, subtitles):
+            start_time = time.time()
+            try:
+                return super().run_optimization(client, system_prompt, subtitles)
+            finally:
+                chunk_times.append(time.time() - start_time)
+
+    server.OPTIMIZER_MAX_CONCURRENT_TASKS = max_concurrent_tasks
+    server.OPTIMIZER_RATE_LIMIT = rate_limit
+    optimizer = TimedSubtitleOptimizer(None, None)
+    optimizer.azure_endpoint = endpoint
+    optimizer.azure_api_key = "mock"
+    client = optimizer.create_client()
+
+    stats_before = stats_reader()
+    with PeakMemorySampler() as sampler:
+        start_time = time.time()
+        split_start_time = time.time()
+        chunks = optimizer.split_subtitles(srt)
+        split_time = time.time() - split_start_time
+        status, optimized_srt = optimizer.optimize_srt(client, META_TEXT, srt)
+        validate_start_time = time.time()
+        valid = optimized_srt is not None and optimizer.validate_srt(optimized_srt)
+        validate_time = time.time() - validate_start_time
+        total_time = time.time() - start_time
+    stats_after = stats_reader()
+
+    return {
+        "stage": "optimization",
+        "max_concurrent_tasks": max_concurrent_tasks,
+        "rate_limit": rate_limit,
+        "status": status,
+        "valid": valid,
+        "chunks": len(chunks),
+        "time": total_time,
+        "split_time": split_time,
+        "validate_time": validate_time,
+        "chunk_time_mean": sum(chunk_times) / len(chunk_times) if chunk_times else None,
+        "chunk_time_p95": percentile(chunk_times, 95),
+        "chunk_time_max": max(chunk_times) if chunk_times else None,
+        "rate_limited_responses": stats_after.get("rate_limited", 0) - stats_before.get("rate_limited", 0),
+        "jobs_per_hour": 3600 / total_time if total_time > 0 else None,
+        "peak_rss_mb": sampler.peak_mb
+    }
+
+
+def start_mock_server(args):
+    sys.path.append(MOCK_SERVER_DIRECTORY)
+    import mockserver
+    config = mockserver.MockConfig(args.latency, args.jitter, args.rate_limit_probability, 0.0, args.requests_per_minute, args.retry_after)
+    mock = mockserver.MockOpenAIServer("127.0.0.1", 0, config).start()
+    print(f"Started mock OpenAI server at {mock.url}")
+    return mock.url, mock.get_stats
+
+
+def read_remote_stats(endpoint):
+    import urllib.request
+    try:
+        with urllib.request.urlopen(endpoint.rstrip('/') + "/mock/stats", timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return {} # not a mock server, or the stats are not available
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def print_table(title, results, columns):
+    print(f"\n{title}")
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(format_value(result.get(column)) for column in columns))
+
+
+def parse_list(value, item_type):
+    return [item_type(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark subtitle generation and optimization throughput.")
+    parser.add_argument("--durations", default="60", help="comma separated durations of the synthetic media files, in seconds")
+    parser.add_argument("--tts", action="store_true", help="synthesize speech with espeak-ng instead of using tone sequences")
+    parser.add_argument("--profiles", default=",".join(["fast", "accurate"]), help="comma separated decoding profiles to benchmark")
+    parser.add_argument("--skip-transcription", action="store_true", help="only benchmark the optimizer")
+    parser.add_argument("--cues", type=int, default=400, help="number of cues in the synthetic subtitles given to the optimizer")
+    parser.add_argument("--optimizer-tasks", default="10", help="comma separated values for OPTIMIZER_MAX_CONCURRENT_TASKS")
+    parser.add_argument("--optimizer-rate-limits", default="1", help="comma separated values for OPTIMIZER_RATE_LIMIT, in seconds")
+    parser.add_argument("--endpoint", default=None, help="use an already running (mock) server instead of starting one")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock server latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="mock server random extra latency, in seconds")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.05, help="mock server probability of random 429 responses")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="mock server simulated quota, 0 for unlimited")
+    parser.add_argument("--retry-after", type=int, default=1, help="mock server Retry-After header, in seconds")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    work_directory = tempfile.mkdtemp(prefix="otula-whisper-benchmark-")
+    os.chdir(work_directory)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+
+    results = []
+    if not args.skip_transcription:
+        media = create_media_corpus(work_directory, parse_list(args.durations, int), args.tts)
+        for profile in parse_list(args.profiles, str):
+            print(f"Benchmarking transcription, profile: {profile}")
+            results.append(benchmark_transcription(server, profile, media))
+
+    if args.endpoint:
+        endpoint = args.endpoint
+        stats_reader = lambda: read_remote_stats(endpoint)
+    else:
+        endpoint, stats_reader = start_mock_server(args)
+
+    srt = create_synthetic_srt(args.cues)
+    for max_concurrent_tasks in parse_list(args.optimizer_tasks, int):
+        for rate_limit in parse_list(args.optimizer_rate_limits, float):
+            print(f"Benchmarking optimization, concurrent tasks: {max_concurrent_tasks}, rate limit: {rate_limit}")
+            results.append(benchmark_optimizer(server, endpoint, stats_reader, srt, max_concurrent_tasks, rate_limit))
+
+    print_table("Transcription", [r for r in results if r["stage"] == "transcription"], ["profile", "model_load_time", "rtf", "jobs_per_hour", "peak_rss_mb"])
+    print_table("Optimization", [r for r in results if r["stage"] == "optimization"], ["max_concurrent_tasks", "rate_limit", "status", "chunks", "time", "chunk_time_mean", "chunk_time_p95", "rate_limited_responses", "jobs_per_hour", "peak_rss_mb"])
+
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {output_path}")
+
+    shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
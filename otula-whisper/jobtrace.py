@@ -0,0 +1,170 @@
+# Per-job tracing of the subtitle processing. The time spent in each step (upload, duration probe, language detection,
+# model load, decoding, optimizer chunks, rate limit waits, validation) is recorded as spans, which are stored in the
+# status storage and can be rendered as a timeline or exported in the Chrome trace event format (chrome://tracing,
+# https://ui.perfetto.dev or https://www.speedscope.app, which also open py-spy's output).
+#
+# Requires only the Python standard library.
+#
+# Usage:
+#   trace = jobtrace.JobTrace(job_id)
+#   with trace.span("generation"):                     # starts a trace in the current context
+#       with jobtrace.span("decode", model="small"):   # child of the current span, does nothing when there is no trace
+#           ...
+#       executor.submit(jobtrace.wrap(function))       # spans started by function in a pool thread are children of the current span
+#   status_storage.add_spans(job_id, trace.flush())
+#
+import contextlib
+import contextvars
+import cProfile
+import functools
+import html
+import os
+import threading
+import time
+import uuid
+
+_current = contextvars.ContextVar("jobtrace_current", default=(None, None)) # (trace, id of the current span)
+
+
+class JobTrace:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.spans = [] # finished spans, not yet flushed
+
+    #
+    # Records the time spent in the with block as a span, the spans started inside the block are its children
+    #
+    # @param attributes extra information shown with the span, e.g. the chunk number
+    # @return the span dict, attributes can be added to span["attributes"] inside the block
+    #
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        trace, parent = _current.get()
+        span = {"id": uuid.uuid4().hex[:16], "parent": parent if trace is self else None, "name": name, "start": time.time(), "end": None,
+                "process": os.getpid(), "thread": threading.current_thread().name, "attributes": attributes}
+        token = _current.set((self, span["id"]))
+        try:
+            yield span
+        except BaseException as e:
+            span["attributes"]["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            span["end"] = time.time()
+            _current.reset(token)
+            with self.lock:
+                self.spans.append(span)
+
+    #
+    # @return the finished spans since the previous flush
+    #
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+
+#
+# Records a span in the trace of the current context, or does nothing if no trace has been started
+#
+@contextlib.contextmanager
+def span(name, **attributes):
+    trace, parent = _current.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as current:
+        yield current
+
+#
+# @return the function bound to the current trace and span, for running it in another thread
+#
+def wrap(function):
+    return functools.partial(contextvars.copy_context().run, function)
+
+#
+# Captures a cProfile of the current thread in the with block, written to path in the pstats format
+# (view with: python3 -m pstats PATH, or e.g. snakeviz PATH)
+#
+@contextlib.contextmanager
+def capture_profile(path):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e: # only one profiler can be active at a time in Python 3.12+
+        print(f"Profile not captured for {path}: {e}")
+        yield None
+        return
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            profiler.dump_stats(path)
+            print(f"Profile written to {path}")
+        except OSError as e:
+            print(f"Failed to write profile {path}: {e}")
+
+#
+# @return the spans in the tree order (each span followed by its children, by start time) as (depth, span) tuples
+#
+def order_spans(spans):
+    ids = {span["id"] for span in spans}
+    children = {}
+    for span in sorted(spans, key=lambda s: s["start"]):
+        children.setdefault(span["parent"] if span["parent"] in ids else None, []).append(span)
+    ordered = []
+    def add(parent, depth):
+        for span in children.get(parent, []):
+            ordered.append((depth, span))
+            add(span["id"], depth + 1)
+    add(None, 0)
+    return ordered
+
+#
+# @return dict of span name => (count, total seconds), the largest total first
+#
+def summarize_spans(spans):
+    totals = {}
+    for span in spans:
+        count, seconds = totals.get(span["name"], (0, 0.0))
+        totals[span["name"]] = (count + 1, seconds + span["end"] - span["start"])
+    return dict(sorted(totals.items(), key=lambda item: item[1][1], reverse=True))
+
+#
+# @return html table of the spans with a bar showing the position of each span on the timeline of the job
+#
+def render_timeline(spans):
+    if not spans:
+        return "<p>No trace recorded.</p>"
+    start = min(span["start"] for span in spans)
+    total = max(max(span["end"] for span in spans) - start, 1e-6)
+    rows = []
+    for depth, span in order_spans(spans):
+        left = (span["start"] - start) / total * 100
+        width = max((span["end"] - span["start"]) / total * 100, 0.2)
+        attributes = ", ".join(f"{key}: {value}" for key, value in span["attributes"].items())
+        title = html.escape(f"process {span['process']}, thread {span['thread']}" + (f", {attributes}" if attributes else ""))
+        rows.append(f'<tr title="{title}"><td style="padding-left:{depth * 16}px">{html.escape(span["name"])}</td>'
+                    f'<td align="right">{span["start"] - start:.3f}</td><td align="right">{span["end"] - span["start"]:.3f}</td>'
+                    f'<td style="width:600px"><div style="margin-left:{left:.2f}%;width:{width:.2f}%;background:{"#c33" if "error" in span["attributes"] else "#36c"};height:12px"></div></td>'
+                    f'<td>{html.escape(attributes)}</td></tr>')
+    summary = "".join(f'<tr><td>{html.escape(name)}</td><td align="right">{count}</td><td align="right">{seconds:.3f}</td></tr>' for name, (count, seconds) in summarize_spans(spans).items())
+    return (f'<table><tr><th align="left">Span</th><th>Start (s)</th><th>Duration (s)</th><th align="left">Timeline ({total:.1f} s)</th><th align="left">Details</th></tr>{"".join(rows)}</table>'
+            f'<h2>Total time by span</h2><table><tr><th align="left">Span</th><th>Count</th><th>Total (s)</th></tr>{summary}</table>')
+
+#
+# @return the spans in the Chrome trace event format
+#
+def to_chrome_trace(spans):
+    thread_ids = {}
+    events = []
+    for span in sorted(spans, key=lambda s: s["start"]):
+        key = (span["process"], span["thread"])
+        if key not in thread_ids:
+            thread_ids[key] = len(thread_ids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": span["process"], "tid": thread_ids[key], "args": {"name": span["thread"]}})
+        events.append({"name": span["name"], "ph": "X", "ts": int(span["start"] * 1e6), "dur": int((span["end"] - span["start"]) * 1e6),
+                       "pid": span["process"], "tid": thread_ids[key], "args": span["attributes"]})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -1,33 +1,43 @@
 # python3 -m venv venv
 # source venv/bin/activate
 # pip install faster-whisper
-# pip install PyPDF2
+# pip install pymupdf (or pip install PyPDF2), see ../pdf-text-extractor
 # pip install openai
 # pip install flask
 # pip install moviepy
 # python3 server.py
 #
+# or in production, with several web server processes and separate worker processes (see worker.py):
+# pip install gunicorn
+# WORKER_MODE=external gunicorn --workers 4 --bind 0.0.0.0:10000 server:app
+# WORKER_MODE=external python3 worker.py --transcribe
+# WORKER_MODE=external python3 worker.py --optimize
+#
 # install instructions for other dependencies at: https://github.com/SYSTRAN/faster-whisper
 # - cuBLAS for CUDA 12 and cuDNN 8 for CUDA 12
 # if you get issues with unsupported types: https://github.com/SYSTRAN/faster-whisper/issues/42
 
 import base64
+import contextlib
+import json
+import os
+import sys
 import threading
 import sqlite3
 import uuid
 import time
-from faster_whisper import WhisperModel
 import io
-from pathlib import Path
-from openai import AzureOpenAI
-from PyPDF2 import PdfReader
-from PyPDF2.errors import PdfReadError
 import re
 from flask import Flask, request, redirect, send_file, jsonify, Response
 import concurrent.futures
 import svnrevisionchecker
-from moviepy.editor import VideoFileClip, AudioFileClip
+import spoolmanager
+import jobtrace
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pdf-text-extractor'))
+import pdfextract
 from datetime import datetime
+# faster_whisper, moviepy and openai are imported only when used, so that the web server processes (WORKER_MODE = "external")
+# start quickly and do not load them at all
 
 app = Flask(__name__)
 
@@ -35,6 +45,11 @@ PORT = 10000
 USERNAME = 'YOUR_USERNAME'
 PASSWORD = 'YOUR_PASSWORD'
 UPLOAD_FILE_DIRECTORY = "./files/"
+SPOOL_MAX_BYTES = 20 * 1024**3 # maximum total size of the files in UPLOAD_FILE_DIRECTORY, uploads exceeding this are refused with 503
+SPOOL_MIN_FREE_BYTES = 2 * 1024**3 # uploads are refused with 503 if the disk would have less free space than this
+SPOOL_RETRY_AFTER = 300 # Retry-After given to clients when uploads are refused, in seconds
+SPOOL_GC_INTERVAL = 600 # how often orphaned files are removed from UPLOAD_FILE_DIRECTORY, in seconds
+SPOOL_ORPHAN_MIN_AGE = 3600 # files not needed by any active job are removed when they are older than this, in seconds
 STATUS_QUEUED = 'not_started'
 STATUS_GENERATING = 'generating'
 STATUS_GENERATED = 'generated'
@@ -43,11 +58,41 @@ STATUS_GENERATION_FAILED = 'generation_failed'
 STATUS_OPTIMIZATION_FAILED = 'optimization_failed'
 STATUS_COMPLETED = 'completed'
 MODEL_SIZE = "medium"
-STATUS_STORAGE_FILE_PATH = "status_storage.db"
+DECODING_PROFILE_ACCURATE = 'accurate'
+DECODING_PROFILE_FAST = 'fast'
+# Whisper model and decoding settings, selectable per job from the upload form/api ("profile" field)
+#   model_size    = whisper model to use, e.g. "small", "medium", "large-v3" or "distil-large-v3" (english only)
+#   device        = "cpu" or "cuda"
+#   compute_type  = "int8" for CPU, "float16" or "int8" for GPU
+#   beam_size     = 1 for greedy decoding, larger values are slower but more accurate
+#   batch_size    = 0 to disable batching, otherwise the number of segments decoded in parallel using faster-whisper's BatchedInferencePipeline
+#   language_models = model_size overrides by language code (given by the user or detected), e.g. {"en": "medium.en"}
+#   label         = name of the profile shown in the upload form
+DECODING_PROFILES = {
+    DECODING_PROFILE_ACCURATE: {"model_size": MODEL_SIZE, "device": "cpu", "compute_type": "int8", "beam_size": 5, "batch_size": 0, "language_models": {}, "label": "Accurate (slow, for final subtitles)"},
+    DECODING_PROFILE_FAST: {"model_size": "small", "device": "cpu", "compute_type": "int8", "beam_size": 1, "batch_size": 8, "language_models": {}, "label": "Fast (draft quality)"}
+}
+DEFAULT_DECODING_PROFILE = DECODING_PROFILE_ACCURATE # used when the upload does not specify a profile
+LANGUAGE_DETECTION_MODEL_SIZE = "base" # small model used for detecting the language when it is not given by the user
+LANGUAGE_DETECTION_MAX_AUDIO_DURATION = 120 # how much audio from the beginning of the file is given to the language detection, in seconds. Silence is removed and the language is detected from the first 30 seconds of speech
+WHISPER_SAMPLING_RATE = 16000
+STATUS_STORAGE_FILE_PATH = os.environ.get("STATUS_STORAGE_FILE_PATH", "status_storage.db")
+STATUS_STORAGE_RESET = True # drop the stored statuses when server.py is started directly, never done under a WSGI server or in worker.py. The environment variable STATUS_STORAGE_RESET=0 disables.
+STATUS_STORAGE_TIMEOUT = 30 # how long to wait for the database lock held by another process, in seconds
+STATUS_STORAGE_ADDED_COLUMNS = [("decoding_profile", "TEXT"), ("language_detected", "TEXT"), ("capture_profile", "INTEGER DEFAULT 0")] # columns added to file_statuses after the first version, added to existing databases on startup
+# Where the subtitles are generated and optimized, can also be given as environment variable WORKER_MODE:
+#   "embedded" = in threads of the web server process, started when files are uploaded
+#   "external" = only in separate worker processes (worker.py), the web server only stores the jobs in the status storage
+WORKER_MODE_EMBEDDED = "embedded"
+WORKER_MODE_EXTERNAL = "external"
+WORKER_MODE = WORKER_MODE_EMBEDDED
+WORKER_POLL_INTERVAL = 5 # how often worker.py checks for new files to transcribe, in seconds
 SUBTITLE_OPTIMIZER_POLL_INTERVAL = 30 # how often the optimizer check for new jobs, in seconds
 STATUS_PAGE_REFRESH_INTERVAL = 30000 # how often the html status page is refreshed, in milliseconds
+TRACE_PROFILE_DIRECTORY = os.environ.get("TRACE_PROFILE_DIRECTORY", "./profiles/") # where the cProfile captures of the jobs uploaded with capture_profile are written
+TRACE_RETENTION = 7 * 24 * 60 * 60 # the trace spans and the cProfile captures of a job are removed this long after the job was last processed, in seconds
+TRACE_CLEANUP_INTERVAL = 3600 # how often the expired traces are removed, in seconds
 MAX_SUBTITLE_LINES_PER_ITERATION = 80
-SVN_REVISION = svnrevisionchecker.get_svn_revision()
 OPTIMIZER_RATE_LIMIT = 65 # how long to wait while between subtitle optimization spawns, in seconds
 OPTIMIZER_MAX_CONCURRENT_TASKS = 10 # maximum bumber of concurrent tasks
 OPTIMIZER_MAX_RETRY = 3 # how many times to retry individual failed call
@@ -57,21 +102,40 @@ SRT_TIMESTAMP_PATTERN = re.compile(r'^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d
 SRT_LAST_TIMESTAMP_FIND_PATTERN = re.compile(r'^\s*\d{2}:\d{2}:\d{2},\d{3}\s*-->\s*\d{2}:\d{2}:\d{2},\d{3}\s*$', re.MULTILINE) # for searching mathinc timestamp strings
 SRT_TIMESTAMP_FORMAT = "%H:%M:%S,%f"
 SRT_LAST_TIMESTAMP_MAX_INTERVAL = 5 # how much can the final timestamps differ in seconds
+# The client used by SubtitleOptimizer, the settings can also be given as environment variables with the same names:
+#   OPENAI_CLIENT_BACKEND = "azure" or "mock" (local mock server, see openai-mock-server directory)
+#   OPENAI_MOCK_ENDPOINT  = address of the mock server
+#   OPENAI_CASSETTE_MODE  = None, "record" (record the api calls to OPENAI_CASSETTE_FILE) or "replay" (answer the api calls from OPENAI_CASSETTE_FILE)
+OPENAI_CLIENT_BACKEND = "azure"
+OPENAI_MOCK_ENDPOINT = "http://127.0.0.1:10001"
+OPENAI_CASSETTE_MODE = None
+OPENAI_CASSETTE_FILE = "openai_cassette.jsonl"
+MOCK_SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openai-mock-server')
 
 #
 #
 #
 class SubtitleGenerator:
-    def __init__(self, model):
-        # Run on GPU with FP16
-        #self.model = WhisperModel(MODEL_SIZE, device="cuda", compute_type="float16")
-
-        # or run on GPU with INT8
-        # self.model = WhisperModel(MODEL_SIZE, device="cuda", compute_type="int8")
-        # or run on CPU with INT8
-        self.model = WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8")
+    def __init__(self, profile, model_size=None):
+        # The device and compute type are given in DECODING_PROFILES, e.g.
+        # Run on GPU with FP16: "device": "cuda", "compute_type": "float16"
+        # or run on GPU with INT8: "device": "cuda", "compute_type": "int8"
+        # or run on CPU with INT8: "device": "cpu", "compute_type": "int8"
+        from faster_whisper import WhisperModel, BatchedInferencePipeline
+        self.profile = DECODING_PROFILES[profile]
+        if model_size is None:
+            model_size = self.profile["model_size"]
+        self.model = WhisperModel(model_size, device=self.profile["device"], compute_type=self.profile["compute_type"])
+        if self.profile["batch_size"] > 0:
+            self.pipeline = BatchedInferencePipeline(model=self.model)
+        else:
+            self.pipeline = self.model
 
-    def generate_subtitles(self, input_file_path, lang):
+    #
+    # @param audio the path to the media file or the decoded audio (e.g. from LanguageDetector.load_audio())
+    # @param lang the language code, or empty string to detect the language during transcription
+    #
+    def generate_subtitles(self, audio, lang):
         start_time = time.time()
         print("Starting to process...")
 
@@ -80,22 +144,25 @@ class SubtitleGenerator:
         try:
             decoding_options = {
                 "no_speech_threshold": 0.6,
-                "beam_size": 5,
+                "beam_size": self.profile["beam_size"],
                 "vad_filter": True 
                 #"temperature": [0.0]
             }
-
-            if len(lang) > 0:
-                decoding_options["language"] = lang
-                segments, info = self.model.transcribe(input_file_path, **decoding_options)
-                print(f"Language given by the user: {lang}")
-            else:
-                segments, info = self.model.transcribe(input_file_path, **decoding_options)
+            if self.profile["batch_size"] > 0:
+                decoding_options["batch_size"] = self.profile["batch_size"]
+
+            with jobtrace.span("vad_and_features", batch_size=self.profile["batch_size"]): # VAD, feature extraction and language detection are run before the segments are decoded
+                if len(lang) > 0:
+                    decoding_options["language"] = lang
+                    segments, info = self.pipeline.transcribe(audio, **decoding_options)
+                    print(f"Language given: {lang}")
+                else:
+                    segments, info = self.pipeline.transcribe(audio, **decoding_options)
             print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
 
             # Assuming 'segments' is a list of objects with 'start', 'end', and 'text' attributes
             index = 1
-            with io.StringIO() as output:
+            with io.StringIO() as output, jobtrace.span("decode", beam_size=self.profile["beam_size"]) as decode_span:
                 index = 1
                 for segment in segments:
                     # Convert the start and end times from seconds to SRT time format
@@ -115,6 +182,8 @@ class SubtitleGenerator:
                     output.write(f"{segment.text}\n\n")
                     index += 1
                 subtitles = output.getvalue()
+                if decode_span is not None:
+                    decode_span["attributes"]["segments"] = index - 1
 
             end_time = time.time()
             print(f"Subtitle generation finished in {end_time - start_time} seconds.")
@@ -124,11 +193,44 @@ class SubtitleGenerator:
         return subtitles
 
 
+#
+# Lightweight language detection run before the actual transcription, using a small model
+#
+class LanguageDetector:
+    def __init__(self):
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load_audio(self, input_file_path):
+        from faster_whisper import decode_audio
+        return decode_audio(input_file_path, sampling_rate=WHISPER_SAMPLING_RATE)
+
+    #
+    # @param audio the decoded audio (see load_audio())
+    # @return the detected language code or empty string on failure
+    #
+    def detect_language(self, audio):
+        start_time = time.time()
+        try:
+            with self.lock:
+                if self.model is None:
+                    from faster_whisper import WhisperModel
+                    print(f"Creating language detection model: {LANGUAGE_DETECTION_MODEL_SIZE}...")
+                    self.model = WhisperModel(LANGUAGE_DETECTION_MODEL_SIZE, device="cpu", compute_type="int8")
+                # the segments are generated lazily, so only the language detection is run here
+                segments, info = self.model.transcribe(audio[:LANGUAGE_DETECTION_MAX_AUDIO_DURATION * WHISPER_SAMPLING_RATE], beam_size=1, vad_filter=True)
+            print(f"Pre-detected language '{info.language}' with probability {info.language_probability} in {time.time() - start_time} seconds.")
+            return info.language
+        except Exception as e:
+            print(f"Exception during language detection: {e}")
+            return ""
+
+
 #
 #
 #
 class FileStatus:
-    def __init__(self, uuid, filename, video_filepath, meta_filepath, status, srt, srt_optimized, language, timestamp_uploaded, timestamp_generation_started, timestamp_generation_completed, timestamp_optimization_started, timestamp_optimization_completed, video_duration):
+    def __init__(self, uuid, filename, video_filepath, meta_filepath, status, srt, srt_optimized, language, timestamp_uploaded, timestamp_generation_started, timestamp_generation_completed, timestamp_optimization_started, timestamp_optimization_completed, video_duration, decoding_profile, language_detected, capture_profile=0):
         self.uuid = uuid
         self.filename = filename
         self.video_filepath = video_filepath
@@ -143,21 +245,43 @@ class FileStatus:
         self.timestamp_optimization_started = timestamp_optimization_started  # Unix timestamp when optimization started
         self.timestamp_optimization_completed = timestamp_optimization_completed  # Unix timestamp when optimization completed
         self.video_duration = video_duration  # Duration of the video in seconds
+        self.decoding_profile = decoding_profile  # Key of DECODING_PROFILES used for generating the subtitles
+        self.language_detected = language_detected  # Language detected in the pre-pass when the language was not given by the user
+        self.capture_profile = capture_profile  # 1 if a cProfile of the processing is written to TRACE_PROFILE_DIRECTORY
 
 
 #
 # ChatGPT generated SQLite handler for the status storage, if it gives issues, use the in-memory version above
 #
+# The database can be shared by several processes (web server processes and workers), the files are claimed with
+# claim_next_file() so that each file is processed only once.
+#
 class StatusStorage:
     def __init__(self, db_name=STATUS_STORAGE_FILE_PATH):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn = sqlite3.connect(db_name, check_same_thread=False, timeout=STATUS_STORAGE_TIMEOUT)
         self.lock = threading.Lock()
         self._create_table()
 
     def _create_table(self):
-        with self.conn:
-            self.conn.execute("DROP TABLE IF EXISTS file_statuses") # drop existing tables
-            self.conn.execute("CREATE TABLE IF NOT EXISTS file_statuses (uuid TEXT PRIMARY KEY, filename TEXT, video_filepath TEXT, meta_filepath TEXT, status TEXT, srt TEXT, srt_optimized TEXT, language TEXT, timestamp_uploaded INTEGER, timestamp_generation_started INTEGER, timestamp_generation_completed INTEGER, timestamp_optimization_started INTEGER, timestamp_optimization_completed INTEGER, video_duration INTEGER)")
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL") # readers in other processes do not block the writer
+            with self.conn:
+                self.conn.execute("CREATE TABLE IF NOT EXISTS file_statuses (uuid TEXT PRIMARY KEY, filename TEXT, video_filepath TEXT, meta_filepath TEXT, status TEXT, srt TEXT, srt_optimized TEXT, language TEXT, timestamp_uploaded INTEGER, timestamp_generation_started INTEGER, timestamp_generation_completed INTEGER, timestamp_optimization_started INTEGER, timestamp_optimization_completed INTEGER, video_duration INTEGER, decoding_profile TEXT, language_detected TEXT, capture_profile INTEGER DEFAULT 0)")
+                columns = [row[1] for row in self.conn.execute("PRAGMA table_info(file_statuses)")]
+                for column, definition in STATUS_STORAGE_ADDED_COLUMNS: # database created before the columns were added
+                    if column not in columns:
+                        self.conn.execute(f"ALTER TABLE file_statuses ADD COLUMN {column} {definition}")
+                self.conn.execute("CREATE TABLE IF NOT EXISTS job_spans (uuid TEXT, span_id TEXT, parent_id TEXT, name TEXT, start REAL, end REAL, process INTEGER, thread TEXT, attributes TEXT)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS job_spans_uuid ON job_spans (uuid)")
+
+    #
+    # Removes all stored statuses, do not call while other processes are using the database
+    #
+    def reset(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM file_statuses")
+                self.conn.execute("DELETE FROM job_spans")
 
     #
     # Retrieve the next file (oldest timestamp_uploaded first) which has the given status.
@@ -171,6 +295,28 @@ class StatusStorage:
                 return FileStatus(*row)
         return None
 
+    #
+    # Atomically retrieves the next file (oldest timestamp_uploaded first) which has the given status and changes its
+    # status to new_status (see update_status()). The database is locked for writing in between, so two threads or
+    # processes never claim the same file.
+    #
+    # @return the file with the new status, or None if there are no files with the given status
+    #
+    def claim_next_file(self, status, new_status):
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute("SELECT uuid FROM file_statuses WHERE status = ? ORDER BY timestamp_uploaded ASC LIMIT 1", (status,)).fetchone()
+                if row:
+                    self._update_status(row[0], new_status)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        if row:
+            return self.get_status(row[0])
+        return None
+
     def get_status(self, uuid):
         with self.lock:
             cur = self.conn.cursor()
@@ -181,10 +327,9 @@ class StatusStorage:
         return None
 
     def set_status(self, status):
-        print("settings: " + status.language)
         with self.lock:
             with self.conn:
-                self.conn.execute("INSERT OR REPLACE INTO file_statuses (uuid, filename, video_filepath, meta_filepath, status, srt, srt_optimized, language, timestamp_uploaded, timestamp_generation_started, timestamp_generation_completed, timestamp_optimization_started, timestamp_optimization_completed, video_duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (status.uuid, status.filename, status.video_filepath, status.meta_filepath, status.status, status.srt, status.srt_optimized, status.language, status.timestamp_uploaded, status.timestamp_generation_started, status.timestamp_generation_completed, status.timestamp_optimization_started, status.timestamp_optimization_completed, status.video_duration))
+                self.conn.execute("INSERT OR REPLACE INTO file_statuses (uuid, filename, video_filepath, meta_filepath, status, srt, srt_optimized, language, timestamp_uploaded, timestamp_generation_started, timestamp_generation_completed, timestamp_optimization_started, timestamp_optimization_completed, video_duration, decoding_profile, language_detected, capture_profile) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (status.uuid, status.filename, status.video_filepath, status.meta_filepath, status.status, status.srt, status.srt_optimized, status.language, status.timestamp_uploaded, status.timestamp_generation_started, status.timestamp_generation_completed, status.timestamp_optimization_started, status.timestamp_optimization_completed, status.video_duration, status.decoding_profile, status.language_detected, status.capture_profile))
 
     #
     # Convenience method for updating status information for on file status object
@@ -198,16 +343,19 @@ class StatusStorage:
     def update_status(self, uuid, new_status):
         with self.lock:
             with self.conn:
-                if new_status == STATUS_GENERATING:
-                    self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_generation_started = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
-                elif new_status == STATUS_GENERATED or new_status == STATUS_GENERATION_FAILED:
-                    self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_generation_completed = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
-                elif new_status == STATUS_OPTIMIZING:
-                    self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_optimization_started = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
-                elif new_status == STATUS_COMPLETED or new_status == STATUS_OPTIMIZATION_FAILED:
-                    self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_optimization_completed = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
-                else:
-                    self.conn.execute("UPDATE file_statuses SET status = ? WHERE uuid = ?", (new_status, uuid))
+                self._update_status(uuid, new_status)
+
+    def _update_status(self, uuid, new_status):
+        if new_status == STATUS_GENERATING:
+            self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_generation_started = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
+        elif new_status == STATUS_GENERATED or new_status == STATUS_GENERATION_FAILED:
+            self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_generation_completed = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
+        elif new_status == STATUS_OPTIMIZING:
+            self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_optimization_started = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
+        elif new_status == STATUS_COMPLETED or new_status == STATUS_OPTIMIZATION_FAILED:
+            self.conn.execute("UPDATE file_statuses SET status = ?, timestamp_optimization_completed = ? WHERE uuid = ?", (new_status, int(time.time()), uuid))
+        else:
+            self.conn.execute("UPDATE file_statuses SET status = ? WHERE uuid = ?", (new_status, uuid))
 
     def set_subtitles(self, uuid, srt):
         with self.lock:
@@ -219,11 +367,50 @@ class StatusStorage:
             with self.conn:
                 self.conn.execute("UPDATE file_statuses SET srt_optimized = ? WHERE uuid = ?", (srt_optimized, uuid))
 
+    def set_detected_language(self, uuid, language_detected):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("UPDATE file_statuses SET language_detected = ? WHERE uuid = ?", (language_detected, uuid))
+
+    def set_video_duration(self, uuid, video_duration):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("UPDATE file_statuses SET video_duration = ? WHERE uuid = ?", (video_duration, uuid))
+
     def set_meta(self, uuid, meta_filepath):
         with self.lock:
             with self.conn:
                 self.conn.execute("UPDATE file_statuses SET meta_filepath = ? WHERE uuid = ?", (meta_filepath, uuid))
 
+    #
+    # Stores the trace spans of the job (see jobtrace.JobTrace.flush()), the spans of a job can be added by several processes
+    #
+    def add_spans(self, uuid, spans):
+        if not spans:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.executemany("INSERT INTO job_spans (uuid, span_id, parent_id, name, start, end, process, thread, attributes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      [(uuid, span["id"], span["parent"], span["name"], span["start"], span["end"], span["process"], span["thread"], json.dumps(span["attributes"], default=str)) for span in spans])
+
+    #
+    # @return the trace spans of the job in the format of jobtrace, in the order they were started
+    #
+    def get_spans(self, uuid):
+        with self.lock:
+            rows = self.conn.execute("SELECT span_id, parent_id, name, start, end, process, thread, attributes FROM job_spans WHERE uuid = ? ORDER BY start", (uuid,)).fetchall()
+        return [{"id": row[0], "parent": row[1], "name": row[2], "start": row[3], "end": row[4], "process": row[5], "thread": row[6], "attributes": json.loads(row[7])} for row in rows]
+
+    #
+    # Removes the trace spans of the jobs whose last span ended before the given time
+    #
+    # @return number of removed spans
+    #
+    def delete_spans_before(self, timestamp):
+        with self.lock:
+            with self.conn:
+                return self.conn.execute("DELETE FROM job_spans WHERE uuid IN (SELECT uuid FROM job_spans GROUP BY uuid HAVING MAX(end) < ?)", (timestamp,)).rowcount
+
 #
 #
 #
@@ -245,6 +432,7 @@ class VideoConverter:
     def calculate_video_duration(self, file_path):
         duration = -1
         try:
+            from moviepy.editor import VideoFileClip
             clip = VideoFileClip(file_path)
             duration = clip.duration  # duration in seconds
             clip.close()
@@ -256,6 +444,7 @@ class VideoConverter:
     def calculate_audio_duration(self, file_path):
         duration = -1
         try:
+            from moviepy.editor import AudioFileClip
             clip = AudioFileClip(file_path)
             duration = clip.duration  # duration in seconds
             clip.close()
@@ -267,10 +456,14 @@ class VideoConverter:
 #
 #
 class VideoProcessor:
-    def __init__(self, status_storage):
+    def __init__(self, status_storage, spool_manager):
         self.thread = None
         self.lock = threading.Lock()
         self.status_storage = status_storage
+        self.spool_manager = spool_manager
+        self.generators = {} # generators (and the loaded models) by decoding profile and model size, kept between processing threads
+        self.language_detector = LanguageDetector()
+        self.converter = VideoConverter()
 
     def start_thread(self):
         with self.lock:
@@ -281,58 +474,144 @@ class VideoProcessor:
             print("Starting a new thread...")
             self.thread.start()
 
+    #
+    # Returns the generator for the given profile, using a language specific model if one is configured for the language
+    #
+    def get_generator(self, profile, language):
+        if profile not in DECODING_PROFILES:
+            print(f"Unknown decoding profile: {profile}, using {DEFAULT_DECODING_PROFILE}")
+            profile = DEFAULT_DECODING_PROFILE
+        model_size = DECODING_PROFILES[profile]["language_models"].get(language, DECODING_PROFILES[profile]["model_size"])
+        generator = self.generators.get((profile, model_size))
+        if generator is None:
+            print(f"Creating subtitle generator for profile: {profile}, model: {model_size}...")
+            with jobtrace.span("model_load", model=model_size):
+                generator = SubtitleGenerator(profile, model_size)
+            self.generators[(profile, model_size)] = generator
+        return generator
+
+    #
+    # Resolves the language for the file. If the user did not give the language, it is detected from the beginning
+    # of the file and cached in the status storage, so that the detection is not repeated for the job.
+    #
+    # @return tuple of language code (or empty string if unknown) and the decoded audio (or the file path if the audio was not decoded)
+    #
+    def resolve_language(self, fs):
+        if fs.language:
+            return fs.language, fs.video_filepath
+        if fs.language_detected:
+            print(f"Using previously detected language: {fs.language_detected}")
+            return fs.language_detected, fs.video_filepath
+        try:
+            with jobtrace.span("audio_decode"):
+                audio = self.language_detector.load_audio(fs.video_filepath) # decoded only once, the same audio is given to the main decode
+        except Exception as e:
+            print(f"Exception while decoding audio for language detection: {e}")
+            return "", fs.video_filepath
+        with jobtrace.span("language_detection", model=LANGUAGE_DETECTION_MODEL_SIZE) as detection_span:
+            language = self.language_detector.detect_language(audio)
+            if detection_span is not None:
+                detection_span["attributes"]["language"] = language
+        if language:
+            self.status_storage.set_detected_language(fs.uuid, language)
+        return language, audio
+
+    #
+    # Processes files until there are no more queued files
+    #
     def process_video(self):
-        print("Creating subtitle generator...")
-        generator = SubtitleGenerator(MODEL_SIZE)
-        fs = self.status_storage.next_file(STATUS_QUEUED)
-        while fs is not None:
-            print(f"Processing file: {fs.uuid} / {fs.video_filepath}")
-            self.status_storage.update_status(fs.uuid, STATUS_GENERATING)
-            srt = generator.generate_subtitles(fs.video_filepath, fs.language)
+        try:
+            fs = self.status_storage.claim_next_file(STATUS_QUEUED, STATUS_GENERATING)
+            while fs is not None:
+                self.process_file(fs)
+                fs = self.status_storage.claim_next_file(STATUS_QUEUED, STATUS_GENERATING)
+        finally:
+            with self.lock:
+                self.thread = None # a new thread can be started for the next upload, also if this one failed
+        print("Processing finished for all active video files.")
+
+    #
+    # Generates the subtitles of a claimed file, the file is marked as failed if the generation raises an exception
+    #
+    def process_file(self, fs):
+        print(f"Processing file: {fs.uuid} / {fs.video_filepath} (profile: {fs.decoding_profile})")
+        srt = ''
+        trace = jobtrace.JobTrace(fs.uuid)
+        try:
+            with capture_job_profile(fs, "generation") as profile_path, trace.span("generation", profile=fs.decoding_profile, pid=os.getpid(), thread_id=threading.get_native_id(), profile_file=profile_path):
+                with jobtrace.span("duration_probe"):
+                    self.status_storage.set_video_duration(fs.uuid, self.converter.calculate_duration(fs.video_filepath)) # probed here instead of in the upload request
+                language, audio = self.resolve_language(fs)
+                generator = self.get_generator(fs.decoding_profile, language)
+                srt = generator.generate_subtitles(audio, language)
+                audio = None
+        except Exception as e:
+            print(f"Exception while generating subtitles for {fs.uuid}: {e}")
+        try:
+            self.status_storage.add_spans(fs.uuid, trace.flush())
             if srt:
                 self.status_storage.set_subtitles(fs.uuid, srt)
                 self.status_storage.update_status(fs.uuid, STATUS_GENERATED)
             else:
                 self.status_storage.update_status(fs.uuid, STATUS_GENERATION_FAILED)
-            Path(fs.video_filepath).unlink()
-            fs = self.status_storage.next_file(STATUS_QUEUED)
-        with self.lock:
-            self.thread = None
-        print("Processing finished for all active video files.")
+        finally:
+            self.spool_manager.release(fs.uuid, fs.video_filepath)
+
+    #
+    # Processes files forever, checking for new files every poll_interval seconds (used by worker.py)
+    #
+    def run_forever(self, poll_interval):
+        while True:
+            try:
+                self.process_video()
+            except Exception as e:
+                print(f"Exception while processing files: {e}")
+            time.sleep(poll_interval)
 
 #
 #
 #
 #
 class SubtitleOptimizer:
-    def __init__(self, status_storage):
+    def __init__(self, status_storage, spool_manager):
         self.thread = None
         self.lock = threading.Lock()
         self.model_engine = "gpt-4o-mini"
-        self.azure_api_key = "YOUR_AZURE_API_KEY"
+        self.azure_api_key = os.environ.get("AZURE_OPENAI_API_KEY", "YOUR_AZURE_API_KEY")
         self.azure_api_version = "2024-02-15-preview"
-        self.azure_endpoint = "YOUR_AZURE_ENDPOINT_URI"
+        self.azure_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT", "YOUR_AZURE_ENDPOINT_URI")
         self.ai_temperature = 0.0
         self.status_storage = status_storage
+        self.spool_manager = spool_manager
 
     def start_thread(self):
         with self.lock:
             if self.thread is not None:
                 print("Already optimizing, not starting a new thread...")
                 return
-            self.thread = threading.Thread(target=self.optimize_subtitles)
+            self.thread = threading.Thread(target=self.run_forever, args=(SUBTITLE_OPTIMIZER_POLL_INTERVAL,))
             print("Starting a new thread...")
             self.thread.start()
 
-    def optimize_subtitles(self):
-        client = AzureOpenAI(
-            api_key=self.azure_api_key,
+    def create_client(self):
+        from openai import AzureOpenAI
+        azure_api_key = self.azure_api_key
+        azure_endpoint = self.azure_endpoint
+        if os.environ.get("OPENAI_CLIENT_BACKEND", OPENAI_CLIENT_BACKEND) == "mock":
+            azure_api_key = "mock"
+            azure_endpoint = os.environ.get("OPENAI_MOCK_ENDPOINT", OPENAI_MOCK_ENDPOINT)
+        return AzureOpenAI(
+            api_key=azure_api_key,
             api_version=self.azure_api_version,
-            azure_endpoint=self.azure_endpoint
+            azure_endpoint=azure_endpoint,
+            http_client=create_cassette_http_client()
         )
 
+    def optimize_subtitles(self):
+        client = self.create_client()
+
         while True:
-            fs = self.status_storage.next_file(STATUS_GENERATED)
+            fs = self.status_storage.claim_next_file(STATUS_GENERATED, STATUS_OPTIMIZING)
             if fs is None:
                 print(f"No subtitles to optimize. Sleeping for {SUBTITLE_OPTIMIZER_POLL_INTERVAL} seconds...")
                 time.sleep(SUBTITLE_OPTIMIZER_POLL_INTERVAL)
@@ -343,81 +622,123 @@ class SubtitleOptimizer:
                 self.status_storage.update_status(fs.uuid, STATUS_COMPLETED)
                 continue
 
-            print(f"Processing file: {fs.uuid} / {fs.meta_filepath}")
-            self.status_storage.update_status(fs.uuid, STATUS_OPTIMIZING)
-            meta = self.extract_text_from_pdf(fs.meta_filepath)
-            if not meta:
-                o_status = STATUS_OPTIMIZATION_FAILED
-                print("Subtitle optimization failed.")
-            else:
-                try:
-                    sprompt = self.create_system_prompt(meta)
-
-                    o_status = STATUS_COMPLETED
-                    splitted_srt = self.split_subtitles(fs.srt)
+            self.optimize_file(client, fs)
 
-                    print(f"Spawning {len(splitted_srt)} optimizers for generated subtitles.")
-                    start_time = time.time()
-
-                    processed_blocks = [None] * len(splitted_srt)
+    #
+    # Optimizes the subtitles of a claimed file, the file is marked as failed if the optimization raises an exception
+    #
+    def optimize_file(self, client, fs):
+        print(f"Processing file: {fs.uuid} / {fs.meta_filepath}")
+        o_status = STATUS_OPTIMIZATION_FAILED
+        trace = jobtrace.JobTrace(fs.uuid)
+        try:
+            with capture_job_profile(fs, "optimization") as profile_path, trace.span("optimization", pid=os.getpid(), thread_id=threading.get_native_id(), profile_file=profile_path) as optimization_span:
+                with jobtrace.span("pdf_extract"):
+                    meta = self.extract_text_from_pdf(fs.meta_filepath)
+                if not meta:
+                    print("Subtitle optimization failed.")
+                else:
+                    o_status, optimized_srt = self.optimize_srt(client, meta, fs.srt)
+                    if optimized_srt is not None:
+                        self.status_storage.set_optimized_subtitles(fs.uuid, optimized_srt) # set the subtitles even if incorrect so that we can see the result
+                optimization_span["attributes"]["status"] = o_status
+        except Exception as e:
+            print(f"Exception while optimizing subtitles for {fs.uuid}: {e}")
+            o_status = STATUS_OPTIMIZATION_FAILED
+        try:
+            self.status_storage.add_spans(fs.uuid, trace.flush())
+            self.status_storage.update_status(fs.uuid, o_status)
+        finally:
+            self.spool_manager.release(fs.uuid, fs.meta_filepath)
 
-                    # Loop through the splitted_srt in chunks of OPTIMIZER_MAX_CONCURRENT_TASKS
-                    for i in range(0, len(splitted_srt), OPTIMIZER_MAX_CONCURRENT_TASKS):
-                        # Create a batch of tasks
-                        batch = splitted_srt[i:i + OPTIMIZER_MAX_CONCURRENT_TASKS]
-                        futures = {}
+    #
+    # Optimizes subtitles forever, restarting optimize_subtitles() after poll_interval seconds if it fails (e.g. when
+    # the client cannot be created or the status storage is not available)
+    #
+    def run_forever(self, poll_interval):
+        while True:
+            try:
+                self.optimize_subtitles()
+            except Exception as e:
+                print(f"Exception while optimizing subtitles: {e}")
+            time.sleep(poll_interval)
 
-                        with concurrent.futures.ThreadPoolExecutor() as executor:
-                            # Submit tasks for the current batch
-                            futures = {
-                                executor.submit(self.run_optimization, client, sprompt, block): idx 
-                                for idx, block in enumerate(batch, start=i)
-                            }
+    #
+    # Optimize the given subtitles using the given reference material
+    #
+    # @param client the client to use
+    # @param meta the reference material as text
+    # @param srt the subtitles to optimize
+    # @return tuple of status (STATUS_COMPLETED or STATUS_OPTIMIZATION_FAILED) and the optimized subtitles (None if the optimization did not produce any)
+    #
+    def optimize_srt(self, client, meta, srt):
+        start_time = time.time()
+        optimized_srt = None
+        try:
+            sprompt = self.create_system_prompt(meta)
 
-                            try:
-                                for future in concurrent.futures.as_completed(futures):
-                                    idx = futures[future]
-                                    try:
-                                        r = future.result()
-                                        r = self.cleanup_srt(r)
-                                        if r is None or not self.validate_last_timestamp(splitted_srt[idx], r): # check that we get results and that the last timestamp is approximately correct
-                                            print("Optimization failed: last timestamp(s) does not match.")
-                                            o_status = STATUS_OPTIMIZATION_FAILED
-                                        processed_blocks[idx] = r # let's assign so that we can see the end result, even if it is incorrect
-                                    except Exception as e:
-                                        print(f"Exception during optimization: {e}")
-                                        o_status = STATUS_OPTIMIZATION_FAILED
-                                        for f in futures.keys():  # something has gone seriously wrong, we should cancel at this point
-                                            if not f.done():
-                                                f.cancel()
-                                        break  # Optionally break out of the loop to stop processing further
-                            except Exception as e:
-                                print(f"Critical error during optimization: {e}")
-                                o_status = STATUS_OPTIMIZATION_FAILED
+            o_status = STATUS_COMPLETED
+            splitted_srt = self.split_subtitles(srt)
 
-                        # If there are more tasks to process, wait before starting the next batch
-                        if o_status == STATUS_COMPLETED and i + OPTIMIZER_MAX_CONCURRENT_TASKS < len(splitted_srt):
-                            print(f"Waiting for {OPTIMIZER_RATE_LIMIT} seconds before processing the next batch...")
-                            time.sleep(OPTIMIZER_RATE_LIMIT)
+            print(f"Spawning {len(splitted_srt)} optimizers for generated subtitles.")
 
-                    optimized_srt = '\n\n'.join(processed_blocks) # let's join so that we can see the end reseult, even if it is incorrect
+            processed_blocks = [None] * len(splitted_srt)
 
-                    if o_status == STATUS_COMPLETED:
-                        if not self.validate_srt(optimized_srt):
-                            print("Subtitle validation failed.")
-                            o_status = STATUS_OPTIMIZATION_FAILED
+            # Loop through the splitted_srt in chunks of OPTIMIZER_MAX_CONCURRENT_TASKS
+            for i in range(0, len(splitted_srt), OPTIMIZER_MAX_CONCURRENT_TASKS):
+                # Create a batch of tasks
+                batch = splitted_srt[i:i + OPTIMIZER_MAX_CONCURRENT_TASKS]
+                futures = {}
 
-                    self.status_storage.set_optimized_subtitles(fs.uuid, optimized_srt) # set the subtitles even if incorrect so that we can see the result
+                with concurrent.futures.ThreadPoolExecutor() as executor:
+                    # Submit tasks for the current batch
+                    futures = {
+                        executor.submit(jobtrace.wrap(self.run_traced_optimization), client, sprompt, block, idx): idx
+                        for idx, block in enumerate(batch, start=i)
+                    }
 
-                except Exception as e:
-                    print(f"Failed to optimize subtitles: {str(e)}")
+                    try:
+                        for future in concurrent.futures.as_completed(futures):
+                            idx = futures[future]
+                            try:
+                                r = future.result()
+                                r = self.cleanup_srt(r)
+                                if r is None or not self.validate_last_timestamp(splitted_srt[idx], r): # check that we get results and that the last timestamp is approximately correct
+                                    print("Optimization failed: last timestamp(s) does not match.")
+                                    o_status = STATUS_OPTIMIZATION_FAILED
+                                processed_blocks[idx] = r # let's assign so that we can see the end result, even if it is incorrect
+                            except Exception as e:
+                                print(f"Exception during optimization: {e}")
+                                o_status = STATUS_OPTIMIZATION_FAILED
+                                for f in futures.keys():  # something has gone seriously wrong, we should cancel at this point
+                                    if not f.done():
+                                        f.cancel()
+                                break  # Optionally break out of the loop to stop processing further
+                    except Exception as e:
+                        print(f"Critical error during optimization: {e}")
+                        o_status = STATUS_OPTIMIZATION_FAILED
+
+                # If there are more tasks to process, wait before starting the next batch
+                if o_status == STATUS_COMPLETED and i + OPTIMIZER_MAX_CONCURRENT_TASKS < len(splitted_srt):
+                    print(f"Waiting for {OPTIMIZER_RATE_LIMIT} seconds before processing the next batch...")
+                    with jobtrace.span("batch_wait"):
+                        time.sleep(OPTIMIZER_RATE_LIMIT)
+
+            optimized_srt = '\n\n'.join(processed_blocks) # let's join so that we can see the end reseult, even if it is incorrect
+
+            if o_status == STATUS_COMPLETED:
+                with jobtrace.span("validation"):
+                    valid = self.validate_srt(optimized_srt)
+                if not valid:
+                    print("Subtitle validation failed.")
                     o_status = STATUS_OPTIMIZATION_FAILED
 
-                print(f"Subtitle optimization finished in {time.time() - start_time} seconds.")
-
-            self.status_storage.update_status(fs.uuid, o_status)
+        except Exception as e:
+            print(f"Failed to optimize subtitles: {str(e)}")
+            o_status = STATUS_OPTIMIZATION_FAILED
 
-            Path(fs.meta_filepath).unlink()
+        print(f"Subtitle optimization finished in {time.time() - start_time} seconds.")
+        return o_status, optimized_srt
 
     def cleanup_srt(self, srt):
         valid_lines = []
@@ -495,6 +816,13 @@ class SubtitleOptimizer:
         return splitted_sub
 
 
+    #
+    # Runs run_optimization() for one chunk of the subtitles, recorded as a span of the job trace
+    #
+    def run_traced_optimization(self, client, system_prompt, subtitles, index):
+        with jobtrace.span("optimizer_chunk", chunk=index, characters=len(subtitles)):
+            return self.run_optimization(client, system_prompt, subtitles)
+
     def run_optimization(self, client, system_prompt, subtitles):
         messages = [
             {"role": "system", "content": system_prompt},
@@ -503,11 +831,12 @@ class SubtitleOptimizer:
 
         for attempt in range(OPTIMIZER_MAX_RETRY):
             try:
-                response = client.chat.completions.create(
-                    model=self.model_engine,
-                    messages=messages,
-                    temperature=self.ai_temperature
-                )
+                with jobtrace.span("api_call", attempt=attempt):
+                    response = client.chat.completions.create(
+                        model=self.model_engine,
+                        messages=messages,
+                        temperature=self.ai_temperature
+                    )
                 choice = response.choices[0]
                 if choice.finish_reason == "stop":
                     return choice.message.content
@@ -518,7 +847,8 @@ class SubtitleOptimizer:
                 error_code = getattr(e, 'status_code', None)
                 if error_code == 429:
                     print(f"Rate limit exceeded. Retrying in {OPTIMIZER_RATE_LIMIT} seconds...")
-                    time.sleep(OPTIMIZER_RATE_LIMIT)
+                    with jobtrace.span("rate_limit_sleep"):
+                        time.sleep(OPTIMIZER_RATE_LIMIT)
                     continue  # Retry the request
                 else:
                     print(f"An unexpected error occurred: {str(e)}")
@@ -530,12 +860,8 @@ class SubtitleOptimizer:
 
     def extract_text_from_pdf(self, pdf_path):
         try:
-            reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + " "  # Space added to avoid merging words
-            return " ".join(text.split())  # Remove excessive whitespace
-        except PdfReadError as e:
+            return pdfextract.extract_text(pdf_path, page_workers=1) # no extra processes from the threads of the server
+        except pdfextract.PdfExtractionError as e:
             print(f"Error reading PDF file: {e}")
             return ""
         except Exception as e:
@@ -543,10 +869,123 @@ class SubtitleOptimizer:
             return ""
 
 
+#
+# Tells the spool manager whether an uploaded file is still needed, i.e. it belongs to a job which has not yet been processed
+#
+def is_spool_file_active(job_id, file_path):
+    fs = status_storage.get_status(job_id)
+    if fs is None:
+        return False
+    file_path = os.path.normpath(file_path)
+    if fs.video_filepath and file_path == os.path.normpath(fs.video_filepath):
+        return fs.status in (STATUS_QUEUED, STATUS_GENERATING)
+    if fs.meta_filepath and file_path == os.path.normpath(fs.meta_filepath):
+        return fs.status in (STATUS_QUEUED, STATUS_GENERATING, STATUS_GENERATED, STATUS_OPTIMIZING)
+    return False
+
+
+def get_profile_path(job_id, stage):
+    return os.path.join(TRACE_PROFILE_DIRECTORY, f"{job_id}_{stage}.prof")
+
+#
+# Captures a cProfile of a processing stage ("generation" or "optimization") of the job, if it was requested in the upload
+#
+# @return context manager giving the path of the profile file, or None if no profile is captured
+#
+@contextlib.contextmanager
+def capture_job_profile(fs, stage):
+    if not fs.capture_profile:
+        yield None
+        return
+    path = get_profile_path(fs.uuid, stage)
+    with jobtrace.capture_profile(path) as profiler:
+        yield path if profiler is not None else None
+
+
+#
+# Removes the trace spans and the cProfile captures older than TRACE_RETENTION
+#
+# @return tuple of (number of removed spans, number of removed profile files)
+#
+def remove_expired_traces():
+    expired = time.time() - TRACE_RETENTION
+    spans = status_storage.delete_spans_before(expired)
+    profiles = 0
+    try:
+        entries = list(os.scandir(TRACE_PROFILE_DIRECTORY))
+    except FileNotFoundError: # no profiles captured
+        entries = []
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.name.endswith(".prof") and entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+                profiles += 1
+        except FileNotFoundError: # removed by another process
+            pass
+    return spans, profiles
+
+def run_trace_cleanup(interval):
+    while True:
+        try:
+            spans, profiles = remove_expired_traces()
+            print(f"Trace cleanup finished, removed {spans} spans and {profiles} profiles.")
+        except Exception as e:
+            print(f"Exception during trace cleanup: {e}")
+        time.sleep(interval)
+
+
+def get_worker_mode():
+    return os.environ.get("WORKER_MODE", WORKER_MODE)
+
+#
+# Starts processing the new jobs in a thread of this process, unless they are processed by worker processes (worker.py)
+#
+# @param worker the processor or the optimizer
+#
+def start_embedded_worker(worker):
+    if get_worker_mode() == WORKER_MODE_EMBEDDED:
+        worker.start_thread()
+
+
 status_storage = StatusStorage()
-optimizer = SubtitleOptimizer(status_storage)
-processor = VideoProcessor(status_storage)
-converter = VideoConverter()
+spool_manager = spoolmanager.SpoolManager(UPLOAD_FILE_DIRECTORY, SPOOL_MAX_BYTES, SPOOL_MIN_FREE_BYTES, SPOOL_RETRY_AFTER, SPOOL_ORPHAN_MIN_AGE, is_spool_file_active, shared=get_worker_mode() == WORKER_MODE_EXTERNAL)
+app.config['MAX_CONTENT_LENGTH'] = SPOOL_MAX_BYTES # larger requests are refused with 413 while they are read
+optimizer = SubtitleOptimizer(status_storage, spool_manager)
+processor = VideoProcessor(status_storage, spool_manager)
+background_threads_lock = threading.Lock()
+background_threads_started = False
+
+
+#
+# Starts the spool garbage collection and the trace cleanup in background threads, only once. Called when the server is
+# started directly, before the first request under a WSGI server and by worker.py --cleanup. Nothing is started at import
+# time, so that worker.py and benchmark.py can import this module without removing files from the upload directory.
+#
+def start_background_threads():
+    global background_threads_started
+    with background_threads_lock:
+        if background_threads_started:
+            return
+        background_threads_started = True
+        spool_manager.start_thread(SPOOL_GC_INTERVAL)
+        threading.Thread(target=run_trace_cleanup, args=(TRACE_CLEANUP_INTERVAL,), daemon=True).start()
+
+@app.before_request
+def ensure_background_threads_started():
+    start_background_threads()
+
+
+#
+# @return http client for recording/replaying the api calls, or None if OPENAI_CASSETTE_MODE is not set
+#
+def create_cassette_http_client():
+    mode = os.environ.get("OPENAI_CASSETTE_MODE", OPENAI_CASSETTE_MODE)
+    if not mode:
+        return None
+    if MOCK_SERVER_DIRECTORY not in sys.path:
+        sys.path.append(MOCK_SERVER_DIRECTORY)
+    import replaytransport
+    return replaytransport.create_http_client(mode, os.environ.get("OPENAI_CASSETTE_FILE", OPENAI_CASSETTE_FILE))
 
 
 def calculate_duration(from_timestamp, to_timestamp):
@@ -586,9 +1025,13 @@ def status():
         <textarea id="textSubtitlesRaw" rows="10" cols="50">{status.srt}</textarea><br>
         <textarea id="textSubtitles" rows="10" cols="50">{status.srt_optimized}</textarea><br>
         <button onclick="downloadTextAreaContent()">Download as File</button>
-        <br>Created with generator revision: {SVN_REVISION}<br>
+        <br>Created with generator revision: {svnrevisionchecker.get_build_revision()}, decoding profile: {status.decoding_profile}, detected language: {status.language_detected}<br>
         <br>Video duration: {status.video_duration} seconds. Subtitles generated in {calculate_duration(status.timestamp_generation_started, status.timestamp_generation_completed)} seconds, optimized in {calculate_duration(status.timestamp_optimization_started, status.timestamp_optimization_completed)} seconds, total: {calculate_duration(status.timestamp_generation_started, status.timestamp_optimization_completed)} seconds (since upload: {calculate_duration(status.timestamp_uploaded, status.timestamp_optimization_completed)} seconds).<br>
 
+        <h2>Processing trace</h2>
+        {jobtrace.render_timeline(status_storage.get_spans(status.uuid))}
+        <br><a href="./trace?uuid={status.uuid}">Download trace</a> (Chrome trace event format, open in https://ui.perfetto.dev or chrome://tracing){get_profile_links(status)}<br><br>
+
         <script>
             function downloadTextAreaContent() {{
                 var text = document.getElementById("textSubtitles").value;
@@ -626,6 +1069,61 @@ def status():
     """
 
 
+#
+# @return html links for downloading the cProfile captures of the job, or empty string if none were captured
+#
+def get_profile_links(status):
+    if not status.capture_profile:
+        return ""
+    links = [f'<a href="./traceProfile?uuid={status.uuid}&stage={stage}">{stage}</a>' for stage in ("generation", "optimization") if os.path.exists(get_profile_path(status.uuid, stage))]
+    return "<br>cProfile captures (view with: python3 -m pstats FILE, or snakeviz FILE): " + (", ".join(links) if links else "not yet written")
+
+
+@app.route('/trace')
+def trace_download():
+    auth_header = request.headers.get('Authorization')
+    if not check_auth(auth_header):
+        return Response('Unauthorized', 401, {'WWW-Authenticate': 'Basic realm="Test"'})
+    uuid_query = request.args.get('uuid')
+    if not uuid_query:
+        return Response('Bad Request', 400)
+    if not status_storage.get_status(uuid_query):
+        return Response(f'Not found: {uuid_query}', 404)
+    return Response(json.dumps(jobtrace.to_chrome_trace(status_storage.get_spans(uuid_query)), default=str), mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment; filename={uuid_query}.trace.json'})
+
+
+@app.route('/traceProfile')
+def trace_profile():
+    auth_header = request.headers.get('Authorization')
+    if not check_auth(auth_header):
+        return Response('Unauthorized', 401, {'WWW-Authenticate': 'Basic realm="Test"'})
+    uuid_query = request.args.get('uuid')
+    stage = request.args.get('stage')
+    if not uuid_query or stage not in ("generation", "optimization"):
+        return Response('Bad Request', 400)
+    fs = status_storage.get_status(uuid_query) # also makes sure that uuid_query is a known job id and not a path
+    if not fs or not os.path.exists(get_profile_path(fs.uuid, stage)):
+        return Response(f'Not found: {uuid_query}', 404)
+    return send_file(os.path.abspath(get_profile_path(fs.uuid, stage)), as_attachment=True, download_name=f"{fs.uuid}_{stage}.prof")
+
+
+#
+# Checks the size of the upload against the spool before the request body is read (request.files and request.form
+# read the whole body into a temporary file), so that an upload which does not fit is refused without receiving it
+#
+# @return the error response, or None if the upload fits
+#
+def check_upload_size():
+    if request.content_length is None:
+        return Response('Length Required', 411)
+    try:
+        spool_manager.check_space(request.content_length)
+    except spoolmanager.SpoolFullError as e:
+        return Response(f'Service Unavailable: {e}', 503, {'Retry-After': str(e.retry_after)})
+    return None
+
+
 @app.route('/uploadMeta', methods=['GET', 'POST'])
 def meta():
     auth_header = request.headers.get('Authorization')
@@ -656,6 +1154,9 @@ def meta():
             </html>
         '''.format(uuid_query, uuid_query)
     elif request.method == 'POST':
+        error = check_upload_size()
+        if error is not None:
+            return error
         uuid_item = request.form.get('uuid')
         if 'file' not in request.files or not uuid_item:
             return Response('Bad Request', 400)
@@ -670,9 +1171,15 @@ def meta():
         if file.filename == '':
             return Response('Bad Request: Filename is missing.', 400)
         file_path = UPLOAD_FILE_DIRECTORY + uuid_item + "_" + re.sub(r'[^a-zA-Z0-9_.-]', '', file.filename) + ".meta.pdf"
-        file.save(file_path)
+        trace = jobtrace.JobTrace(uuid_item)
+        try:
+            with trace.span("meta_upload", bytes=request.content_length):
+                spool_manager.save(uuid_item, file, file_path, request.content_length)
+        except spoolmanager.SpoolFullError as e:
+            return Response(f'Service Unavailable: {e}', 503, {'Retry-After': str(e.retry_after)})
         status_storage.set_meta(uuid_item, file_path)
-        optimizer.start_thread()
+        status_storage.add_spans(uuid_item, trace.flush())
+        start_embedded_worker(optimizer)
         return redirect(f'./status?uuid={uuid_item}')
 
 
@@ -681,6 +1188,9 @@ def upload_video():
     auth_header = request.headers.get('Authorization')
     if not check_auth(auth_header):
         return Response('Unauthorized', 401, {'WWW-Authenticate': 'Basic realm="Test"'})
+    error = check_upload_size()
+    if error is not None:
+        return error
     if 'file' not in request.files:
         return Response('Bad Request', 400)
     file = request.files['file']
@@ -691,12 +1201,26 @@ def upload_video():
     language = request.form.get('language', 'auto')  # Default to auto if not selected
     if language == "auto":
         language = ""
+
+    # Get the decoding profile (speed/accuracy preset) from the form
+    profile = request.form.get('profile', DEFAULT_DECODING_PROFILE)
+    if profile not in DECODING_PROFILES:
+        return Response(f'Bad Request: Unknown profile: {profile}', 400)
     
+    # Whether to write a cProfile of the processing of this file into TRACE_PROFILE_DIRECTORY
+    capture_profile = 1 if request.form.get('capture_profile') in ('1', 'on', 'true') else 0
+
     file_uuid = str(uuid.uuid4())
     file_path = UPLOAD_FILE_DIRECTORY + file_uuid + "_" + re.sub(r'[^a-zA-Z0-9_.-]', '', file.filename)
-    file.save(file_path)
-    status_storage.set_status(FileStatus(file_uuid, file.filename, file_path, '', STATUS_QUEUED, '', '', language, int(time.time()), TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, converter.calculate_duration(file_path)))
-    processor.start_thread()
+    trace = jobtrace.JobTrace(file_uuid)
+    try:
+        with trace.span("upload", bytes=request.content_length):
+            spool_manager.save(file_uuid, file, file_path, request.content_length)
+    except spoolmanager.SpoolFullError as e:
+        return Response(f'Service Unavailable: {e}', 503, {'Retry-After': str(e.retry_after)})
+    status_storage.set_status(FileStatus(file_uuid, file.filename, file_path, '', STATUS_QUEUED, '', '', language, int(time.time()), TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, TIMESTAMP_NOT_SET, profile, '', capture_profile)) # the duration is probed by the processor
+    status_storage.add_spans(file_uuid, trace.flush())
+    start_embedded_worker(processor)
     return redirect(f'./uploadMeta?uuid={file_uuid}')
 
 
@@ -705,6 +1229,8 @@ def index():
     auth_header = request.headers.get('Authorization')
     if not check_auth(auth_header):
         return Response('Unauthorized', 401, {'WWW-Authenticate': 'Basic realm="Test"'})
+    profile_options = "".join(f'<option value="{name}"{" selected" if name == DEFAULT_DECODING_PROFILE else ""}>{profile.get("label", name)}</option>'
+                              for name, profile in DECODING_PROFILES.items())
     return '''
         <html>
         <head>
@@ -819,7 +1345,13 @@ def index():
                     <option value="yi">Yiddish</option>
                     <option value="yo">Yoruba</option>
                     <option value="zu">Zulu</option>
-                </select>
+                </select><br><br>
+                <label for="profile">Select Profile:</label>
+                <select name="profile" id="profile">
+                    {}
+                </select><br><br>
+                <input type="checkbox" name="capture_profile" id="capture_profile" value="1">
+                <label for="capture_profile">Capture a cProfile of the processing (for debugging performance)</label><br><br>
 
                 <input type="submit" value="Upload">
             </form>
@@ -830,9 +1362,12 @@ def index():
             </form>
         </body>
         </html>
-    '''
+    '''.format(profile_options)
 
 
 
 if __name__ == '__main__':
+    if os.environ.get("STATUS_STORAGE_RESET", "1" if STATUS_STORAGE_RESET else "0") != "0":
+        status_storage.reset()
+    start_background_threads()
     app.run(host='0.0.0.0', port=PORT)
@@ -0,0 +1,202 @@
+import os
+import shutil
+import threading
+import time
+
+#
+# Thrown when an upload does not fit in the spool, retry_after is the suggested wait time in seconds
+#
+class SpoolFullError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+#
+# Keeps track of the uploaded files stored in the upload directory, enforces the disk quota and removes orphaned files
+#
+# Files are expected to be named as JOBID_filename, which is how the uploaded video and meta files are stored.
+#
+class SpoolManager:
+    #
+    # @param directory the upload directory
+    # @param max_bytes maximum total size of the files in the directory
+    # @param min_free_bytes uploads are refused if the disk would have less free space than this after the upload
+    # @param retry_after the wait time suggested to the clients when the spool is full, in seconds
+    # @param orphan_min_age files which are not used by an active job are removed when they are older than this, in seconds
+    # @param is_active function(job_id, file_path) returning True if the file is still needed by the job
+    # @param shared True if other processes (e.g. several web server processes) also save files into the directory, the
+    #        used space is then measured from the directory on each upload instead of the bookkeeping of this process
+    #
+    def __init__(self, directory, max_bytes, min_free_bytes, retry_after, orphan_min_age, is_active, shared=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.retry_after = retry_after
+        self.orphan_min_age = orphan_min_age
+        self.is_active = is_active
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.thread = None
+        self.files = {} # file path => size in bytes
+        self.job_bytes = {} # job id => total size of the files of the job
+        self.reserved_bytes = 0 # uploads in progress
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    #
+    # Adds the files already in the directory (e.g. left from the previous run) to the used space
+    #
+    def scan(self):
+        with self.lock:
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    self._add(self.get_job_id(entry.name), entry.path, entry.stat().st_size)
+
+    def get_job_id(self, filename):
+        return os.path.basename(filename).split('_', 1)[0]
+
+    def used_bytes(self):
+        with self.lock:
+            return sum(self.files.values()) + self.reserved_bytes
+
+    def get_job_bytes(self, job_id):
+        with self.lock:
+            return self.job_bytes.get(job_id, 0)
+
+    def _add(self, job_id, file_path, size):
+        file_path = os.path.normpath(file_path)
+        self._remove(job_id, file_path)
+        self.files[file_path] = size
+        self.job_bytes[job_id] = self.job_bytes.get(job_id, 0) + size
+
+    def _remove(self, job_id, file_path):
+        size = self.files.pop(os.path.normpath(file_path), None)
+        if size is not None:
+            self.job_bytes[job_id] = self.job_bytes.get(job_id, 0) - size
+            if self.job_bytes[job_id] <= 0:
+                del self.job_bytes[job_id]
+
+    #
+    # @return total size of the files in the directory, including the files saved by other processes
+    #
+    def _directory_bytes(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file():
+                    total += entry.stat().st_size
+            except FileNotFoundError: # removed by another process
+                pass
+        return total
+
+    def _check_space(self, expected_bytes):
+        used_bytes = self._directory_bytes() if self.shared else sum(self.files.values())
+        if used_bytes + self.reserved_bytes + expected_bytes > self.max_bytes:
+            raise SpoolFullError("Upload quota exceeded.", self.retry_after)
+        if shutil.disk_usage(self.directory).free - expected_bytes < self.min_free_bytes:
+            raise SpoolFullError("Not enough free disk space.", self.retry_after)
+
+    #
+    # Checks that an upload of the given size fits in the spool, before the upload is received
+    #
+    # @raise SpoolFullError if it does not fit
+    #
+    def check_space(self, expected_bytes):
+        with self.lock:
+            self._check_space(expected_bytes)
+
+    #
+    # Saves the uploaded file if it fits in the spool
+    #
+    # @param job_id the job the file belongs to
+    # @param file the uploaded file (werkzeug FileStorage)
+    # @param file_path where to save the file
+    # @param expected_bytes the expected size of the file (e.g. request content length) or None if not known
+    # @raise SpoolFullError if the file does not fit, in which case nothing is saved. If saving fails, the partial file is removed
+    #
+    def save(self, job_id, file, file_path, expected_bytes):
+        expected_bytes = expected_bytes or 0
+        with self.lock:
+            self._check_space(expected_bytes)
+            self.reserved_bytes += expected_bytes
+        try:
+            file.save(file_path)
+            size = os.path.getsize(file_path)
+        except BaseException:
+            try:
+                os.remove(file_path) # a partially saved file would count against the quota until it is collected as an orphan
+            except OSError:
+                pass
+            raise
+        finally:
+            with self.lock:
+                self.reserved_bytes -= expected_bytes
+        with self.lock:
+            try:
+                if self.shared:
+                    self._check_space(0) # the saved file is already included in the size of the directory
+                elif size > expected_bytes:
+                    self._check_space(size - expected_bytes)
+            except SpoolFullError:
+                os.remove(file_path)
+                raise
+            self._add(job_id, file_path, size)
+
+    #
+    # Removes the file of a job, missing files are ignored
+    #
+    def release(self, job_id, file_path):
+        if not file_path:
+            return
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove file {file_path}: {e}")
+            return
+        with self.lock:
+            self._remove(job_id, file_path)
+
+    #
+    # Removes files which are not needed by any active job and are older than orphan_min_age
+    #
+    # @return number of removed files
+    #
+    def collect_garbage(self):
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                age = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            job_id = self.get_job_id(entry.name)
+            if age < self.orphan_min_age or self.is_active(job_id, entry.path):
+                continue
+            print(f"Removing orphaned file: {entry.path}")
+            self.release(job_id, entry.path)
+            removed += 1
+        with self.lock: # forget files removed by someone else
+            for file_path in [f for f in self.files if not os.path.exists(f)]:
+                self._remove(self.get_job_id(file_path), file_path)
+        return removed
+
+    def start_thread(self, interval):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run_garbage_collection, args=(interval,), daemon=True)
+            self.thread.start()
+
+    def run_garbage_collection(self, interval):
+        while True:
+            try:
+                removed = self.collect_garbage()
+                print(f"Spool garbage collection finished, removed {removed} files, {self.used_bytes()} bytes in use.")
+            except Exception as e:
+                print(f"Exception during spool garbage collection: {e}")
+            time.sleep(interval)
@@ -1,4 +1,15 @@
+import functools
+import hashlib
+import json
+import os
 import subprocess
+import sys
+
+BUILD_REVISION_VARIABLE = "BUILD_REVISION" # environment variable giving the revision, e.g. set by the deployment
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "otula-whisper")
+# revision written at deploy time, or cached from svn info. Kept outside the source directory, one file per installation
+BUILD_INFO_FILE = os.environ.get("BUILD_INFO_FILE", os.path.join(CACHE_DIRECTORY, f"build_info-{hashlib.sha1(SOURCE_DIRECTORY.encode()).hexdigest()[:12]}.json"))
 
 def get_svn_revision():
     try:
@@ -22,3 +33,65 @@ def get_svn_revision():
         print(f"Subprocess error occurred: {e}")
         return None
 
+#
+# Resolves the revision once per process, from the first of:
+#  1. the environment variable BUILD_REVISION
+#  2. BUILD_INFO_FILE written at deploy time (python3 svnrevisionchecker.py)
+#  3. svn info, the result is cached in BUILD_INFO_FILE, so that other processes do not run svn again until the
+#     working copy changes
+#
+# @return the revision or None if not known
+#
+@functools.lru_cache(maxsize=None)
+def get_build_revision():
+    revision = os.environ.get(BUILD_REVISION_VARIABLE)
+    if revision:
+        return revision
+    working_copy_mtime = get_working_copy_mtime()
+    info = read_build_info()
+    if info is not None and ("working_copy_mtime" not in info or info["working_copy_mtime"] == working_copy_mtime):
+        return info.get("revision")
+    revision = get_svn_revision()
+    write_build_info({"revision": revision, "working_copy_mtime": working_copy_mtime})
+    return revision
+
+#
+# @return modification time of the svn working copy database (changed by svn update), or None if not in a working copy
+#
+def get_working_copy_mtime():
+    directory = os.getcwd()
+    while True:
+        try:
+            return os.stat(os.path.join(directory, ".svn", "wc.db")).st_mtime_ns
+        except OSError:
+            pass
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def read_build_info():
+    try:
+        with open(BUILD_INFO_FILE, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_build_info(info):
+    try:
+        os.makedirs(os.path.dirname(BUILD_INFO_FILE) or ".", exist_ok=True)
+        tmp_path = f"{BUILD_INFO_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(info, file)
+        os.replace(tmp_path, BUILD_INFO_FILE)
+    except OSError as e:
+        print(f"Failed to write {BUILD_INFO_FILE}: {e}")
+
+#
+# Writes the revision into BUILD_INFO_FILE at deploy time: python3 svnrevisionchecker.py [REVISION]
+# Without REVISION, the revision of the working copy is used.
+#
+if __name__ == '__main__':
+    revision = sys.argv[1] if len(sys.argv) > 1 else get_svn_revision()
+    write_build_info({"revision": revision})
+    print(f"Revision {revision} written to {BUILD_INFO_FILE}")
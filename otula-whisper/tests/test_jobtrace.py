@@ -0,0 +1,76 @@
+import concurrent.futures
+import os
+import sys
+import pytest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import jobtrace
+
+
+def test_spans_are_nested():
+    trace = jobtrace.JobTrace("job")
+    with trace.span("generation"):
+        with jobtrace.span("decode", model="small") as span:
+            span["attributes"]["segments"] = 3
+    decode, generation = trace.flush()
+    assert generation["parent"] is None
+    assert decode["parent"] == generation["id"]
+    assert decode["attributes"] == {"model": "small", "segments": 3}
+    assert generation["start"] <= decode["start"] <= decode["end"] <= generation["end"]
+    assert trace.flush() == []
+
+def test_span_without_trace_does_nothing():
+    with jobtrace.span("decode") as span:
+        assert span is None
+
+def test_wrapped_function_records_in_the_current_span():
+    trace = jobtrace.JobTrace("job")
+    def chunk(number):
+        with jobtrace.span("chunk", number=number):
+            return number
+    with trace.span("optimization"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(jobtrace.wrap(lambda number=number: chunk(number))) for number in range(3)]
+            assert [future.result() for future in futures] == [0, 1, 2]
+    spans = trace.flush()
+    root = next(span for span in spans if span["name"] == "optimization")
+    chunks = [span for span in spans if span["name"] == "chunk"]
+    assert len(chunks) == 3 and all(span["parent"] == root["id"] for span in chunks)
+
+def test_error_is_recorded():
+    trace = jobtrace.JobTrace("job")
+    with pytest.raises(ValueError):
+        with trace.span("validation"):
+            raise ValueError("invalid srt")
+    assert trace.flush()[0]["attributes"]["error"] == "invalid srt"
+
+def create_span(span_id, parent, name, start, end):
+    return {"id": span_id, "parent": parent, "name": name, "start": start, "end": end, "process": 1, "thread": "main", "attributes": {}}
+
+SPANS = [
+    create_span("c", "a", "decode", 2.0, 4.0),
+    create_span("a", None, "generation", 1.0, 5.0),
+    create_span("b", "a", "decode", 1.5, 2.0),
+    create_span("d", "missing", "upload", 0.0, 0.5) # parent not stored, shown at the top level
+]
+
+def test_order_spans():
+    assert [(depth, span["id"]) for depth, span in jobtrace.order_spans(SPANS)] == [(0, "d"), (0, "a"), (1, "b"), (1, "c")]
+
+def test_summarize_spans():
+    assert jobtrace.summarize_spans(SPANS) == {"generation": (1, 4.0), "decode": (2, 2.5), "upload": (1, 0.5)}
+
+def test_chrome_trace():
+    trace = jobtrace.to_chrome_trace(SPANS)
+    events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in events] == ["upload", "generation", "decode", "decode"]
+    assert events[1]["ts"] == 1000000 and events[1]["dur"] == 4000000
+    assert [event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"] == ["main"]
+
+def test_render_timeline():
+    assert jobtrace.render_timeline([]) == "<p>No trace recorded.</p>"
+    failed = create_span("e", "a", "<chunk>", 4.0, 4.5)
+    failed["attributes"]["error"] = "rate limit"
+    timeline = jobtrace.render_timeline(SPANS + [failed])
+    assert '<td style="padding-left:16px">decode</td>' in timeline
+    assert "&lt;chunk&gt;" in timeline and "<chunk>" not in timeline
+    assert "background:#c33" in timeline
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import pytest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import spoolmanager
+
+
+#
+# Uploaded file (werkzeug FileStorage) with the given content, fails after writing it if error is given
+#
+class FakeUpload:
+    def __init__(self, content, error=None):
+        self.content = content
+        self.error = error
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.content)
+        if self.error is not None:
+            raise self.error
+
+
+def create_manager(directory, max_bytes=100, active=(), shared=False):
+    return spoolmanager.SpoolManager(str(directory), max_bytes, 0, 30, 60, lambda job_id, path: job_id in active, shared)
+
+def test_save_and_release(tmp_path):
+    manager = create_manager(tmp_path)
+    path = str(tmp_path / "job1_video.mp4")
+    manager.save("job1", FakeUpload(b"x" * 40), path, 40)
+    assert manager.used_bytes() == 40 and manager.get_job_bytes("job1") == 40
+    manager.release("job1", path)
+    assert not os.path.exists(path)
+    assert manager.used_bytes() == 0 and manager.get_job_bytes("job1") == 0
+    manager.release("job1", path) # already removed
+
+def test_upload_over_quota_is_refused_before_saving(tmp_path):
+    manager = create_manager(tmp_path)
+    manager.save("job1", FakeUpload(b"x" * 80), str(tmp_path / "job1_video.mp4"), 80)
+    with pytest.raises(spoolmanager.SpoolFullError) as error:
+        manager.check_space(30)
+    assert error.value.retry_after == 30
+    with pytest.raises(spoolmanager.SpoolFullError):
+        manager.save("job2", FakeUpload(b"x" * 30), str(tmp_path / "job2_video.mp4"), 30)
+    assert not os.path.exists(tmp_path / "job2_video.mp4")
+    assert manager.used_bytes() == 80
+
+def test_file_larger_than_expected_is_removed(tmp_path):
+    manager = create_manager(tmp_path)
+    with pytest.raises(spoolmanager.SpoolFullError):
+        manager.save("job1", FakeUpload(b"x" * 120), str(tmp_path / "job1_video.mp4"), None)
+    assert os.listdir(tmp_path) == []
+    assert manager.used_bytes() == 0
+
+def test_partial_file_is_removed_when_saving_fails(tmp_path):
+    manager = create_manager(tmp_path)
+    with pytest.raises(OSError):
+        manager.save("job1", FakeUpload(b"x" * 10, OSError("client disconnected")), str(tmp_path / "job1_video.mp4"), 40)
+    assert os.listdir(tmp_path) == []
+    assert manager.used_bytes() == 0
+
+def test_existing_files_are_counted(tmp_path):
+    (tmp_path / "job1_video.mp4").write_bytes(b"x" * 30)
+    (tmp_path / "job1_meta.txt").write_bytes(b"x" * 5)
+    manager = create_manager(tmp_path)
+    assert manager.used_bytes() == 35 and manager.get_job_bytes("job1") == 35
+
+def test_shared_directory_counts_the_files_of_other_processes(tmp_path):
+    manager = create_manager(tmp_path, shared=True)
+    (tmp_path / "job1_video.mp4").write_bytes(b"x" * 80) # saved by another process
+    with pytest.raises(spoolmanager.SpoolFullError):
+        manager.check_space(30)
+
+def test_orphaned_files_are_collected(tmp_path):
+    old = time.time() - 120
+    for name in ("active_video.mp4", "orphan_video.mp4", "new_video.mp4"):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        if name != "new_video.mp4":
+            os.utime(tmp_path / name, (old, old))
+    manager = create_manager(tmp_path, active={"active"})
+    assert manager.collect_garbage() == 1
+    assert sorted(os.listdir(tmp_path)) == ["active_video.mp4", "new_video.mp4"]
+    assert manager.used_bytes() == 20
+
+def test_files_removed_by_others_are_forgotten(tmp_path):
+    manager = create_manager(tmp_path)
+    manager.save("job1", FakeUpload(b"x" * 10), str(tmp_path / "job1_video.mp4"), 10)
+    os.remove(tmp_path / "job1_video.mp4")
+    manager.collect_garbage()
+    assert manager.used_bytes() == 0
@@ -0,0 +1,47 @@
+# Worker process for generating and optimizing the subtitles separately from the web server.
+#
+# Usage:
+#   WORKER_MODE=external python3 worker.py [--transcribe] [--optimize] [--cleanup]
+#
+# With neither --transcribe nor --optimize both are run. The orphaned uploaded files and the expired traces are removed
+# by the web server, and by the worker only with --cleanup. The worker takes the uploaded files from the status storage (STATUS_STORAGE_FILE_PATH
+# in server.py, or the environment variable with the same name) and stores the results there, it does not communicate
+# with the web server in any other way. Any number of workers can be started, each file is claimed by exactly one of
+# them. The workers need access to the uploaded files (UPLOAD_FILE_DIRECTORY) and to the status storage database.
+#
+# Start the web server with WORKER_MODE=external so that it does not process the files in its own threads, and the
+# workers with the same setting so that the upload quota is shared correctly.
+#
+import argparse
+import threading
+import server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and optimize subtitles for the files uploaded to the web server.")
+    parser.add_argument("--transcribe", action="store_true", help="generate the subtitles of the uploaded video files")
+    parser.add_argument("--optimize", action="store_true", help="optimize the generated subtitles")
+    parser.add_argument("--cleanup", action="store_true", help="also remove the orphaned uploaded files and the expired traces, e.g. when no web server runs on this host")
+    args = parser.parse_args()
+    transcribe = args.transcribe or not args.optimize
+    optimize = args.optimize or not args.transcribe
+
+    if server.get_worker_mode() != server.WORKER_MODE_EXTERNAL:
+        print(f"Warning: WORKER_MODE is {server.get_worker_mode()}, the web server may also process the files in its own threads.")
+
+    if args.cleanup:
+        server.start_background_threads()
+    threads = []
+    if transcribe:
+        threads.append(threading.Thread(target=server.processor.run_forever, args=(server.WORKER_POLL_INTERVAL,), daemon=True))
+    if optimize:
+        threads.append(threading.Thread(target=server.optimizer.run_forever, args=(server.SUBTITLE_OPTIMIZER_POLL_INTERVAL,), daemon=True))
+    print(f"Worker started, transcribe: {transcribe}, optimize: {optimize}, status storage: {server.STATUS_STORAGE_FILE_PATH}")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
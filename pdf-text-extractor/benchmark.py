@@ -0,0 +1,120 @@
+# Benchmark of the PDF text extraction backends on your own documents.
+#
+# Usage:
+#   python3 benchmark.py DIRECTORY_OR_PDF [...] [--repeat 3] [--page-workers 1 8] [--json results.json]
+#
+# For each installed backend (and each --page-workers value), all documents are extracted --repeat times and the best
+# time is reported, together with the pages and characters per second. The speed of the hash-keyed cache (cold and
+# warm) is measured with the first backend. The old extraction of the examples (PyPDF2 with string concatenation) is
+# included as the baseline when PyPDF2 is installed.
+#
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import pdfextract
+
+
+def collect_pdfs(paths):
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                pdfs.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.pdf'))
+        else:
+            pdfs.append(path)
+    return pdfs
+
+#
+# The extraction used by the examples before pdfextract, for comparison
+#
+# @return tuple of (pages, characters)
+#
+def extract_text_baseline(pdf_path):
+    from PyPDF2 import PdfReader
+    reader = PdfReader(pdf_path)
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() + " "
+    return len(reader.pages), len(" ".join(text.split()))
+
+#
+# @return function(pdf_path) returning tuple of (pages, characters) extracted with pdfextract
+#
+def pdfextract_function(backend, page_workers, cache_directory):
+    def extract(pdf_path):
+        pages = pdfextract.extract_pages(pdf_path, backend, page_workers, cache_directory)
+        return len(pages), sum(len(text) for text in pages)
+    return extract
+
+#
+# @param extract function(pdf_path) returning tuple of (pages, characters)
+# @return dict with the best time of the given number of runs, and the pages and characters extracted
+#
+def measure(name, pdfs, repeat, extract):
+    best = None
+    pages = 0
+    characters = 0
+    failed = 0
+    for run in range(repeat):
+        pages = 0
+        characters = 0
+        failed = 0
+        start_time = time.perf_counter()
+        for pdf in pdfs:
+            try:
+                document_pages, document_characters = extract(pdf)
+            except Exception as e:
+                if run == 0:
+                    print(f"  {name}: failed to extract {pdf}: {e}")
+                failed += 1
+                continue
+            pages += document_pages
+            characters += document_characters
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    result = {"name": name, "seconds": best, "documents": len(pdfs) - failed, "failed": failed, "pages": pages, "characters": characters,
+              "pages_per_second": pages / best if best else 0, "characters_per_second": characters / best if best else 0}
+    print(f"{name:32} {best:8.3f} s {result['pages_per_second']:10.1f} pages/s {result['characters_per_second'] / 1000:10.1f} kchars/s  ({pages} pages, {failed} failed)")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF text extraction backends.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDF files")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best time is reported")
+    parser.add_argument("--page-workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="page worker counts to compare")
+    parser.add_argument("--json", help="write the results into this file")
+    args = parser.parse_args()
+
+    pdfs = collect_pdfs(args.paths)
+    backends = pdfextract.available_backends()
+    if not pdfs or not backends:
+        print("No PDF files found." if not pdfs else "No PDF backend installed, install pymupdf or PyPDF2.")
+        return
+    print(f"{len(pdfs)} documents, backends: {', '.join(backends)}, parallel extraction for documents with at least {pdfextract.PARALLEL_MIN_PAGES} pages")
+
+    results = []
+    if pdfextract.BACKEND_PYPDF2 in backends:
+        results.append(measure("baseline (PyPDF2, +=)", pdfs, args.repeat, extract_text_baseline))
+    for backend in backends:
+        for workers in sorted(set(args.page_workers)):
+            results.append(measure(f"{backend}, {workers} page workers", pdfs, args.repeat, pdfextract_function(backend, workers, None)))
+
+    cache_directory = tempfile.mkdtemp(prefix="pdfextract-cache-")
+    try:
+        extract_cached = pdfextract_function(backends[0], 1, cache_directory)
+        results.append(measure(f"{backends[0]}, cache cold", pdfs, 1, extract_cached))
+        results.append(measure(f"{backends[0]}, cache warm", pdfs, args.repeat, extract_cached))
+    finally:
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
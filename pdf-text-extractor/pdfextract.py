@@ -0,0 +1,220 @@
+# Shared PDF text extraction for the examples in this repository.
+#
+# Requires one of (both can be installed, PyMuPDF is preferred as it is considerably faster):
+#  - pip install pymupdf
+#  - pip install PyPDF2
+#
+# Features:
+#  - pluggable backends: PyMuPDF (fast path) with PyPDF2 as the fallback when PyMuPDF is not installed or cannot read the file
+#  - page-level parallelism: large documents are split into page ranges which are extracted in parallel processes
+#  - the pages are assembled with a single join instead of repeated string concatenation
+#  - optional on-disk cache keyed by the hash of the file contents, so unchanged files are never extracted twice
+#
+# Usage (from another directory of this repository):
+#   sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pdf-text-extractor'))
+#   import pdfextract
+#   text = pdfextract.extract_text("document.pdf")
+#
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+
+BACKEND_PYMUPDF = "pymupdf"
+BACKEND_PYPDF2 = "pypdf2"
+BACKENDS = (BACKEND_PYMUPDF, BACKEND_PYPDF2) # in the order of preference
+PAGE_WORKERS = None # number of processes for extracting the pages of a large document, None for the number of CPUs, 1 to disable
+PARALLEL_MIN_PAGES = 64 # documents with fewer pages are extracted in the calling process
+CACHE_DIRECTORY = os.environ.get("PDF_TEXT_CACHE_DIRECTORY") # default cache directory, None to disable the cache
+CACHE_FORMAT_VERSION = 1 # increase when the extraction changes so that old cache entries are not used
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_in_pool_worker = False # True in the worker processes of the pools started with pool_initializer()
+
+
+class PdfExtractionError(Exception):
+    pass
+
+
+#
+# @return the installed backends, in the order of preference
+#
+def available_backends():
+    backends = []
+    try:
+        import fitz # noqa: F401
+        backends.append(BACKEND_PYMUPDF)
+    except ImportError:
+        pass
+    try:
+        import PyPDF2 # noqa: F401
+        backends.append(BACKEND_PYPDF2)
+    except ImportError:
+        pass
+    return backends
+
+#
+# @return the number of pages of the document
+#
+def count_pages(path, backend):
+    if backend == BACKEND_PYMUPDF:
+        import fitz
+        with fitz.open(path) as doc:
+            return doc.page_count
+    elif backend == BACKEND_PYPDF2:
+        from PyPDF2 import PdfReader
+        return len(PdfReader(path).pages)
+    raise ValueError(f"Unknown backend: {backend}")
+
+#
+# Generates the texts of the pages start..end-1 (to the last page if end is None) one by one, so that the caller can stop
+# early (e.g. when checking whether a document contains any text)
+#
+def iter_pages(path, backend, start=0, end=None):
+    if backend == BACKEND_PYMUPDF:
+        import fitz
+        with fitz.open(path) as doc:
+            for page_num in range(start, doc.page_count if end is None else min(end, doc.page_count)):
+                yield doc.load_page(page_num).get_text("text")
+    elif backend == BACKEND_PYPDF2:
+        from PyPDF2 import PdfReader
+        pages = PdfReader(path).pages
+        for page_num in range(start, len(pages) if end is None else min(end, len(pages))):
+            yield pages[page_num].extract_text() or ""
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+#
+# Initializer for the process pools of the callers which extract documents in their worker processes, e.g.
+#   ProcessPoolExecutor(max_workers=n, initializer=pdfextract.pool_initializer)
+# The documents are then extracted in the worker process itself, instead of each worker starting its own page worker
+# processes (up to the number of CPUs squared processes in total)
+#
+def pool_initializer():
+    global _in_pool_worker
+    _in_pool_worker = True
+
+#
+# @return the start method for the worker processes: forkserver if available, otherwise spawn. fork is not used, as the
+#         callers extract documents from the threads of servers and thread pools, and a forked child could inherit a lock
+#         held by another thread and deadlock. forkserver and spawn import the main module again in the workers, so the
+#         main module of the caller must not start anything at import time.
+#
+def get_mp_context():
+    return multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+def extract_page_range(path, backend, start, end):
+    return list(iter_pages(path, backend, start, end))
+
+#
+# Extracts the pages using the given backend, in parallel processes if the document is large
+#
+def extract_pages_with(path, backend, page_workers):
+    workers = page_workers if page_workers is not None else os.cpu_count() or 1
+    # the workers of the pools started with pool_initializer() are already parallel, and the daemonic workers of
+    # multiprocessing.Pool cannot start processes (the workers of ProcessPoolExecutor are not daemonic)
+    if workers <= 1 or _in_pool_worker or multiprocessing.current_process().daemon:
+        return extract_page_range(path, backend, 0, None)
+    page_count = count_pages(path, backend)
+    if page_count < PARALLEL_MIN_PAGES:
+        return extract_page_range(path, backend, 0, None)
+    workers = min(workers, page_count)
+    ranges = [(page_count * i // workers, page_count * (i + 1) // workers) for i in range(workers)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=get_mp_context()) as executor:
+        futures = [executor.submit(extract_page_range, path, backend, start, end) for start, end in ranges]
+        return [page for future in futures for page in future.result()]
+
+#
+# @param path the PDF file
+# @param backend BACKEND_PYMUPDF, BACKEND_PYPDF2 or None to use the first available backend (falling back to the next
+#        one if the backend fails to read the file)
+# @param page_workers number of processes for large documents, see PAGE_WORKERS
+# @param cache_directory the cache directory, None to disable the cache
+# @return list of the page texts
+# @raise PdfExtractionError if the file cannot be read with any backend
+#
+def extract_pages(path, backend=None, page_workers=PAGE_WORKERS, cache_directory=CACHE_DIRECTORY):
+    backends = [backend] if backend is not None else available_backends()
+    if not backends:
+        raise PdfExtractionError("No PDF backend installed, install pymupdf or PyPDF2.")
+    cache_path = None
+    if cache_directory is not None:
+        cache_path = get_cache_path(cache_directory, path, backends[0])
+        pages = read_cache(cache_path)
+        if pages is not None:
+            return pages
+    errors = []
+    for candidate in backends:
+        try:
+            pages = extract_pages_with(path, candidate, page_workers)
+            break
+        except ImportError:
+            raise
+        except Exception as e:
+            errors.append(f"{candidate}: {e}")
+    else:
+        raise PdfExtractionError(f"Failed to extract {path}: {'; '.join(errors)}")
+    if cache_path is not None:
+        write_cache(cache_path, pages)
+    return pages
+
+#
+# @return the text of the document with excessive whitespace removed (pages separated by a space), see extract_pages() for the parameters
+#
+def extract_text(path, backend=None, page_workers=PAGE_WORKERS, cache_directory=CACHE_DIRECTORY):
+    return " ".join(" ".join(extract_pages(path, backend, page_workers, cache_directory)).split())
+
+#
+# @return True if any page of the document contains text, checking the pages only until the first text is found
+#
+def contains_text(path, backend=None):
+    backend = backend or (available_backends() or [BACKEND_PYMUPDF])[0]
+    return any(text.strip() for text in iter_pages(path, backend))
+
+#
+# @param max_pages number of pages to read from the start, None for all pages
+# @return list of the pages, each a list of the text blocks (x0, y0, x1, y1, text) in reading order
+# @raise PdfExtractionError if PyMuPDF is not installed (PyPDF2 does not give the positions of the text)
+#
+def extract_blocks(path, max_pages=None):
+    try:
+        import fitz
+    except ImportError:
+        raise PdfExtractionError("Text blocks require PyMuPDF, install pymupdf.")
+    pages = []
+    with fitz.open(path) as doc:
+        for page_num in range(doc.page_count if max_pages is None else min(max_pages, doc.page_count)):
+            blocks = doc.load_page(page_num).get_text("blocks", sort=True)
+            pages.append([(block[0], block[1], block[2], block[3], block[4]) for block in blocks if block[6] == 0]) # skip image blocks
+    return pages
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_cache_path(cache_directory, path, backend):
+    return os.path.join(cache_directory, f"{hash_file(path)}-{backend}-{CACHE_FORMAT_VERSION}.json")
+
+def read_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache entry {cache_path}: {e}")
+        return None
+
+def write_cache(cache_path, pages):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(pages, file, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Failed to write cache entry {cache_path}: {e}")
@@ -3,23 +3,55 @@
 # Check main function for selecting which service to use
 #
 # Requirements:
-# pip install PyPDF2
+# pip install pymupdf (or pip install PyPDF2), see ../pdf-text-extractor
 # pip install openai
 #
-from PyPDF2 import PdfReader
 from openai import AzureOpenAI      # python3-openai
 from openai import OpenAI           # python3-openai
+import openai
+import argparse
+import concurrent.futures
 import difflib
+import json
+import os
+import sys
+import threading
 import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pdf-text-extractor'))
+import layoutextractor
+import pagefilter
+import pdfextract
+import templateschema
 
-DATA_FILE = "data/data.txt" # file in format PATH_TO_TARGET_JSON PATH_TO_SOURCE_PDF, one entry per line
+DATA_FILE = "data/data.txt" # file in format PATH_TO_TARGET_JSON PATH_TO_SOURCE_PDF, one entry per line (in convert mode the target can be left out)
+OUTPUT_FILE = "results.jsonl" # convert mode: the results, one JSON record per converted document
+CHECKPOINT_FILE = "results.checkpoint" # convert mode: the completed documents, these are skipped when the conversion is run again
 JSON_TEMPLATE = "template.json" # the template for JSON output
+LAYOUT_FILE = "layouts.json" # documents with these layouts are converted locally without the model, see layoutextractor.py; None to disable
 MODEL_ENGINE = "YOUR_MODEL" # your model deployment for Azure; or , e.g., gpt-4-turbo, gpt-4, and gpt-3.5-turbo for openAI
-AZURE_API_KEY="YOUR_AZURE_KEY"
+AZURE_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY", "YOUR_AZURE_KEY")
 AZURE_API_VERSION="2024-02-01"
-AZURE_ENDPOINT = "YOUR AZURE ENDPOINT, e.g. https://EXAMPLE.openai.azure.com/"
-OPENAI_API_KEY = "YOUR_OPEN_AI_API_KEY"
+AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "YOUR AZURE ENDPOINT, e.g. https://EXAMPLE.openai.azure.com/")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR_OPEN_AI_API_KEY")
 AI_TEMPERATURE = 0.0
+PAGE_FILTER = True # remove repeated headers and footers and pages unrelated to the template before sending the text, see pagefilter.py
+MAX_REASK = 1 # how many times the model is asked to correct a response which does not match the template, 0 to disable
+# The client created by create_client(), the settings can also be given as environment variables with the same names:
+#   OPENAI_CLIENT_BACKEND = "azure", "openai" or "mock" (local mock server, see openai-mock-server directory)
+#   OPENAI_MOCK_ENDPOINT  = address of the mock server
+#   OPENAI_CASSETTE_MODE  = None, "record" (record the api calls to OPENAI_CASSETTE_FILE) or "replay" (answer the api calls from OPENAI_CASSETTE_FILE)
+OPENAI_CLIENT_BACKEND = "azure"
+OPENAI_MOCK_ENDPOINT = "http://127.0.0.1:10001"
+OPENAI_CASSETTE_MODE = None
+OPENAI_CASSETTE_FILE = "openai_cassette.jsonl"
+MOCK_SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openai-mock-server')
+# The documents are converted in a pipeline: PDFs are extracted in a process pool while the extracted texts are sent to
+# the API from a thread pool, so that the total time is limited by the API quota instead of the latency of each call.
+PIPELINE_EXTRACT_WORKERS = None # number of processes extracting PDFs, None for the number of CPUs
+PIPELINE_MAX_CONCURRENT_CALLS = 8 # number of concurrent API calls
+PIPELINE_REQUESTS_PER_MINUTE = 60 # maximum rate of API calls (including retries), 0 for unlimited
+PIPELINE_MAX_RETRY = 3 # how many times a call is tried when it fails with a rate limit, server or connection error
+PIPELINE_RETRY_DELAY = 5 # delay before retrying a failed call (doubled for each retry) unless the service gives Retry-After, in seconds
 
 def read_data_file(file_path):
     data = []
@@ -34,75 +66,386 @@ def read_data_file(file_path):
                 data.append(line_items)
     return data
 
-def extract_text_from_pdf(pdf_path):
-    reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + " "  # Space added to avoid merging words
-    return " ".join(text.split()) # remove excessive whitespace
+#
+# @param terms the field name words used for dropping irrelevant pages (see pagefilter.create_terms()), None to send all pages
+#
+def extract_text_from_pdf(pdf_path, terms=None):
+    pages = pdfextract.extract_pages(pdf_path)
+    if terms is not None:
+        pages = pagefilter.filter_pages(pages, terms)
+    return " ".join(" ".join(pages).split()) # pages separated by a space, excessive whitespace removed
 
-def create_system_prompt(template_path):
-    with open(template_path, 'r') as file:
-        return "Missing values are replaced with null. Answer only by printing the JSON. "+file.read()
+# The prompt is the same for every document and is sent first, followed by the document, so that the service can reuse
+# the cached prompt prefix (prompt caching is automatic on OpenAI and Azure for prompts of at least 1024 tokens).
+#
+# @param schema the template, see templateschema.TemplateSchema
+#
+def create_system_prompt(schema):
+    return "Convert the document given by the user into JSON using the template below. The values of the template describe the fields. Missing values are replaced with null. Answer only by printing the JSON.\nTemplate: "+schema.to_prompt()
 
-def call_openai(client, system_prompt, user_prompt):
+#
+# @param followup_messages messages after the document, e.g. a previous answer and the request to correct it
+#
+def call_openai(client, system_prompt, user_prompt, followup_messages=()):
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
+    messages.extend(followup_messages)
 
     response=client.chat.completions.create(model=MODEL_ENGINE, response_format={"type":"json_object"}, messages=messages, temperature=AI_TEMPERATURE) # note: azure does not support response format json object on gpt-4 and gpt-3.5-turbo
     #response=client.chat.completions.create(model=MODEL_ENGINE, messages=messages, temperature=AI_TEMPERATURE)
     return response
 
+#
+# Spaces the API calls evenly to stay under the given number of requests per minute
+#
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            call_time = max(now, self.next_time)
+            self.next_time = call_time + self.interval
+        if call_time > now:
+            time.sleep(call_time - now)
+
+def call_openai_with_retry(client, system_prompt, user_prompt, rate_limiter, followup_messages=()):
+    for attempt in range(1, PIPELINE_MAX_RETRY + 1):
+        rate_limiter.wait()
+        try:
+            return call_openai(client, system_prompt, user_prompt, followup_messages)
+        except (openai.APIConnectionError, openai.APIStatusError) as e:
+            status_code = getattr(e, 'status_code', None) # None for connection errors
+            if (status_code is not None and status_code != 429 and status_code < 500) or attempt == PIPELINE_MAX_RETRY:
+                raise
+            response = getattr(e, 'response', None)
+            retry_after = response.headers.get('retry-after') if response is not None else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else PIPELINE_RETRY_DELAY * 2 ** (attempt - 1)
+            print(f"Call failed ({status_code or str(e)}), retrying in {delay} seconds (attempt {attempt}/{PIPELINE_MAX_RETRY})...")
+            time.sleep(delay)
+
+# add the token usage of a response to the totals
+#
+def add_usage(usage, response):
+    if response.usage is None:
+        return
+    usage["prompt_tokens"] += response.usage.prompt_tokens
+    usage["completion_tokens"] += response.usage.completion_tokens
+    usage["total_tokens"] += response.usage.total_tokens
+    details = getattr(response.usage, 'prompt_tokens_details', None)
+    usage["cached_tokens"] += getattr(details, 'cached_tokens', None) or 0
+
+# call the API and validate the response against the template, asking the model to correct an invalid response
+#
+# The correction is asked by appending the invalid answer and the validation errors after the original messages, so
+# the prompt prefix of the first call can be served from the prompt cache.
+#
+# @return dict with keys "response" (the last response), "result" (the parsed JSON or None), "validation_errors"
+#         (errors of the last response, empty if valid), "reasks" and "usage" (tokens of all the calls)
+#
+def call_openai_validated(client, system_prompt, user_prompt, schema, rate_limiter):
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+    followup_messages = []
+    for reask in range(MAX_REASK + 1):
+        response = call_openai_with_retry(client, system_prompt, user_prompt, rate_limiter, followup_messages)
+        add_usage(usage, response)
+        choice = response.choices[0]
+        result, errors = schema.validate_json(choice.message.content)
+        if not errors or choice.finish_reason == "length" or reask == MAX_REASK: # a truncated answer would be truncated again
+            return {"response": response, "result": result, "validation_errors": errors, "reasks": reask, "usage": usage}
+        followup_messages = [
+            {"role": "assistant", "content": choice.message.content or ""},
+            {"role": "user", "content": "The JSON does not match the template:\n" + "\n".join(errors) + "\nAnswer only by printing the corrected JSON."}
+        ]
+
+# extract a PDF in a worker process of convert_documents
+#
+# @param layouts the layouts converted locally (see layoutextractor.LayoutExtractor) or None
+# @return tuple of (text or None, tuple of (layout name, result) if converted locally or None, extraction time in seconds, error message or None)
+#
+def extract_worker(pdf_path, terms, layouts):
+    start_time = time.time()
+    try:
+        converted = layouts.extract(pdf_path) if layouts is not None else None
+        if converted is not None:
+            return None, converted, time.time() - start_time, None
+        return extract_text_from_pdf(pdf_path, terms), None, time.time() - start_time, None
+    except Exception as e:
+        return None, None, time.time() - start_time, str(e)
+
+# call the API in a worker thread of convert_documents
+#
+# @return tuple of (result of call_openai_validated(), call time in seconds including retries and re-asks)
+#
+def call_worker(client, system_prompt, text, schema, rate_limiter):
+    start_time = time.time()
+    called = call_openai_validated(client, system_prompt, text, schema, rate_limiter)
+    return called, time.time() - start_time
+
+#
+# Converts the given documents, extracting the PDFs in parallel with the API calls
+#
+# At most 2 * PIPELINE_MAX_CONCURRENT_CALLS documents are in progress at once, so the extracted texts do not pile up
+# in memory when the API is slower than the extraction.
+#
+# @param client the client to use
+# @param system_prompt the system prompt, see create_system_prompt()
+# @param schema the template the responses are validated against
+# @param entries list of (target json path, source pdf path) or (source pdf path,), see read_data_file()
+# @param on_result function(entry, result) called in the calling thread as soon as each document is finished, in the
+#        order of completion. result is a dict with keys "extract_seconds", "call_seconds", "error" (error message or
+#        None), "layout" (name of the layout if converted locally without the model) and the keys of
+#        call_openai_validated() ("response" is None if the document was not sent).
+#
+def convert_documents(client, system_prompt, schema, entries, on_result):
+    rate_limiter = RateLimiter(PIPELINE_REQUESTS_PER_MINUTE)
+    terms = pagefilter.create_terms(schema.field_names()) if PAGE_FILTER else None
+    layouts = layoutextractor.LayoutExtractor.load(LAYOUT_FILE, schema) if LAYOUT_FILE and os.path.exists(LAYOUT_FILE) else None
+    max_in_progress = PIPELINE_MAX_CONCURRENT_CALLS * 2
+    entries = iter(entries)
+    pending = {} # future => (entry, result)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=PIPELINE_EXTRACT_WORKERS, mp_context=pdfextract.get_mp_context(), initializer=pdfextract.pool_initializer) as extract_pool, concurrent.futures.ThreadPoolExecutor(max_workers=PIPELINE_MAX_CONCURRENT_CALLS) as call_pool:
+        while True:
+            while len(pending) < max_in_progress:
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                pending[extract_pool.submit(extract_worker, entry[-1], terms, layouts)] = (entry, {"extract_seconds": None, "call_seconds": None, "response": None, "result": None,
+                                                                                            "validation_errors": [], "reasks": 0, "usage": None, "layout": None, "error": None})
+            if not pending:
+                break
+            done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                entry, result = pending.pop(future)
+                try:
+                    if result["extract_seconds"] is None: # extraction finished, start the call
+                        text, converted, result["extract_seconds"], result["error"] = future.result()
+                        if converted is not None:
+                            result["layout"], result["result"] = converted
+                        elif text is not None:
+                            pending[call_pool.submit(call_worker, client, system_prompt, text, schema, rate_limiter)] = (entry, result)
+                            continue
+                    else:
+                        called, result["call_seconds"] = future.result()
+                        result.update(called)
+                except Exception as e:
+                    result["error"] = str(e)
+                on_result(entry, result)
+
 def diff_text(text1, text2):
     d = difflib.Differ()
     return d.compare(text1.splitlines(), text2.splitlines())
 
 def run_tests(client, data):
-    system_prompt = create_system_prompt(JSON_TEMPLATE)
+    schema = templateschema.TemplateSchema.load(JSON_TEMPLATE)
+    system_prompt = create_system_prompt(schema)
 
     print("Starting to call endpoint...")
     start_time = time.time()
 
-    for json, pdf in data:
-        extract_start_time = time.time()
-        text = extract_text_from_pdf(pdf)
-        extract_end_time = time.time()
-        #print(text) # print the raw text output (converted from pdf)
-        openai_start_time = time.time()
-        response = call_openai(client, system_prompt, text)
-        result = response.choices[0].message.content
-        openai_end_time = time.time()
+    def print_diff(entry, converted):
+        target, pdf = entry
         print('\n\n##############################################')
-        print(f"PDF extract finished in {extract_end_time - extract_start_time} seconds. Call finished in {openai_end_time - openai_start_time} seconds, reason: {response.choices[0].finish_reason}, choices: {len(response.choices)}")
-        print("Diff for file: "+json+" / "+pdf)
-        with open(json, 'r') as file:
+        if converted["error"] is not None:
+            print(f"Conversion failed for file: {pdf}: {converted['error']}")
+            return
+        if converted["layout"] is not None:
+            print(f"Converted locally with layout {converted['layout']} in {converted['extract_seconds']} seconds.")
+            result = json.dumps(converted["result"], indent=2, ensure_ascii=False)
+        else:
+            response = converted["response"]
+            result = response.choices[0].message.content
+            print(f"PDF extract finished in {converted['extract_seconds']} seconds. Call finished in {converted['call_seconds']} seconds, reason: {response.choices[0].finish_reason}, choices: {len(response.choices)}, re-asks: {converted['reasks']}")
+            print(f"Tokens: {converted['usage']}")
+            if converted["validation_errors"]:
+                print("Response does not match the template:\n" + "\n".join(converted["validation_errors"]))
+        print("Diff for file: "+target+" / "+pdf)
+        with open(target, 'r') as file:
             diff = diff_text(file.read(), result)
             print('\n'.join(diff))
 
+    convert_documents(client, system_prompt, schema, data, print_diff) # the diffs are printed in the order the documents finish
+
     end_time = time.time()
     print(f"Calls finished in {end_time - start_time} seconds.")
 
-def create_azure_client():
+# load the checkpoint of the completed documents
+#
+# @return dict of source pdf path => [size, mtime_ns] of the file when it was converted
+#
+def load_checkpoint(checkpoint_path):
+    completed = {}
+    try:
+        with open(checkpoint_path, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    completed[entry["source"]] = entry["key"]
+                except (ValueError, KeyError, TypeError):
+                    pass # a line left incomplete by a crash, the document is converted again
+    except FileNotFoundError:
+        pass
+    return completed
+
+def get_file_key(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# create the JSONL record of a converted document
+#
+def create_record(entry, converted):
+    record = {
+        "source": entry[-1],
+        "target": entry[0] if len(entry) > 1 else None,
+        "result": converted["result"],
+        "layout": converted["layout"],
+        "error": converted["error"],
+        "extract_seconds": converted["extract_seconds"],
+        "call_seconds": converted["call_seconds"],
+        "finish_reason": None,
+        "usage": converted["usage"],
+        "reasks": converted["reasks"],
+        "validation_errors": converted["validation_errors"],
+        "model": None
+    }
+    response = converted["response"]
+    if response is not None:
+        choice = response.choices[0]
+        record["finish_reason"] = choice.finish_reason
+        record["model"] = response.model
+        if record["result"] is None:
+            record["raw_result"] = choice.message.content
+        if choice.finish_reason != "stop" and record["error"] is None:
+            record["error"] = f"Call finished with reason: {choice.finish_reason}"
+        elif converted["validation_errors"] and record["error"] is None:
+            record["error"] = f"Response does not match the template: {'; '.join(converted['validation_errors'])}"
+    return record
+
+# start the conversion from the beginning: the checkpoint is removed and the earlier results are moved aside to
+# OUTPUT.TIMESTAMP, so that the documents converted again are not listed twice in the output
+#
+def restart_conversion(output_path, checkpoint_path):
+    if os.path.exists(output_path):
+        previous_path = f"{output_path}.{time.strftime('%Y%m%d%H%M%S')}"
+        os.replace(output_path, previous_path)
+        print(f"Earlier results moved to {previous_path}")
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+# convert the documents and write the results into a JSONL file
+#
+# Each result is written as soon as the document is finished. Successfully converted documents are listed in the
+# checkpoint file, and skipped when the conversion is run again unless the pdf has changed. Failed documents are
+# written to the output with the error, and tried again on the next run. A document tried again is written again, the
+# last record of a source is the current one.
+#
+# @param client the client to use
+# @param data list of (target json path, source pdf path) or (source pdf path,), see read_data_file()
+# @param output_path the JSONL file, new results are appended
+# @param checkpoint_path the checkpoint file
+#
+def run_conversion(client, data, output_path=OUTPUT_FILE, checkpoint_path=CHECKPOINT_FILE):
+    schema = templateschema.TemplateSchema.load(JSON_TEMPLATE)
+    system_prompt = create_system_prompt(schema)
+    completed = load_checkpoint(checkpoint_path)
+    entries = []
+    keys = {} # source pdf path => key of the file when the conversion started, a file changed during the conversion is converted again on the next run
+    for entry in data:
+        try:
+            keys[entry[-1]] = get_file_key(entry[-1])
+            if completed.get(entry[-1]) != keys[entry[-1]]:
+                entries.append(entry)
+        except OSError as e:
+            print(f"Skipping {entry[-1]}: {e}")
+    print(f"Converting {len(entries)} documents, {len(data) - len(entries)} skipped (already converted or missing).")
+
+    start_time = time.time()
+    counts = {"converted": 0, "failed": 0, "local": 0, "reasks": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    with open(output_path, 'a') as output, open(checkpoint_path, 'a') as checkpoint:
+        def write_result(entry, converted):
+            record = create_record(entry, converted)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            counts["reasks"] += record["reasks"]
+            counts["local"] += record["layout"] is not None
+            if record["usage"] is not None:
+                counts["prompt_tokens"] += record["usage"]["prompt_tokens"]
+                counts["cached_tokens"] += record["usage"]["cached_tokens"]
+            if record["error"] is not None:
+                counts["failed"] += 1
+                print(f"Failed: {entry[-1]}: {record['error']}")
+            else:
+                os.fsync(output.fileno()) # the result must be on disk before the document is marked completed
+                checkpoint.write(json.dumps({"source": entry[-1], "key": keys[entry[-1]]}) + "\n")
+                checkpoint.flush()
+                counts["converted"] += 1
+            done = counts["converted"] + counts["failed"]
+            if done % 10 == 0 or done == len(entries):
+                print(f"{done}/{len(entries)} documents processed in {time.time() - start_time} seconds, {counts['failed']} failed.")
+
+        convert_documents(client, system_prompt, schema, entries, write_result)
+
+    print(f"Conversion finished in {time.time() - start_time} seconds: {counts['converted']} converted ({counts['local']} locally with layouts), {counts['failed']} failed, {counts['reasks']} re-asks, {counts['prompt_tokens']} prompt tokens ({counts['cached_tokens']} cached). Results in {output_path}.")
+
+def create_azure_client(azure_endpoint=AZURE_ENDPOINT, api_key=AZURE_API_KEY):
     client = AzureOpenAI(
-        api_key=AZURE_API_KEY,
+        api_key=api_key,
         api_version=AZURE_API_VERSION,
-        azure_endpoint=AZURE_ENDPOINT
+        azure_endpoint=azure_endpoint,
+        http_client=create_cassette_http_client(),
+        max_retries=0 # the calls are retried by call_openai_with_retry(), through the rate limiter
     )
     return client
 
 def create_openai_client():
     client = OpenAI(
-        api_key=OPENAI_API_KEY
+        api_key=OPENAI_API_KEY,
+        http_client=create_cassette_http_client(),
+        max_retries=0 # the calls are retried by call_openai_with_retry(), through the rate limiter
     )
     return client
 
+def create_client():
+    backend = os.environ.get("OPENAI_CLIENT_BACKEND", OPENAI_CLIENT_BACKEND)
+    if backend == "openai":
+        return create_openai_client()
+    elif backend == "mock":
+        return create_azure_client(os.environ.get("OPENAI_MOCK_ENDPOINT", OPENAI_MOCK_ENDPOINT), "mock")
+    return create_azure_client()
+
+def create_cassette_http_client():
+    mode = os.environ.get("OPENAI_CASSETTE_MODE", OPENAI_CASSETTE_MODE)
+    if not mode:
+        return None
+    if MOCK_SERVER_DIRECTORY not in sys.path:
+        sys.path.append(MOCK_SERVER_DIRECTORY)
+    import replaytransport
+    return replaytransport.create_http_client(mode, os.environ.get("OPENAI_CASSETTE_FILE", OPENAI_CASSETTE_FILE))
+
 def main():
-    data = read_data_file(DATA_FILE)
-    client = create_azure_client() # comment out to use Azure's OpenAI service
-    #client = create_openai_client() # comment out to use OpenAI service
-    run_tests(client, data)
+    parser = argparse.ArgumentParser(description="Convert PDF files to JSON using a template.")
+    parser.add_argument("mode", nargs="?", choices=["test", "convert"], default="test", help="test: print diffs against the target JSON files (default), convert: write the results into a JSONL file")
+    parser.add_argument("--data", default=DATA_FILE, help="the list of files to convert")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="convert mode: the JSONL file the results are appended to")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="convert mode: the list of completed documents, which are skipped")
+    parser.add_argument("--restart", action="store_true", help="convert mode: convert all documents again, the earlier results are moved to OUTPUT.TIMESTAMP")
+    args = parser.parse_args()
+
+    data = read_data_file(args.data)
+    client = create_client() # select the service with OPENAI_CLIENT_BACKEND
+    if args.mode == "convert":
+        if args.restart:
+            restart_conversion(args.output, args.checkpoint)
+        run_conversion(client, data, args.output, args.checkpoint)
+    else:
+        run_tests(client, data)
 
 if __name__ == "__main__":
     main()
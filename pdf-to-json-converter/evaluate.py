@@ -0,0 +1,244 @@
+# Evaluation of the accuracy, latency and token usage of the converter on the documents listed in the data file.
+#
+# Each document is converted with the same pipeline as converter.py (layouts, page filter, validation and re-asks) and
+# the result is compared to the target JSON:
+#  - fields: exact match (case and whitespace ignored) and fuzzy similarity (0..1) of each field
+#  - items: the converted items are aligned with the target items by their similarity, and the fields of the items are
+#    scored over the target items (a missing item scores 0), together with the precision and recall of the items
+#  - latency: percentiles of the extraction, API call and total time per document
+#  - tokens: prompt, completion and cached tokens per document, and the number of re-asks
+# Failed documents score 0 for all fields.
+#
+# Usage:
+#   python3 evaluate.py [--data data/data.txt] [--report evaluation.json]
+#   python3 evaluate.py --mock --latency 0.5        (against a local mock server, no API keys needed)
+#
+# The client is selected as in converter.py (OPENAI_CLIENT_BACKEND, OPENAI_CASSETTE_MODE). The mock server answers with
+# an empty JSON object, so it is useful for measuring the pipeline, but not the accuracy. For comparing accuracy
+# without API costs, record the calls once with OPENAI_CASSETTE_MODE=record and replay them.
+#
+import argparse
+import difflib
+import json
+import math
+import sys
+import time
+import converter
+import templateschema
+
+ITEM_MIN_SIMILARITY = 0.5 # a converted item is aligned with a target item only if their similarity is at least this
+PERCENTILES = (50, 90, 95, 99)
+
+
+def normalize_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+#
+# @return tuple of (1 if the values are equal ignoring case and whitespace else 0, similarity 0..1)
+#
+def compare_values(target, predicted):
+    target, predicted = normalize_value(target), normalize_value(predicted)
+    if target == predicted:
+        return 1, 1.0
+    return 0, difflib.SequenceMatcher(None, target, predicted).ratio()
+
+def item_similarity(target, predicted, fields):
+    if not fields:
+        return 0.0
+    return sum(compare_values(target.get(field), predicted.get(field))[1] for field in fields) / len(fields)
+
+#
+# Aligns the converted items with the target items, the most similar pairs first
+#
+# @return list of (target index, predicted index) pairs
+#
+def align_items(target_items, predicted_items, fields):
+    pairs = sorted(((item_similarity(target, predicted, fields), t, p) for t, target in enumerate(target_items)
+                    for p, predicted in enumerate(predicted_items)), reverse=True)
+    aligned = []
+    used_targets, used_predicted = set(), set()
+    for similarity, t, p in pairs:
+        if similarity < ITEM_MIN_SIMILARITY:
+            break
+        if t not in used_targets and p not in used_predicted:
+            aligned.append((t, p))
+            used_targets.add(t)
+            used_predicted.add(p)
+    return sorted(aligned)
+
+#
+# @param predicted the converted JSON, None if the conversion failed
+# @return dict with the scores of the fields ("fields") and the lists ("lists")
+#
+def evaluate_document(template, target, predicted):
+    scores = {"fields": {}, "lists": {}}
+    for name, field_template in template.items():
+        target_value = target.get(name) if isinstance(target, dict) else None
+        predicted_value = predicted.get(name) if isinstance(predicted, dict) else None
+        if isinstance(field_template, list) and field_template and isinstance(field_template[0], dict):
+            fields = list(field_template[0])
+            target_items = [item for item in target_value or [] if isinstance(item, dict)]
+            predicted_items = [item for item in predicted_value or [] if isinstance(item, dict)] if predicted is not None else []
+            aligned = align_items(target_items, predicted_items, fields)
+            field_scores = {field: {"exact": 0, "fuzzy": 0.0} for field in fields}
+            for t, p in aligned:
+                for field in fields:
+                    exact, fuzzy = compare_values(target_items[t].get(field), predicted_items[p].get(field))
+                    field_scores[field]["exact"] += exact
+                    field_scores[field]["fuzzy"] += fuzzy
+            scores["lists"][name] = {"target": len(target_items), "predicted": len(predicted_items), "aligned": len(aligned), "fields": field_scores}
+        elif predicted is None:
+            scores["fields"][name] = {"exact": 0, "fuzzy": 0.0}
+        else:
+            exact, fuzzy = compare_values(target_value, predicted_value)
+            scores["fields"][name] = {"exact": exact, "fuzzy": fuzzy}
+    return scores
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(math.ceil(p / 100 * len(values))) - 1))
+    return values[index]
+
+def summarize_times(values):
+    summary = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = max(values) if values else None
+    return summary
+
+#
+# @param documents list of the per document results, see evaluate()
+# @return the summary of the evaluation
+#
+def summarize(documents, elapsed):
+    count = len(documents)
+    fields = {}
+    lists = {}
+    for document in documents:
+        for name, score in document["scores"]["fields"].items():
+            total = fields.setdefault(name, {"exact": 0, "fuzzy": 0.0})
+            total["exact"] += score["exact"]
+            total["fuzzy"] += score["fuzzy"]
+        for name, score in document["scores"]["lists"].items():
+            total = lists.setdefault(name, {"target": 0, "predicted": 0, "aligned": 0, "fields": {}})
+            for key in ("target", "predicted", "aligned"):
+                total[key] += score[key]
+            for field, field_score in score["fields"].items():
+                field_total = total["fields"].setdefault(field, {"exact": 0, "fuzzy": 0.0})
+                field_total["exact"] += field_score["exact"]
+                field_total["fuzzy"] += field_score["fuzzy"]
+    for total in fields.values():
+        total["exact"] /= count
+        total["fuzzy"] /= count
+    for total in lists.values():
+        total["precision"] = total["aligned"] / total["predicted"] if total["predicted"] else None
+        total["recall"] = total["aligned"] / total["target"] if total["target"] else None
+        for field_total in total["fields"].values():
+            field_total["exact"] = field_total["exact"] / total["target"] if total["target"] else None
+            field_total["fuzzy"] = field_total["fuzzy"] / total["target"] if total["target"] else None
+
+    converted = [document for document in documents if document["error"] is None]
+    usages = [document["usage"] for document in documents if document["usage"] is not None]
+    tokens = {key: sum(usage[key] for usage in usages) for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens")}
+    tokens.update({f"{key}_per_document": value / len(usages) for key, value in list(tokens.items())} if usages else {})
+    return {
+        "documents": count,
+        "converted": len(converted),
+        "failed": count - len(converted),
+        "converted_locally": sum(1 for document in documents if document["layout"] is not None),
+        "reasks": sum(document["reasks"] for document in documents),
+        "elapsed_seconds": elapsed,
+        "documents_per_minute": count / elapsed * 60 if elapsed > 0 else None,
+        "fields": fields,
+        "lists": lists,
+        "latency": {
+            "extract_seconds": summarize_times([d["extract_seconds"] for d in documents if d["extract_seconds"] is not None]),
+            "call_seconds": summarize_times([d["call_seconds"] for d in documents if d["call_seconds"] is not None]),
+            "total_seconds": summarize_times([(d["extract_seconds"] or 0) + (d["call_seconds"] or 0) for d in documents])
+        },
+        "tokens": tokens
+    }
+
+#
+# Converts the documents and compares the results to the targets
+#
+# @param data list of (target json path, source pdf path), see converter.read_data_file()
+# @return tuple of (summary, list of the per document results)
+#
+def evaluate(client, data):
+    schema = templateschema.TemplateSchema.load(converter.JSON_TEMPLATE)
+    system_prompt = converter.create_system_prompt(schema)
+    documents = []
+
+    def add_result(entry, converted):
+        record = converter.create_record(entry, converted)
+        with open(entry[0], 'r') as file:
+            target = json.load(file)
+        predicted = record["result"] if record["error"] is None else None
+        document = {key: record[key] for key in ("source", "target", "error", "layout", "extract_seconds", "call_seconds", "usage", "reasks", "validation_errors")}
+        document["scores"] = evaluate_document(schema.template, target, predicted)
+        documents.append(document)
+        print(f"{len(documents)}/{len(data)} {entry[-1]}: {'failed: ' + record['error'] if record['error'] else 'converted'}")
+
+    start_time = time.time()
+    converter.convert_documents(client, system_prompt, schema, data, add_result)
+    return summarize(documents, time.time() - start_time), documents
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+def print_summary(summary):
+    print(f"\n{summary['documents']} documents, {summary['converted']} converted ({summary['converted_locally']} locally with layouts), {summary['failed']} failed, "
+          f"{summary['reasks']} re-asks, {format_value(summary['elapsed_seconds'])} seconds ({format_value(summary['documents_per_minute'])} documents/minute)")
+    print(f"\n{'field':32} {'exact':>8} {'fuzzy':>8}")
+    for name, score in summary["fields"].items():
+        print(f"{name:32} {format_value(score['exact']):>8} {format_value(score['fuzzy']):>8}")
+    for name, total in summary["lists"].items():
+        print(f"\n{name}: {total['target']} target, {total['predicted']} converted, {total['aligned']} aligned, precision {format_value(total['precision'])}, recall {format_value(total['recall'])}")
+        for field, score in total["fields"].items():
+            print(f"{name + '.' + field:32} {format_value(score['exact']):>8} {format_value(score['fuzzy']):>8}")
+    print(f"\n{'latency (s)':32} " + " ".join(f"{key:>8}" for key in summary["latency"]["total_seconds"]))
+    for name, times in summary["latency"].items():
+        print(f"{name:32} " + " ".join(f"{format_value(value):>8}" for value in times.values()))
+    print("\ntokens: " + ", ".join(f"{key} {format_value(value)}" for key, value in summary["tokens"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the accuracy, latency and token usage of the converter.")
+    parser.add_argument("--data", default=converter.DATA_FILE, help="the list of target JSON and source PDF files")
+    parser.add_argument("--report", default=None, help="write the summary and the per document results as JSON to this file")
+    parser.add_argument("--mock", action="store_true", help="start a local mock server and use it instead of the configured service")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock server latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock server random extra latency, in seconds")
+    args = parser.parse_args()
+
+    data = [entry for entry in converter.read_data_file(args.data) if len(entry) >= 2]
+    if not data:
+        print(f"No target JSON and source PDF pairs in {args.data}.")
+        return
+    if args.mock:
+        sys.path.append(converter.MOCK_SERVER_DIRECTORY)
+        import mockserver
+        mock = mockserver.MockOpenAIServer("127.0.0.1", 0, mockserver.MockConfig(args.latency, args.jitter)).start()
+        print(f"Started mock OpenAI server at {mock.url}")
+        client = converter.create_azure_client(mock.url, "mock")
+    else:
+        client = converter.create_client()
+
+    summary, documents = evaluate(client, data)
+    print_summary(summary)
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({"summary": summary, "documents": documents}, file, indent=2, ensure_ascii=False)
+        print(f"\nReport written to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# Converts documents with a known layout into JSON locally with rules, without calling the model.
+#
+# Requires PyMuPDF (pip install pymupdf), documents are always sent to the model if it is not installed.
+#
+# The layouts are defined in a JSON file (see layouts.json), a list of objects with the keys:
+#  - name: name of the layout, written into the results
+#  - labels: the fingerprint of the layout, the fixed texts of the first page (e.g. "order number", "delivery address").
+#    A document has the layout if at least LAYOUT_MIN_SIMILARITY of the labels start a line on its first page (case and
+#    whitespace are ignored). The candidate labels of a sample document can be printed with:
+#    python3 layoutextractor.py labels sample.pdf
+#  - fields: field name of the template => rule, the fields without a rule are null. A rule is one of:
+#     - {"pattern": regular expression}: the first group (or the whole match) of the first match in the text of the
+#       document, the lines of the text blocks are separated by newlines
+#     - {"anchor": label, "position": "right" or "below"}: the text after the label on the same line, or if there is
+#       none, the first line of the nearest text block to the right of (or below) the label
+#     - {"rows": regular expression with named groups, "start": regular expression, "end": regular expression}: a list,
+#       each line between the start and end lines (the whole text if not given) matching the expression is an item, and
+#       the named groups are the fields of the item
+#    and can also have "format": regular expression the value must match, and "optional": true if the field can be missing.
+#
+# If a field which is not optional is not found or does not match its format, or the result does not match the
+# template, the document is sent to the model instead.
+#
+# Test the layouts with: python3 layoutextractor.py test document.pdf
+#
+import argparse
+import json
+import os
+import re
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pdf-text-extractor'))
+import pdfextract
+import templateschema
+
+LAYOUT_MIN_SIMILARITY = 0.8 # fraction of the labels of a layout which must be found on the first page of a document
+LABEL_MAX_LENGTH = 60 # longer lines are not used as labels
+LABEL_PATTERN = re.compile(r'^[^\W\d_][^\d]{2,}$') # labels are lines without digits, starting with a letter
+
+
+class LayoutExtractor:
+    #
+    # @param layouts the parsed layouts file
+    # @param schema the template, see templateschema.TemplateSchema
+    #
+    def __init__(self, layouts, schema):
+        self.layouts = [compile_layout(layout) for layout in layouts]
+        self.schema = schema
+
+    @classmethod
+    def load(cls, layout_path, schema):
+        with open(layout_path, 'r') as file:
+            return cls(json.load(file), schema)
+
+    #
+    # @param pages the text blocks of the pages, see pdfextract.extract_blocks(), only the first page is used
+    # @return tuple of (the best matching layout or None, its similarity)
+    #
+    def match(self, pages):
+        lines = [normalize(line) for block in pages[0] for line in block[4].splitlines()] if pages else []
+        best, best_similarity = None, 0.0
+        for layout in self.layouts:
+            found = sum(1 for label in layout["labels"] if any(line.startswith(label) for line in lines))
+            similarity = found / len(layout["labels"]) if layout["labels"] else 0.0
+            if similarity > best_similarity:
+                best, best_similarity = layout, similarity
+        if best_similarity < LAYOUT_MIN_SIMILARITY:
+            return None, best_similarity
+        return best, best_similarity
+
+    #
+    # @return tuple of (layout name, result) if the document has a known layout and all the fields were found, otherwise None
+    #
+    def extract(self, pdf_path):
+        try:
+            layout, similarity = self.match(pdfextract.extract_blocks(pdf_path, max_pages=1)) # the other pages are read only for a known layout
+            if layout is None:
+                return None
+            pages = pdfextract.extract_blocks(pdf_path)
+        except pdfextract.PdfExtractionError:
+            return None
+        result, errors = self.apply(layout, pages)
+        return (layout["name"], result) if not errors else None
+
+    #
+    # @return tuple of (result, list of the fields which were not found or did not match their format)
+    #
+    def apply(self, layout, pages):
+        text = "\n".join(block[4].strip() for blocks in pages for block in blocks)
+        result = create_empty_result(self.schema.template)
+        errors = []
+        for name, rule in layout["fields"].items():
+            if "rows" in rule:
+                item = self.schema.template.get(name)
+                value = find_rows(rule, text, item[0] if isinstance(item, list) and item and isinstance(item[0], dict) else {}) or None
+            elif "anchor" in rule:
+                value = find_anchor(rule, pages)
+            else:
+                match = rule["pattern"].search(text)
+                value = (match.group(1) if match.groups() else match.group()).strip() if match else None
+            if value is None or (rule["format"] is not None and not isinstance(value, list) and not rule["format"].fullmatch(value)):
+                if not rule["optional"]:
+                    errors.append(name)
+                value = None
+            result[name] = value
+        errors.extend(self.schema.validate(result))
+        return result, errors
+
+
+def compile_layout(layout):
+    fields = {}
+    for name, rule in layout.get("fields", {}).items():
+        compiled = {"optional": rule.get("optional", False), "format": re.compile(rule["format"]) if rule.get("format") else None}
+        if "rows" in rule:
+            compiled["rows"] = re.compile(rule["rows"])
+            compiled["start"] = re.compile(rule["start"], re.MULTILINE) if rule.get("start") else None
+            compiled["end"] = re.compile(rule["end"], re.MULTILINE) if rule.get("end") else None
+        elif "anchor" in rule:
+            compiled["anchor"] = normalize(rule["anchor"])
+            compiled["position"] = rule.get("position", "right")
+        else:
+            compiled["pattern"] = re.compile(rule["pattern"], re.MULTILINE)
+        fields[name] = compiled
+    return {"name": layout["name"], "labels": {normalize(label) for label in layout.get("labels", [])}, "fields": fields}
+
+#
+# @return the template with all the values replaced with null, and the lists with empty lists
+#
+def create_empty_result(template):
+    return {name: [] if isinstance(value, list) else None for name, value in template.items()}
+
+def normalize(text):
+    return " ".join(text.lower().split()).rstrip(":")
+
+#
+# @param blocks the text blocks of a page
+# @return set of the normalized lines of the blocks which can be fixed texts of the layout (lines without digits)
+#
+def get_labels(blocks):
+    labels = set()
+    for block in blocks:
+        for line in block[4].splitlines():
+            label = normalize(line)
+            if len(label) <= LABEL_MAX_LENGTH and LABEL_PATTERN.match(label):
+                labels.add(label)
+    return labels
+
+#
+# @param item_template the template of the items, the fields of the template not in the expression are null
+# @return list of the items
+#
+def find_rows(rule, text, item_template):
+    start = rule["start"].search(text) if rule["start"] else None
+    text = text[start.end():] if start else text
+    end = rule["end"].search(text) if rule["end"] else None
+    text = text[:end.start()] if end else text
+    rows = []
+    for line in text.splitlines():
+        match = rule["rows"].fullmatch(line.strip())
+        if match:
+            row = dict.fromkeys(item_template)
+            row.update((name, value.strip() if value is not None else None) for name, value in match.groupdict().items())
+            rows.append(row)
+    return rows
+
+#
+# @return the value next to the anchor label, or None if the label is not found
+#
+def find_anchor(rule, pages):
+    anchor = rule["anchor"]
+    for blocks in pages:
+        for block in blocks:
+            lines = block[4].splitlines()
+            for index, line in enumerate(lines):
+                if not normalize(line).startswith(anchor):
+                    continue
+                rest = " ".join(line.split())[len(anchor):].lstrip(": ").strip() # anchor is normalized, so it is as long as the normalized line prefix
+                if rest:
+                    return rest
+                if rule["position"] == "below" and index + 1 < len(lines) and lines[index + 1].strip():
+                    return lines[index + 1].strip()
+                neighbour = find_neighbour(block, blocks, rule["position"])
+                if neighbour is not None:
+                    return neighbour[4].strip().splitlines()[0].strip()
+                return None
+    return None
+
+#
+# @return the nearest text block to the right of (on the same line) or below (in the same column) the block, or None
+#
+def find_neighbour(block, blocks, position):
+    x0, y0, x1, y1 = block[:4]
+    best = None
+    for other in blocks:
+        if other is block or not other[4].strip():
+            continue
+        if position == "below":
+            if other[1] >= y1 - 1 and other[0] < x1 and other[2] > x0 and (best is None or other[1] < best[1]):
+                best = other
+        elif other[0] >= x1 - 1 and other[1] < y1 and other[3] > y0 and (best is None or other[0] < best[0]):
+            best = other
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and test the layouts used for converting documents without the model.")
+    parser.add_argument("command", choices=["labels", "test"], help="labels: print the labels of the first page for creating a layout, test: print the matching layout and the result")
+    parser.add_argument("pdf", help="the PDF file")
+    parser.add_argument("--layouts", default="layouts.json", help="the layouts file")
+    parser.add_argument("--template", default="template.json", help="the JSON template")
+    args = parser.parse_args()
+
+    pages = pdfextract.extract_blocks(args.pdf, max_pages=1 if args.command == "labels" else None)
+    if args.command == "labels":
+        print(json.dumps(sorted(get_labels(pages[0]) if pages else []), indent=2, ensure_ascii=False))
+        return
+    extractor = LayoutExtractor.load(args.layouts, templateschema.TemplateSchema.load(args.template))
+    layout, similarity = extractor.match(pages)
+    if layout is None:
+        print(f"No matching layout, best similarity {similarity:.2f}.")
+        return
+    result, errors = extractor.apply(layout, pages)
+    print(f"Layout: {layout['name']}, similarity {similarity:.2f}")
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if errors:
+        print("Not converted locally, fields not found or invalid: " + ", ".join(errors))
+
+if __name__ == "__main__":
+    main()
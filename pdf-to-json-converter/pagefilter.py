@@ -0,0 +1,101 @@
+# Removes the parts of the extracted PDF text which are not needed for filling the template, before the text is sent to
+# the model.
+#
+# Requires only the Python standard library.
+#
+#  - repeated headers and footers: lines at the top or bottom of the pages which repeat on most pages (ignoring the page
+#    number and the number of pages, so "Page 1/3" and "Page 2/3" are the same line) are kept only on the first page
+#    where they appear
+#  - irrelevant pages: pages of running text with few numbers and few words of the template's field names (e.g. terms
+#    and conditions) are dropped. The first page, and pages with many numbers (item tables, addresses and dates), are
+#    always kept.
+#
+import math
+import re
+
+HEADER_LINES = 5 # number of lines at the top and at the bottom of each page which can be headers or footers
+HEADER_MIN_PAGE_FRACTION = 0.5 # a line is a header or footer if it repeats on at least this fraction of the pages (and on at least 2 pages)
+PAGE_MIN_NUMBER_FRACTION = 0.1 # pages where at least this fraction of the words contain digits are kept
+PAGE_MIN_RELATIVE_SCORE = 0.5 # other pages are kept if their density of field name words is at least this fraction of the best page's
+EXTRA_TERMS = [] # words counted as field name words in addition to the words of the template, e.g. the field names in the language of the documents
+STOP_WORDS = {"and", "for", "not", "one", "per", "the", "with"}
+WORD_PATTERN = re.compile(r'\w+')
+CAMEL_CASE_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
+#
+# @param field_names the field names of the template, see templateschema.TemplateSchema.field_names()
+# @return list of the lowercase words of the field names (e.g. "deliveryAddress" => "delivery", "address") and EXTRA_TERMS
+#
+def create_terms(field_names):
+    terms = []
+    for name in field_names:
+        for word in CAMEL_CASE_PATTERN.findall(name):
+            word = word.lower()
+            if len(word) >= 3 and word not in STOP_WORDS and not word.isdigit() and word not in terms:
+                terms.append(word)
+    terms.extend(term.lower() for term in EXTRA_TERMS if term.lower() not in terms)
+    return terms
+
+#
+# @param pages list of the page texts, see pdfextract.extract_pages()
+# @param terms the field name words, see create_terms()
+# @return list of the relevant pages, with the repeated headers and footers removed
+#
+def filter_pages(pages, terms):
+    pages = remove_repeated_lines(pages)
+    if len(pages) <= 1:
+        return pages
+    scores = [score_page(page, terms) for page in pages]
+    best_density = max(term_density for number_fraction, term_density in scores)
+    return [page for index, (page, (number_fraction, term_density)) in enumerate(zip(pages, scores))
+            if index == 0 or number_fraction >= PAGE_MIN_NUMBER_FRACTION or term_density >= PAGE_MIN_RELATIVE_SCORE * best_density]
+
+#
+# @return tuple of (fraction of the words containing digits, fraction of the words starting with a field name word)
+#
+def score_page(page, terms):
+    words = WORD_PATTERN.findall(page.lower())
+    if not words:
+        return 0.0, 0.0
+    prefixes = tuple(terms)
+    numbers = sum(1 for word in words if any(c.isdigit() for c in word))
+    term_words = sum(1 for word in words if word.startswith(prefixes)) if prefixes else 0
+    return numbers / len(words), term_words / len(words)
+
+#
+# @return the pages with the repeated header and footer lines removed from all but the first page containing them
+#
+def remove_repeated_lines(pages):
+    if len(pages) < 2:
+        return pages
+    page_lines = [[line for line in page.splitlines() if line.strip()] for page in pages]
+    counts = {}
+    for page_num, lines in enumerate(page_lines, 1):
+        for key in {line_key(line, page_num, len(pages)) for line in lines[:HEADER_LINES] + lines[-HEADER_LINES:]}:
+            counts[key] = counts.get(key, 0) + 1
+    min_pages = max(2, math.ceil(HEADER_MIN_PAGE_FRACTION * len(pages)))
+    repeated = {key for key, count in counts.items() if count >= min_pages}
+    if not repeated:
+        return pages
+    seen = set()
+    result = []
+    for page_num, lines in enumerate(page_lines, 1):
+        edges = set(range(min(HEADER_LINES, len(lines)))) | set(range(max(0, len(lines) - HEADER_LINES), len(lines)))
+        kept = []
+        for index, line in enumerate(lines):
+            key = line_key(line, page_num, len(pages))
+            if index in edges and key in repeated:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(line)
+        result.append("\n".join(kept))
+    return result
+
+#
+# @return the line in lowercase with the whitespace normalized and the page number and the number of pages replaced with #
+#
+def line_key(line, page_num, page_count):
+    return NUMBER_PATTERN.sub(lambda match: "#" if match.group() in (str(page_num), str(page_count)) else match.group(), " ".join(line.lower().split()))
@@ -0,0 +1,120 @@
+# Schema compiled from the JSON template, used for validating the converted documents locally.
+#
+# Requires only the Python standard library.
+#
+# The template is an example of the output: objects list the required fields, a list contains one example item and the
+# values are descriptions of the fields. The type of a value is the last comma-separated word of its description
+# ("string", "number", "integer" or "boolean"), other descriptions accept any value. All values can also be null,
+# as missing values are replaced with null.
+#
+import json
+
+TYPES = {
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,)
+}
+MAX_ERRORS = 20 # validation stops after this many errors
+
+
+class TemplateSchema:
+    #
+    # @param template the parsed template
+    #
+    def __init__(self, template):
+        self.template = template
+        self.root = compile_node(template)
+
+    @classmethod
+    def load(cls, template_path):
+        with open(template_path, 'r') as file:
+            return cls(json.load(file))
+
+    #
+    # @return the template as compact JSON with the fields in a fixed order, so that the prompt built from it is
+    #         identical for every document
+    #
+    def to_prompt(self):
+        return json.dumps(self.template, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+    #
+    # @return list of the field names of the template, including the fields of the list items, without duplicates
+    #
+    def field_names(self):
+        names = []
+        def collect(node):
+            if node[0] == "object":
+                for name, child in node[1].items():
+                    if name not in names:
+                        names.append(name)
+                    collect(child)
+            elif node[0] == "array":
+                collect(node[1])
+        collect(self.root)
+        return names
+
+    #
+    # @param value the parsed JSON
+    # @return list of error messages, empty if the value matches the template
+    #
+    def validate(self, value):
+        errors = []
+        if not isinstance(value, dict):
+            errors.append(f"$: expected an object, got {type_name(value)}")
+        else:
+            validate_node(self.root, value, "$", errors)
+        return errors[:MAX_ERRORS]
+
+    #
+    # @param content the JSON text returned by the model
+    # @return tuple of (parsed value or None, list of error messages)
+    #
+    def validate_json(self, content):
+        try:
+            value = json.loads(content)
+        except (TypeError, ValueError) as e:
+            return None, [f"Invalid JSON: {e}"]
+        return value, self.validate(value)
+
+
+#
+# @return the node of the template value: ("object", {name: node}), ("array", item node) or ("value", type name or None for any)
+#
+def compile_node(template):
+    if isinstance(template, dict):
+        return "object", {name: compile_node(value) for name, value in template.items()}
+    if isinstance(template, list):
+        return "array", compile_node(template[0]) if template else ("value", None)
+    if isinstance(template, str):
+        value_type = template.split(",")[-1].strip().lower()
+        return "value", value_type if value_type in TYPES else None
+    return "value", None
+
+def validate_node(node, value, path, errors):
+    if len(errors) >= MAX_ERRORS or value is None:
+        return
+    kind, child = node
+    if kind == "object":
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected an object, got {type_name(value)}")
+            return
+        for name in child:
+            if name not in value:
+                errors.append(f"{path}.{name}: missing (use null for missing values)")
+        for name in value:
+            if name not in child:
+                errors.append(f"{path}.{name}: not in the template")
+            else:
+                validate_node(child[name], value[name], f"{path}.{name}", errors)
+    elif kind == "array":
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected a list, got {type_name(value)}")
+            return
+        for index, item in enumerate(value):
+            validate_node(child, item, f"{path}[{index}]", errors)
+    elif child is not None and (not isinstance(value, TYPES[child]) or (isinstance(value, bool) and child != "boolean")):
+        errors.append(f"{path}: expected {child}, got {type_name(value)}")
+
+def type_name(value):
+    return "null" if value is None else type(value).__name__
@@ -0,0 +1,122 @@
+import json
+import os
+import sys
+import types
+import pytest
+pytest.importorskip("openai")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import converter
+import templateschema
+
+SCHEMA = templateschema.TemplateSchema({"orderNumber": "string", "total": "number"})
+
+
+def create_response(content, finish_reason="stop"):
+    usage = types.SimpleNamespace(prompt_tokens=100, completion_tokens=10, total_tokens=110, prompt_tokens_details=types.SimpleNamespace(cached_tokens=50))
+    choice = types.SimpleNamespace(finish_reason=finish_reason, message=types.SimpleNamespace(content=content))
+    return types.SimpleNamespace(choices=[choice], usage=usage, model="test-model")
+
+#
+# Client returning the given answers in order, the messages of each call are recorded in calls
+#
+class FakeClient:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        self.calls.append(messages)
+        return self.answers.pop(0)
+
+
+def test_valid_response_is_not_reasked():
+    client = FakeClient([create_response('{"orderNumber": "A1", "total": 5}')])
+    called = converter.call_openai_validated(client, "system", "document", SCHEMA, converter.RateLimiter(0))
+    assert called["result"] == {"orderNumber": "A1", "total": 5}
+    assert called["validation_errors"] == [] and called["reasks"] == 0
+    assert len(client.calls) == 1
+
+def test_invalid_response_is_reasked_after_the_original_messages(monkeypatch):
+    monkeypatch.setattr(converter, "MAX_REASK", 1)
+    client = FakeClient([create_response('{"orderNumber": 1, "total": 5}'), create_response('{"orderNumber": "1", "total": 5}')])
+    called = converter.call_openai_validated(client, "system", "document", SCHEMA, converter.RateLimiter(0))
+    assert called["result"] == {"orderNumber": "1", "total": 5}
+    assert called["validation_errors"] == [] and called["reasks"] == 1
+    assert called["usage"] == {"prompt_tokens": 200, "completion_tokens": 20, "total_tokens": 220, "cached_tokens": 100}
+    first, second = client.calls
+    assert second[:len(first)] == first # the prompt prefix is the same, so it can be served from the prompt cache
+    assert second[-2] == {"role": "assistant", "content": '{"orderNumber": 1, "total": 5}'}
+    assert "$.orderNumber: expected string, got int" in second[-1]["content"]
+
+def test_reasks_are_limited(monkeypatch):
+    monkeypatch.setattr(converter, "MAX_REASK", 1)
+    client = FakeClient([create_response('{"total": 5}'), create_response('{"total": 6}')])
+    called = converter.call_openai_validated(client, "system", "document", SCHEMA, converter.RateLimiter(0))
+    assert called["reasks"] == 1 and called["validation_errors"] == ["$.orderNumber: missing (use null for missing values)"]
+    assert len(client.calls) == 2
+
+def test_truncated_response_is_not_reasked(monkeypatch):
+    monkeypatch.setattr(converter, "MAX_REASK", 1)
+    client = FakeClient([create_response('{"orderNumber": "A', finish_reason="length")])
+    called = converter.call_openai_validated(client, "system", "document", SCHEMA, converter.RateLimiter(0))
+    assert called["result"] is None and called["reasks"] == 0
+    assert len(client.calls) == 1
+
+#
+# Replaces convert_documents() so that the documents listed in failing fail and the others are converted
+#
+def fake_convert_documents(converted_sources, failing=()):
+    def convert_documents(client, system_prompt, schema, entries, on_result):
+        for entry in entries:
+            converted_sources.append(entry[-1])
+            result = {"extract_seconds": 0.0, "call_seconds": 0.0, "response": None, "result": {"orderNumber": "A1", "total": 1},
+                      "validation_errors": [], "reasks": 0, "usage": None, "layout": "test", "error": None}
+            if entry[-1] in failing:
+                result.update(result=None, layout=None, error="extraction failed")
+            on_result(entry, result)
+    return convert_documents
+
+def read_records(path):
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file]
+
+def test_conversion_is_resumed_from_the_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(converter, "JSON_TEMPLATE", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'template.json'))
+    pdfs = []
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        (tmp_path / name).write_bytes(b"%PDF " + name.encode())
+        pdfs.append(str(tmp_path / name))
+    output, checkpoint = str(tmp_path / "results.jsonl"), str(tmp_path / "results.checkpoint")
+    data = [[pdf] for pdf in pdfs] + [[str(tmp_path / "missing.pdf")]]
+
+    converted = []
+    monkeypatch.setattr(converter, "convert_documents", fake_convert_documents(converted, failing={pdfs[1]}))
+    converter.run_conversion(None, data, output, checkpoint)
+    assert converted == pdfs
+    assert [(record["source"], record["error"]) for record in read_records(output)] == [(pdfs[0], None), (pdfs[1], "extraction failed"), (pdfs[2], None)]
+
+    converted.clear() # the failed document is tried again
+    monkeypatch.setattr(converter, "convert_documents", fake_convert_documents(converted))
+    converter.run_conversion(None, data, output, checkpoint)
+    assert converted == [pdfs[1]]
+
+    converted.clear() # a changed document is converted again
+    (tmp_path / "c.pdf").write_bytes(b"%PDF changed")
+    converter.run_conversion(None, data, output, checkpoint)
+    assert converted == [pdfs[2]]
+    assert [record["source"] for record in read_records(output)] == [pdfs[0], pdfs[1], pdfs[2], pdfs[1], pdfs[2]]
+
+    converted.clear()
+    converter.run_conversion(None, data, output, checkpoint)
+    assert converted == []
+
+    converter.restart_conversion(output, checkpoint)
+    converter.run_conversion(None, data, output, checkpoint)
+    assert converted == pdfs
+    assert [record["source"] for record in read_records(output)] == pdfs
+
+def test_incomplete_checkpoint_line_is_ignored(tmp_path):
+    checkpoint = tmp_path / "results.checkpoint"
+    checkpoint.write_text('{"source": "a.pdf", "key": [1, 2]}\n{"source": "b.pd')
+    assert converter.load_checkpoint(str(checkpoint)) == {"a.pdf": [1, 2]}
@@ -0,0 +1,36 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pagefilter
+
+
+def test_create_terms():
+    assert pagefilter.create_terms(["deliveryAddress", "orderNumber", "items", "sum", "pricePerOne"]) == ["delivery", "address", "order", "number", "items", "sum", "price"]
+
+def test_repeated_headers_and_footers_are_kept_once():
+    pages = [f"ACME Oy\nPurchase order\n{text}\nPage {i}/3" for i, text in enumerate(["apples", "pears", "plums"], 1)]
+    assert pagefilter.remove_repeated_lines(pages) == [
+        "ACME Oy\nPurchase order\napples\nPage 1/3",
+        "pears",
+        "plums"
+    ]
+
+def test_lines_repeating_on_few_pages_are_kept():
+    pages = ["Header\nfirst", "second", "third", "Header\nfourth", "fifth"]
+    assert pagefilter.remove_repeated_lines(pages) == pages
+
+def test_single_page_is_not_changed():
+    assert pagefilter.filter_pages(["only page"], ["order"]) == ["only page"]
+
+def test_irrelevant_pages_are_dropped():
+    first = "Purchase order\nOrder number 123\nDelivery address Street 1"
+    items = "Items\n1 ABC 10 pcs 5,00 50,00\n2 DEF 20 pcs 1,00 20,00"
+    terms_page = " ".join(["these general terms and conditions apply to all deliveries of the seller"] * 10)
+    relevant = " ".join(["the order and the delivery address of this order"] * 10)
+    terms = pagefilter.create_terms(["orderNumber", "deliveryAddress"])
+    assert pagefilter.filter_pages([first, items, terms_page, relevant], terms) == [first, items, relevant]
+
+def test_first_page_is_always_kept():
+    terms = pagefilter.create_terms(["orderNumber"])
+    pages = ["general terms and conditions", "order order order number"]
+    assert pagefilter.filter_pages(pages, terms) == pages
@@ -0,0 +1,61 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import templateschema
+
+TEMPLATE = {
+    "orderNumber": "string",
+    "total": "only amount, number",
+    "paid": "boolean",
+    "items": [{"productCode": "string", "quantity": "integer"}],
+    "notes": "free text"
+}
+
+
+def create_schema():
+    return templateschema.TemplateSchema(TEMPLATE)
+
+def test_valid_result_has_no_errors():
+    result = {"orderNumber": "A1", "total": 12.5, "paid": False, "items": [{"productCode": "X", "quantity": 2}], "notes": 3}
+    assert create_schema().validate(result) == []
+
+def test_null_values_are_accepted():
+    result = {"orderNumber": None, "total": None, "paid": None, "items": None, "notes": None}
+    assert create_schema().validate(result) == []
+
+def test_missing_and_unknown_fields():
+    errors = create_schema().validate({"orderNumber": "A1", "total": 1, "paid": True, "items": [], "extra": 1})
+    assert errors == ["$.notes: missing (use null for missing values)", "$.extra: not in the template"]
+
+def test_wrong_types():
+    result = {"orderNumber": 1, "total": "12", "paid": 1, "items": [{"productCode": "X", "quantity": True}], "notes": None}
+    assert create_schema().validate(result) == [
+        "$.orderNumber: expected string, got int",
+        "$.total: expected number, got str",
+        "$.paid: expected boolean, got int",
+        "$.items[0].quantity: expected integer, got bool"
+    ]
+
+def test_list_and_object_mismatch():
+    assert create_schema().validate({"orderNumber": None, "total": None, "paid": None, "items": {}, "notes": None}) == ["$.items: expected a list, got dict"]
+    assert create_schema().validate([]) == ["$: expected an object, got list"]
+
+def test_errors_are_limited():
+    schema = templateschema.TemplateSchema({"items": [{"quantity": "integer"}]})
+    errors = schema.validate({"items": [{"quantity": "1"}] * (templateschema.MAX_ERRORS + 5)})
+    assert len(errors) == templateschema.MAX_ERRORS
+
+def test_validate_json():
+    schema = create_schema()
+    value, errors = schema.validate_json('{"orderNumber": "A1", "total": 1, "paid": true, "items": [], "notes": null}')
+    assert value["orderNumber"] == "A1" and errors == []
+    value, errors = schema.validate_json('{"orderNumber": ')
+    assert value is None and errors[0].startswith("Invalid JSON")
+
+def test_field_names_include_item_fields_once():
+    schema = templateschema.TemplateSchema({"deliveryDate": "string", "items": [{"deliveryDate": "string", "sum": "string"}]})
+    assert schema.field_names() == ["deliveryDate", "items", "sum"]
+
+def test_prompt_does_not_depend_on_the_key_order():
+    reordered = dict(reversed(list(TEMPLATE.items())))
+    assert templateschema.TemplateSchema(reordered).to_prompt() == create_schema().to_prompt()